@@ -15,8 +15,11 @@ from osm_stop_matcher.GtfsImporter import GtfsStopsImporter
 from osm_stop_matcher.NvbwStopsImporter import NvbwStopsImporter
 from osm_stop_matcher.DelfiStopsImporter import DelfiStopsImporter
 from osm_stop_matcher.StopMatcher import StopMatcher
+from osm_stop_matcher.FeatureExtractor import FeatureExtractor
 from osm_stop_matcher.MatchResultValidator import MatchResultValidator
 from osm_stop_matcher.OsmStopsImporter import OsmStopsImporter
+from osm_stop_matcher.OsmChangeImporter import OsmChangeImporter
+from osm_stop_matcher.RegionScope import RegionScope
         
 import logging
 import os.path
@@ -27,13 +30,23 @@ import datetime
 # pre/succ currently only works for (bus) platforms...
 
 
+def parse_bbox(bbox):
+    coords = [float(coord) for coord in bbox.split(',')]
+    if len(coords) != 4:
+        raise argparse.ArgumentTypeError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    return coords
+
 def retrieve_timestamp(filename):
     return os.path.getmtime(filename)
 
-def load_data(db, osmfile, stops_file, gtfs_file, stopsprovider):
+def load_data(db, osmfile, stops_file, gtfs_file, stopsprovider, osm_change_files = [], scope = None):
     logger = logging.getLogger('compare_stops')
     importer = GtfsStopsImporter(db)
     metadata = {}
+    if scope:
+        # stops and osm stops outside of scope are restored after loading
+        (stop_condition, stop_params) = scope.stop_condition()
+        scope.keep_outside(db, 'haltestellen_unified', stop_condition, stop_params)
     if gtfs_file:
         logger.info("Start importing gtfs " + gtfs_file)
         metadata['gtfs_file'] = gtfs_file
@@ -60,8 +73,20 @@ def load_data(db, osmfile, stops_file, gtfs_file, stopsprovider):
     if osmfile:
         metadata['osm_file'] = osmfile
         metadata['osm_timestamp'] = retrieve_timestamp(osmfile)
+        if scope and scope.bbox:
+            (osm_condition, osm_params) = scope.osm_condition(scope.osm_bounds(db))
+            scope.keep_outside(db, 'osm_stops', osm_condition, osm_params)
         OsmStopsImporter(db, osm_file = osmfile)
         logger.info("Imported osm file")
+        if scope and scope.bbox:
+            scope.restore_outside(db, 'osm_stops', osm_condition, osm_params, 'osm_id')
+            logger.info("Restricted osm stops to scope %s", scope)
+
+    for osm_change_file in osm_change_files:
+        metadata['osm_change_file'] = osm_change_file
+        metadata['osm_change_timestamp'] = retrieve_timestamp(osm_change_file)
+        OsmChangeImporter(db, osm_change_file)
+        logger.info("Applied osm change file %s", osm_change_file)
 
     if stopsprovider == 'GTFS':
         importer.load_haltestellen_unified()
@@ -69,6 +94,9 @@ def load_data(db, osmfile, stops_file, gtfs_file, stopsprovider):
             zhv_importer.patch_haltestellen_unified()
     else:
         zhv_importer.load_haltestellen_unified()
+    if scope:
+        db.execute("DELETE FROM haltestellen_unified WHERE NOT IFNULL(({}), 0)".format(stop_condition), stop_params)
+        logger.info("Restricted haltestellen_unified to scope %s", scope)
         
     importer.update_linien()
     logger.info("Updated route names")
@@ -78,10 +106,14 @@ def load_data(db, osmfile, stops_file, gtfs_file, stopsprovider):
     logger.info("Updated mode")
     importer.update_platform_code()
     logger.info("Updated platform codes") 
+    FeatureExtractor(db).extract_features()
+    logger.info("Extracted matching features")
+    if scope:
+        scope.restore_outside(db, 'haltestellen_unified', stop_condition, stop_params, 'globaleID')
 
     return metadata
 
-def main(osmfile, db_file, stops_file, gtfs_file, stopsprovider, mode, logfile):
+def main(osmfile, db_file, stops_file, gtfs_file, stopsprovider, mode, logfile, osm_change_files = [], incremental = False, scope = None):
     logging.basicConfig(filename=logfile, filemode='w', level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     
     logger = logging.getLogger('compare_stops')
@@ -93,17 +125,26 @@ def main(osmfile, db_file, stops_file, gtfs_file, stopsprovider, mode, logfile):
     metadata = {}
 
     if mode == 'all':
-        metadata = load_data(db, osmfile, stops_file, gtfs_file, stopsprovider)
+        metadata = load_data(db, osmfile, stops_file, gtfs_file, stopsprovider, osm_change_files, scope)
     
+    # globaleIDs of the stops rematched incrementally or in scope, None if all stops were matched
+    rematched_stop_ids = None
+    picker = MatchPicker(db)
     if mode in ('all', 'match'):
-        StopMatcher(db).match_stops()
+        # if all stops are matched, picker picks their matches while they are matched
+        rematched_stop_ids = StopMatcher(db).match_stops(incremental = incremental, scope = scope, picker = picker)
         metadata['match_timestamp'] = datetime.datetime.now()
         logger.info("Matched and exported candidates")
+    elif scope:
+        rematched_stop_ids = scope.stop_ids(db)
 
     # mode is in ('all', 'match', 'pick')
-    MatchPicker(db).pick_matches()
-    MatchResultValidator(db).check_assertions()
-    StatisticsUpdater(db).update_match_statistics(metadata)
+    if mode == 'pick' or rematched_stop_ids is not None:
+        picker.pick_matches(stop_ids = rematched_stop_ids)
+    if scope:
+        scope.prepare(db)
+    MatchResultValidator(db, scope).check_assertions()
+    StatisticsUpdater(db, scope).update_match_statistics(metadata)
     
     db.close()
 
@@ -112,13 +153,18 @@ def main(osmfile, db_file, stops_file, gtfs_file, stopsprovider, mode, logfile):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-o', dest='osmfile', required=False, help='OpenStreetMap pbf file')
+    parser.add_argument('-c', dest='osm_change_files', required=False, nargs='*', default=[], help='OpenStreetMap change files (.osc/.osc.gz) to apply to a previously imported pbf file')
     parser.add_argument('-s', dest='stopsfile', required=False, help='Stops file')
     parser.add_argument('-g', dest='gtfs_file', required=False, help='GTFS file')
     parser.add_argument('-p', dest='stopsprovider', required=True, help='Stops provider.', choices=['DELFI','GTFS','NVBW'])
     parser.add_argument('-d', dest='db_file', required=False, help='sqlite DB out file', default='out/stops.db')
     parser.add_argument('-l', dest='log_file', required=False, help='log file', default='out/matching.log')
     parser.add_argument('-m', dest='mode', required=False, help='Mode', choices=['all','match','pick'], default='all')
+    parser.add_argument('-r', dest='region_prefix', required=False, help='Only import, match and pick official stops whose IFOPT starts with this prefix (e.g. de:08111), keeping the results of other stops')
+    parser.add_argument('-b', dest='bbox', required=False, type=parse_bbox, help='Only import, match and pick stops within this bounding box (min_lon,min_lat,max_lon,max_lat), keeping the results of other stops')
+    parser.add_argument('-i', dest='incremental', required=False, action='store_true', help='Only rematch and repick stops which changed or have changed osm stops nearby since the last match run')
     
     args = parser.parse_args()
+    scope = RegionScope(args.region_prefix, args.bbox) if args.region_prefix or args.bbox else None
     print("Launching compare_stops. Progress is logged to " + args.log_file)
-    exit(main(args.osmfile, args.db_file, args.stopsfile, args.gtfs_file, args.stopsprovider, args.mode, args.log_file))
+    exit(main(args.osmfile, args.db_file, args.stopsfile, args.gtfs_file, args.stopsprovider, args.mode, args.log_file, args.osm_change_files, args.incremental, scope))
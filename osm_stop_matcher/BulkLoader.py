@@ -0,0 +1,90 @@
+import logging
+import time
+from itertools import islice
+
+from . import config
+
+class BulkLoader():
+	"""
+	Write path for importers loading large tables.
+
+	Rows are inserted in batches of config.BULK_LOAD_BATCH_SIZE without intermediate commits.
+	Used as context manager, the loader applies config.BULK_LOAD_PRAGMAS during the import,
+	executes deferred statements (e.g. index creation) after loading, commits once
+	and finally restores the previous pragmas and logs rows/s per table.
+	A loader entered again while in use (e.g. passed to a nested step) continues the outer load,
+	which alone commits, executes deferred statements and restores pragmas.
+	"""
+
+	def __init__(self, db, batch_size = config.BULK_LOAD_BATCH_SIZE):
+		self.db = db
+		self.batch_size = batch_size
+		self.logger = logging.getLogger('osm_stop_matcher.BulkLoader')
+		self.stats = {}
+		self.deferred_statements = []
+		self.previous_pragmas = {}
+		self.depth = 0
+
+	def __enter__(self):
+		self.depth += 1
+		if self.depth > 1:
+			return self
+		# journal_mode can't be changed within a transaction
+		self.db.commit()
+		for (pragma, value) in config.BULK_LOAD_PRAGMAS.items():
+			self.previous_pragmas[pragma] = self.db.execute("PRAGMA {}".format(pragma)).fetchone()[0]
+			self.db.execute("PRAGMA {}={}".format(pragma, value))
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.depth -= 1
+		if self.depth > 0:
+			return False
+		if exc_type is None:
+			for statement in self.deferred_statements:
+				start = time.perf_counter()
+				self.db.execute(statement)
+				self.logger.info("Executed deferred %s in %.1f s", statement, time.perf_counter() - start)
+			self.db.commit()
+			self.log_stats()
+		else:
+			self.db.rollback()
+		for (pragma, value) in self.previous_pragmas.items():
+			self.db.execute("PRAGMA {}={}".format(pragma, value))
+		self.deferred_statements = []
+		self.stats = {}
+		return False
+
+	def insert(self, table, rows, columns = None):
+		"""
+		Inserts rows (any iterable of tuples) into table, optionally only into the given columns (e.g. "a, b").
+		Returns the number of inserted rows.
+		"""
+		start = time.perf_counter()
+		count = 0
+		statement = None
+		rows = iter(rows)
+		while True:
+			batch = list(islice(rows, self.batch_size))
+			if not batch:
+				break
+			if statement is None:
+				statement = "INSERT INTO {}{} VALUES ({})".format(table,
+					" ({})".format(columns) if columns else "",
+					",".join("?" * len(batch[0])))
+			self.db.executemany(statement, batch)
+			count += len(batch)
+		stats = self.stats.setdefault(table, [0, 0.0])
+		stats[0] += count
+		stats[1] += time.perf_counter() - start
+		return count
+
+	def defer(self, statement):
+		"""
+		Executes statement (e.g. CREATE INDEX) when loading finished
+		"""
+		self.deferred_statements.append(statement)
+
+	def log_stats(self):
+		for (table, (count, seconds)) in self.stats.items():
+			self.logger.info("Loaded %s rows into %s in %.1f s (%.0f rows/s)", count, table, seconds, count / max(seconds, 1e-6))
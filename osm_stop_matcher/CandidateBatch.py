@@ -0,0 +1,25 @@
+import numpy as np
+
+class CandidateBatch():
+	"""
+	Candidate pairs of one or many official stops, as rated by Raters:
+	pair k is the official stop stops[stop_indexes[k]] and the osm stop osm_stop_list[candidate_ids[k]],
+	which are distances[k] meters apart. osm_stop_list is the one the Raters were prepared with.
+	"""
+
+	def __init__(self, stops, candidate_ids, stop_indexes, distances, osm_stop_list):
+		self.stops = stops
+		self.candidate_ids = np.asarray(candidate_ids, dtype=np.intp)
+		self.stop_indexes = np.asarray(stop_indexes, dtype=np.intp)
+		self.distances = np.asarray(distances, dtype=float)
+		self.osm_stop_list = osm_stop_list
+
+	def __len__(self):
+		return len(self.candidate_ids)
+
+	def pairs(self):
+		"""
+		Yields (stop, candidate) of every candidate pair
+		"""
+		for (stop_index, candidate_id) in zip(self.stop_indexes.tolist(), self.candidate_ids.tolist()):
+			yield (self.stops[stop_index], self.osm_stop_list[candidate_id])
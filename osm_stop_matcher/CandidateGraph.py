@@ -0,0 +1,73 @@
+class CandidateGraph():
+	"""
+	Bipartite graph of official stops (ifopt_ids) and osm stops, connected by their candidates, which is
+	partitioned into connected components by union-find (union by size, path halving) while candidates are added.
+
+	Matches of stops in different components can't conflict, so every component can be picked on its own.
+	Only ids and per component counts are kept, not the candidates themselves.
+	"""
+
+	def __init__(self):
+		self.stop_nodes = {}
+		self.osm_nodes = {}
+		self.parents = []
+		# per root node, the number of official stops, osm stops and candidates of its component
+		self.stop_counts = []
+		self.osm_counts = []
+		self.candidate_counts = []
+
+	def node(self, nodes, id, is_stop):
+		node = nodes.get(id)
+		if node is None:
+			node = nodes[id] = len(self.parents)
+			self.parents.append(node)
+			self.stop_counts.append(1 if is_stop else 0)
+			self.osm_counts.append(0 if is_stop else 1)
+			self.candidate_counts.append(0)
+		return node
+
+	def find(self, node):
+		parents = self.parents
+		while parents[node] != node:
+			parents[node] = parents[parents[node]]
+			node = parents[node]
+		return node
+
+	def add(self, ifopt_id, osm_id):
+		"""
+		Adds the candidate osm_id of the official stop ifopt_id
+		"""
+		stop_root = self.find(self.node(self.stop_nodes, ifopt_id, True))
+		osm_root = self.find(self.node(self.osm_nodes, osm_id, False))
+		if stop_root != osm_root:
+			if self.stop_counts[stop_root] + self.osm_counts[stop_root] < self.stop_counts[osm_root] + self.osm_counts[osm_root]:
+				(stop_root, osm_root) = (osm_root, stop_root)
+			self.parents[osm_root] = stop_root
+			self.stop_counts[stop_root] += self.stop_counts[osm_root]
+			self.osm_counts[stop_root] += self.osm_counts[osm_root]
+			self.candidate_counts[stop_root] += self.candidate_counts[osm_root]
+		self.candidate_counts[stop_root] += 1
+
+	def __len__(self):
+		return len(self.stop_nodes)
+
+	def components(self):
+		"""
+		Returns {ifopt_id: component} of all official stops, identifying every component by its smallest ifopt_id
+		"""
+		roots = {ifopt_id: self.find(node) for (ifopt_id, node) in self.stop_nodes.items()}
+		component_of_root = {}
+		for (ifopt_id, root) in roots.items():
+			if root not in component_of_root or ifopt_id < component_of_root[root]:
+				component_of_root[root] = ifopt_id
+		return {ifopt_id: component_of_root[root] for (ifopt_id, root) in roots.items()}
+
+	def component_sizes(self):
+		"""
+		Returns {component: (official stop count, osm stop count, candidate count)} of all components (identified as by components)
+		"""
+		sizes = {}
+		for component in set(self.components().values()):
+			root = self.find(self.stop_nodes[component])
+			sizes[component] = (self.stop_counts[root], self.osm_counts[root], self.candidate_counts[root])
+		return sizes
@@ -0,0 +1,72 @@
+import numpy as np
+
+from osm_stop_matcher.util import EARTH_RADIUS_METERS
+
+class CandidateIndex():
+	"""
+	Grid index of stop coordinates for radius queries.
+
+	Coordinates are projected equirectangularly to meters, using the latitude farthest from
+	the equator as reference, so that projected distances never exceed true distances.
+	With a cell size of (slightly more than) radius, all stops within radius of a location are in the
+	3x3 cells surrounding it. The index is built in one step by sorting the stops by cell.
+	"""
+
+	def __init__(self, lats, lons, radius):
+		self.radius = radius
+		# margin for rounding errors and the projection's error for small distances (relative ~1e-10)
+		self.cell_size = radius * 1.000001
+		self.count = len(lats)
+		if self.count == 0:
+			return
+		# add a little margin for query locations beyond the indexed stops
+		self.reference_latitude = min(np.radians(np.abs(lats).max()) + 0.01, np.pi / 2 - 0.01)
+		(cell_xs, cell_ys) = self.cells(lats, lons)
+		self.min_x, self.max_x = cell_xs.min(), cell_xs.max()
+		self.min_y, self.max_y = cell_ys.min(), cell_ys.max()
+		keys = self.cell_keys(cell_xs, cell_ys)
+		self.order = np.argsort(keys, kind = 'stable')
+		(self.keys, self.starts, self.counts) = np.unique(keys[self.order], return_index = True, return_counts = True)
+
+	def cells(self, lats, lons):
+		x = EARTH_RADIUS_METERS * np.radians(lons) * np.cos(self.reference_latitude)
+		y = EARTH_RADIUS_METERS * np.radians(lats)
+		return (np.floor(x / self.cell_size).astype(np.int64), np.floor(y / self.cell_size).astype(np.int64))
+
+	def cell_keys(self, cell_xs, cell_ys):
+		return (cell_xs - self.min_x) * (self.max_y - self.min_y + 1) + (cell_ys - self.min_y)
+
+	def query(self, lats, lons):
+		"""
+		Returns the indexes of all stops in the cells surrounding the given locations and for each of these
+		the index of the location it is near to, ordered by location. Besides all stops within radius, this
+		includes some stops farther away, which the caller is expected to filter by their exact distance.
+		"""
+		if self.count == 0 or len(lats) == 0:
+			return (np.empty(0, dtype = np.intp), np.empty(0, dtype = np.intp))
+		(cell_xs, cell_ys) = self.cells(lats, lons)
+		locations = np.arange(len(lats))
+		owners = []
+		starts = []
+		counts = []
+		for dx in (-1, 0, 1):
+			for dy in (-1, 0, 1):
+				xs = cell_xs + dx
+				ys = cell_ys + dy
+				in_grid = (xs >= self.min_x) & (xs <= self.max_x) & (ys >= self.min_y) & (ys <= self.max_y)
+				keys = self.cell_keys(xs[in_grid], ys[in_grid])
+				positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+				found = self.keys[positions] == keys
+				owners.append(locations[in_grid][found])
+				starts.append(self.starts[positions[found]])
+				counts.append(self.counts[positions[found]])
+		owners = np.concatenate(owners)
+		starts = np.concatenate(starts)
+		counts = np.concatenate(counts)
+		by_owner = np.argsort(owners, kind = 'stable')
+		(owners, starts, counts) = (owners[by_owner], starts[by_owner], counts[by_owner])
+
+		# expand each (start, count) cell range to the positions start, start+1, ..., start+count-1
+		offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		positions = np.repeat(starts, counts) + offsets
+		return (self.order[positions], np.repeat(owners, counts))
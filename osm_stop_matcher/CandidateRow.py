@@ -0,0 +1,11 @@
+class CandidateRow(tuple):
+	"""
+	Row of table candidates as produced by StopMatcher, whose values can be accessed by column name
+	like those of a sqlite3.Row, so MatchPicker can pick from candidates without reading them from the table.
+	"""
+
+	COLUMNS = {column: index for (index, column) in enumerate(['ifopt_id', 'osm_id', 'rating', 'distance', 'name_distance',
+		'platform_matches', 'successor_rating', 'mode_rating', 'the_geom'])}
+
+	def __getitem__(self, key):
+		return tuple.__getitem__(self, self.COLUMNS[key] if isinstance(key, str) else key)
@@ -1,5 +1,6 @@
 import csv
 import datetime
+from .BulkLoader import BulkLoader
 from .util import to_iso_date_format, xstr, drop_table_if_exists
 import logging
 
@@ -20,7 +21,7 @@ class DelfiStopsImporter():
 
 		with open(stops_file,'r',encoding='utf-8-sig') as csvfile:
 			dr = csv.DictReader(csvfile, delimiter=';', quotechar='"')
-			to_db = [(
+			to_db = ((
 				xstr(row['SeqNo']), 
 				xstr(row['Type']), 
 				xstr(row['DHID']),
@@ -39,12 +40,12 @@ class DelfiStopsImporter():
 				xstr(row['TariffProvider']),
 				# convert '31.12.1999 00:00:00' to '1999-31-12'
 				to_iso_date_format(row['LastOperationDate'])
-				) for row in dr]
-			logger.info("Loaded stops from DELF zHV")
-			cur.executemany("""INSERT INTO zhv (SeqNo, Type, DHID, Parent, Name, 
-			Latitude, Longitude, MunicipalityCode, Municipality, DistrictCode, District, Description,
-			Authority, DelfiName, THID, TariffProvider, LastOperationDate) VALUES (?{})""".format(",?"*16), to_db)
-			logger.info("Inserted stops into table zhv")
+				) for row in dr)
+			with BulkLoader(self.db) as loader:
+				loader.insert('zhv', to_db, """SeqNo, Type, DHID, Parent, Name, 
+					Latitude, Longitude, MunicipalityCode, Municipality, DistrictCode, District, Description,
+					Authority, DelfiName, THID, TariffProvider, LastOperationDate""")
+			logger.info("Inserted stops from DELFI zHV into table zhv")
 
 		cur.execute("SELECT InitSpatialMetaData()")
 		cur.execute("SELECT AddGeometryColumn('zhv', 'the_geom', 4326, 'POINT','XY')")
@@ -0,0 +1,86 @@
+import logging
+import re
+
+from . import config
+
+def normalize_name(name):
+	if not name:
+		return name
+	normalized_name = re.sub("\([\w\. ]*\)", '', name)
+	normalized_name = re.sub("Bahnhof$|Bhf$|Bf$", 'Bf', normalized_name)
+	normalized_name = re.sub("Ort$", '', normalized_name)
+	normalized_name = re.sub("trasse$", 'tr', normalized_name)
+	return normalized_name
+
+def normalize_direction(dir, ortsteil, gemeinde):
+	dir = dir.replace(ortsteil+' ', '') if ortsteil else dir
+	dir = dir.replace(gemeinde+' ', '') if gemeinde else dir
+	return dir.replace('trasse', 'tr').replace(',', ' ').replace('-', ' ').strip()
+
+def normalize_direction_of_name_steig(name_steig, ortsteil, gemeinde):
+	"""
+	Returns the normalized direction (e.g. "Stuttgart Hbf" of "Ri Stuttgart Hbf") or None, if name_steig names no direction
+	"""
+	if name_steig:
+		match = re.match(config.DIRECTION_PREFIX_PATTERN, name_steig)
+		if match:
+			return normalize_direction(match.group(3).strip(), ortsteil, gemeinde)
+	return None
+
+def is_bus_or_train_station(name_short, name_long):
+	name = name_short if name_short else name_long
+	return 1 if name and ('ahnhof' in name
+		or 'ZOB' in name
+		or 'Schulzentrum' in name
+		or 'Flughafen' in name
+		or ' Bf' in name ) else 0
+
+class FeatureExtractor():
+	"""
+	Computes the features StopMatcher needs per official or osm stop (instead of per candidate pair),
+	i.e. normalized names, the parsed and normalized direction and whether a stop is a bus or train station,
+	and stores them as additional columns of haltestellen_unified and osm_stops.
+
+	Rows having features are marked via features_extracted, so repeated matching runs
+	only extract features of rows added since (e.g. by OsmChangeImporter).
+	"""
+
+	STOP_FEATURE_COLUMNS = ['name_normalized TEXT', 'name_long_normalized TEXT', 'bus_or_train_station INTEGER',
+		'direction_normalized TEXT', 'features_extracted INTEGER']
+	OSM_STOP_FEATURE_COLUMNS = ['name_normalized TEXT', 'features_extracted INTEGER']
+
+	def __init__(self, db):
+		self.db = db
+		self.logger = logging.getLogger('osm_stop_matcher.FeatureExtractor')
+
+	def extract_features(self, only_missing = False):
+		self.extract_stop_features(only_missing)
+		self.extract_osm_stop_features(only_missing)
+		self.db.commit()
+
+	def add_columns(self, table, columns):
+		existing_columns = set(row[1] for row in self.db.execute("PRAGMA table_info({})".format(table)))
+		for column in columns:
+			if column.split()[0] not in existing_columns:
+				self.db.execute("ALTER TABLE {} ADD COLUMN {}".format(table, column))
+
+	def extract_stop_features(self, only_missing = False):
+		self.add_columns('haltestellen_unified', self.STOP_FEATURE_COLUMNS)
+		cur = self.db.execute("""SELECT rowid, Haltestelle, Haltestelle_lang, Name_Steig, Ortsteil, Gemeinde
+			FROM haltestellen_unified {}""".format("WHERE features_extracted IS NULL" if only_missing else ""))
+		rows = [(
+			normalize_name(stop[1]),
+			normalize_name(stop[2]),
+			is_bus_or_train_station(stop[1], stop[2]),
+			normalize_direction_of_name_steig(stop[3], stop[4], stop[5]),
+			stop[0]) for stop in cur]
+		self.db.executemany("""UPDATE haltestellen_unified SET name_normalized=?, name_long_normalized=?, bus_or_train_station=?,
+			direction_normalized=?, features_extracted=1 WHERE rowid=?""", rows)
+		self.logger.info("Extracted features of %s stops", len(rows))
+
+	def extract_osm_stop_features(self, only_missing = False):
+		self.add_columns('osm_stops', self.OSM_STOP_FEATURE_COLUMNS)
+		cur = self.db.execute("SELECT rowid, name FROM osm_stops {}".format("WHERE features_extracted IS NULL" if only_missing else ""))
+		rows = [(normalize_name(stop[1]), stop[0]) for stop in cur]
+		self.db.executemany("UPDATE osm_stops SET name_normalized=?, features_extracted=1 WHERE rowid=?", rows)
+		self.logger.info("Extracted features of %s osm stops", len(rows))
@@ -1,6 +1,7 @@
 import argparse
 import csv
 import datetime
+from osm_stop_matcher.BulkLoader import BulkLoader
 from osm_stop_matcher.util import xstr, drop_table_if_exists, get_parent_station
 import sqlite3
 import spatialite
@@ -17,49 +18,45 @@ class GtfsStopsImporter():
         self.db = connection
         self.encoding = 'utf-8-sig'
     
-    def import_agency(self, agency_file):
+    def import_agency(self, agency_file, loader):
         cur = self.db.cursor()
         drop_table_if_exists(self.db, "gtfs_agency")
         cur.execute("CREATE TABLE gtfs_agency (agency_id PRIMARY KEY,agency_name);")
         reader = csv.DictReader(io.TextIOWrapper(agency_file, self.encoding))
-        to_db = [(i['agency_id'], i['agency_name']) for i in reader]
+        to_db = ((i['agency_id'], i['agency_name']) for i in reader)
 
-        cur.executemany("INSERT INTO gtfs_agency (agency_id,agency_name) VALUES (?, ?);", to_db)
-        self.db.commit()
+        loader.insert("gtfs_agency", to_db, "agency_id,agency_name")
 
-    def import_routes(self, routes_file):
+    def import_routes(self, routes_file, loader):
         cur = self.db.cursor()
         drop_table_if_exists(self.db, "gtfs_routes")
         cur.execute("CREATE TABLE gtfs_routes (route_id PRIMARY KEY,route_type,route_short_name, route_long_name,agency_id);")
         reader = csv.DictReader(io.TextIOWrapper(routes_file, self.encoding))
-        to_db = [(i['route_id'], i['route_type'], i['route_short_name'], i['route_long_name'],i['agency_id']) for i in reader]
+        to_db = ((i['route_id'], i['route_type'], i['route_short_name'], i['route_long_name'],i['agency_id']) for i in reader)
 
-        cur.executemany("INSERT INTO gtfs_routes (route_id,route_type,route_short_name, route_long_name, agency_id) VALUES (?, ?, ?, ?, ?);", to_db)
-        self.db.commit()
+        loader.insert("gtfs_routes", to_db, "route_id,route_type,route_short_name, route_long_name, agency_id")
 
-    def import_trips(self, trips_file):
+    def import_trips(self, trips_file, loader):
         cur = self.db.cursor()
         drop_table_if_exists(self.db, "gtfs_trips")
         cur.execute("CREATE TABLE gtfs_trips (trip_id PRIMARY KEY, route_id);")
 
         reader = csv.DictReader(io.TextIOWrapper(trips_file, self.encoding))
-        to_db = [(i['trip_id'], i['route_id']) for i in reader]
+        to_db = ((i['trip_id'], i['route_id']) for i in reader)
 
-        cur.executemany("INSERT INTO gtfs_trips (trip_id,route_id) VALUES (?, ?);", to_db)
-        self.db.commit()
+        loader.insert("gtfs_trips", to_db, "trip_id,route_id")
 
-    def import_stops(self, stops_file):
+    def import_stops(self, stops_file, loader):
         cur = self.db.cursor()
         drop_table_if_exists(self.db, "gtfs_stops")
         cur.execute("CREATE TABLE gtfs_stops (stop_id PRIMARY KEY,stop_name,stop_lat,stop_lon,location_type,parent_station,platform_code);")
 
         reader = csv.DictReader(io.TextIOWrapper(stops_file, self.encoding))
-        to_db = [(i['stop_id'], i['stop_name'], i['stop_lat']
+        to_db = ((i['stop_id'], i['stop_name'], i['stop_lat']
             , i['stop_lon'], i['location_type'], get_parent_station(i['stop_id']),
-            i.get('platform_code')) for i in reader]
+            i.get('platform_code')) for i in reader)
 
-        cur.executemany("INSERT INTO gtfs_stops (stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station,platform_code) VALUES (?, ?, ?, ?, ?, ?, ?);", to_db)
-        self.db.commit()
+        loader.insert("gtfs_stops", to_db, "stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station,platform_code")
 
     def load_haltestellen_unified(self):
         '''
@@ -86,31 +83,31 @@ class GtfsStopsImporter():
         self.db.commit()
         logger.info("Loaded haltestellen_unified from GTFS")
 
-    def import_stop_times(self, stop_times_file):
+    def import_stop_times(self, stop_times_file, loader):
         cur = self.db.cursor()
         drop_table_if_exists(self.db, "gtfs_stop_times")
         cur.execute("CREATE TABLE gtfs_stop_times (trip_id,stop_id,stop_sequence INT);")
-        cur.execute("CREATE UNIQUE INDEX gst ON gtfs_stop_times(trip_id,stop_id,stop_sequence);")
 
         reader = csv.DictReader(io.TextIOWrapper(stop_times_file, self.encoding))
-        to_db = [(i['trip_id'], i['stop_id'], i['stop_sequence']) for i in reader]
+        to_db = ((i['trip_id'], i['stop_id'], i['stop_sequence']) for i in reader)
 
-        cur.executemany("INSERT INTO gtfs_stop_times (trip_id,stop_id,stop_sequence) VALUES (?, ?, ?);", to_db)
-        cur.execute("CREATE INDEX gst_s ON gtfs_stop_times(stop_id);")
-        self.db.commit()
+        loader.insert("gtfs_stop_times", to_db, "trip_id,stop_id,stop_sequence")
+        # Creating indexes after loading is much faster than maintaining them on every insert
+        loader.defer("CREATE UNIQUE INDEX gst ON gtfs_stop_times(trip_id,stop_id,stop_sequence);")
+        loader.defer("CREATE INDEX gst_s ON gtfs_stop_times(stop_id);")
         
     def import_gtfs(self, gtfs_file):
-        with zipfile.ZipFile(gtfs_file) as gtfs:
+        with zipfile.ZipFile(gtfs_file) as gtfs, BulkLoader(self.db) as loader:
             with gtfs.open('agency.txt', 'r') as agency_file:
-                self.import_agency(agency_file)
+                self.import_agency(agency_file, loader)
             with gtfs.open('routes.txt', 'r') as routes_file:
-                self.import_routes(routes_file)
+                self.import_routes(routes_file, loader)
             with gtfs.open('trips.txt', 'r') as trips_file:
-                self.import_trips(trips_file)
+                self.import_trips(trips_file, loader)
             with gtfs.open('stops.txt', 'r') as stops_file:
-                self.import_stops(stops_file)
+                self.import_stops(stops_file, loader)
             with gtfs.open('stop_times.txt', 'r') as stop_times_file:
-                self.import_stop_times(stop_times_file)
+                self.import_stop_times(stop_times_file, loader)
 
     def patch_gtfs(self):
         cur = self.db.cursor()
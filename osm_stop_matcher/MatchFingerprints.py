@@ -0,0 +1,114 @@
+import hashlib
+import logging
+
+import numpy as np
+
+from osm_stop_matcher.CandidateIndex import CandidateIndex
+from osm_stop_matcher.util import drop_table_if_exists, haversine_distances, table_exists
+
+from . import config
+
+class MatchFingerprints():
+	"""
+	Fingerprints the attributes of official and osm stops (and the config values) StopMatcher's rating depends on,
+	to determine which official stops must be rematched since the fingerprints were stored by the last match run:
+	official stops which were added, changed or removed and official stops having an osm stop within MAXIMUM_DISTANCE
+	(of its current or previous location) which was added, changed or removed.
+
+	Fingerprints are stored in table match_fingerprints as (kind, id, lat, lon, fingerprint),
+	kind being 'stop' (id is the globaleID), 'osm' (id is the osm_id) or 'config'.
+	"""
+
+	# Columns of haltestellen_unified respectively osm_stops read by StopMatcher (features are derived from these)
+	STOP_COLUMNS = ['globaleID', 'lat', 'lon', 'mode', 'Haltestelle', 'Haltestelle_lang', 'Name_Steig', 'Ortsteil', 'Gemeinde', 'platform_code']
+	OSM_STOP_COLUMNS = ['osm_id', 'lat', 'lon', 'name', 'network', 'operator', 'mode', 'type', 'ref', 'ref_key', 'next_stops', 'prev_stops', 'assumed_platform']
+	# Config values affecting candidates
+	CONFIG_VALUES = ['MAXIMUM_DISTANCE', 'MINIMUM_NAME_SIMILARITY', 'MAX_EVALUATED_CANDIDATES_BUS_STATIONS', 'MAX_EVALUATED_CANDIDATES_OTHER_STOPS',
+		'UNSERVED_STOP_RATING', 'UNKNOWN_MODE_RATING', 'MINIMUM_SUCCESSOR_SIMILARITY', 'MINIMUM_SUCCESSOR_PREDECESSOR_DISTANCE', 'DIRECTION_PREFIX_PATTERN']
+
+	def __init__(self, db):
+		self.db = db
+		self.current = None
+		self.logger = logging.getLogger('osm_stop_matcher.MatchFingerprints')
+
+	def fingerprint(self, values):
+		return hashlib.blake2b(repr(values).encode('utf-8'), digest_size = 16).digest()
+
+	def current_fingerprints(self):
+		"""
+		Returns {(kind, id): (lat, lon, fingerprint)} of the current stops, osm stops and config.
+		Rows of official stops sharing a globaleID have a common fingerprint (in rowid order, in which they are matched).
+		"""
+		fingerprints = {('config', 'config'): (None, None, self.fingerprint([getattr(config, name) for name in self.CONFIG_VALUES]))}
+		stops = {}
+		for stop in self.db.execute("SELECT {} FROM haltestellen_unified ORDER BY globaleID, rowid".format(', '.join(self.STOP_COLUMNS))):
+			stops.setdefault(stop[0], []).append(tuple(stop))
+		for (stop_id, rows) in stops.items():
+			fingerprints[('stop', stop_id)] = (rows[0][1], rows[0][2], self.fingerprint(rows))
+		for stop in self.db.execute("SELECT {} FROM osm_stops".format(', '.join(self.OSM_STOP_COLUMNS))):
+			fingerprints[('osm', stop[0])] = (stop[1], stop[2], self.fingerprint(tuple(stop)))
+		return fingerprints
+
+	def stored_fingerprints(self):
+		if not table_exists(self.db, "match_fingerprints"):
+			return {}
+		return {(kind, id): (lat, lon, fingerprint) for (kind, id, lat, lon, fingerprint) in self.db.execute(
+			"SELECT kind, id, lat, lon, fingerprint FROM match_fingerprints")}
+
+	def changed_stop_ids(self):
+		"""
+		Returns the globaleIDs of the official stops to rematch (including removed ones),
+		or None, if all have to be matched, as no fingerprints are stored or config values changed.
+		"""
+		self.current = self.current_fingerprints()
+		stored = self.stored_fingerprints()
+		if self.fingerprint_of(stored, ('config', 'config')) != self.fingerprint_of(self.current, ('config', 'config')):
+			self.logger.info("No fingerprints of a previous match run with the current config found, matching all stops")
+			return None
+
+		changed = [key for key in stored.keys() | self.current.keys() if self.fingerprint_of(stored, key) != self.fingerprint_of(self.current, key)]
+		stop_ids = set(id for (kind, id) in changed if kind == 'stop')
+		changed_osm_locations = [location[:2] for (kind, id) in changed if kind == 'osm'
+			for location in (stored.get((kind, id)), self.current.get((kind, id))) if location is not None]
+		neighbour_ids = self.stops_near(changed_osm_locations) - stop_ids
+		self.logger.info("%s official stops and %s osm stops changed, %s official stops within %s m of changed osm stops",
+			len(stop_ids), len([kind for (kind, id) in changed if kind == 'osm']), len(neighbour_ids), config.MAXIMUM_DISTANCE)
+		return stop_ids | neighbour_ids
+
+	def fingerprint_of(self, fingerprints, key):
+		return fingerprints[key][2] if key in fingerprints else None
+
+	def stops_near(self, osm_locations):
+		"""
+		Returns the globaleIDs of the official stops within MAXIMUM_DISTANCE of any of osm_locations (lat, lon),
+		using the same distances as StopMatcher.filter_candidates.
+		"""
+		if not osm_locations:
+			return set()
+		osm_lats = np.array([location[0] for location in osm_locations], dtype=float)
+		osm_lons = np.array([location[1] for location in osm_locations], dtype=float)
+		index = CandidateIndex(osm_lats, osm_lons, config.MAXIMUM_DISTANCE)
+		stops = self.db.execute("SELECT globaleID, lat, lon FROM haltestellen_unified WHERE lon IS NOT NULL").fetchall()
+		stop_lats = np.array([float(stop[1]) for stop in stops], dtype=float)
+		stop_lons = np.array([float(stop[2]) for stop in stops], dtype=float)
+		(osm_indexes, stop_indexes) = index.query(stop_lats, stop_lons)
+		distances = haversine_distances(stop_lats[stop_indexes], stop_lons[stop_indexes], osm_lats[osm_indexes], osm_lons[osm_indexes])
+		return set(stops[stop_index][0] for stop_index in np.unique(stop_indexes[distances <= config.MAXIMUM_DISTANCE]).tolist())
+
+	def store(self):
+		"""
+		Stores the fingerprints of the current stops, osm stops and config, i.e. those changed_stop_ids computed, if called before.
+		"""
+		fingerprints = self.current or self.current_fingerprints()
+		drop_table_if_exists(self.db, "match_fingerprints")
+		self.db.execute("""CREATE TABLE match_fingerprints (kind TEXT, id TEXT, lat REAL, lon REAL, fingerprint BLOB, PRIMARY KEY (kind, id))""")
+		self.db.executemany("INSERT INTO match_fingerprints VALUES (?,?,?,?,?)",
+			((kind, id, lat, lon, fingerprint) for ((kind, id), (lat, lon, fingerprint)) in fingerprints.items()))
+		self.db.commit()
+
+	def clear(self):
+		"""
+		Removes stored fingerprints, so the next incremental match run matches all stops
+		"""
+		drop_table_if_exists(self.db, "match_fingerprints")
+		self.db.commit()
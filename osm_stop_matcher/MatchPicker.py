@@ -1,12 +1,20 @@
 import logging
 import math
+import multiprocessing
 import argparse
 import spatialite
 import sqlite3
 import sys
+from collections import defaultdict, deque
+from itertools import groupby, islice
+
+import numpy as np
+
+from osm_stop_matcher.BulkLoader import BulkLoader
+from osm_stop_matcher.CandidateGraph import CandidateGraph
 
 from . import config
-from .util import drop_table_if_exists
+from .util import drop_table_if_exists, table_exists
 
 def get_rating(row):
 	return row['rating']
@@ -29,131 +37,354 @@ def get_total_rating_sum(matches, agency_stops_cnt):
 	root = (product_of_matches_rating+product_of_unmatched)/agency_stops_cnt
 	return root
 
-def best_unique_matches(candidates, agency_stops = [], matches = [], matched_index = 0, already_matched_osm = []):
-	if (len(agency_stops) == 0 ):
-		agency_stops_set = set()
-		cand_count = 0
-		for candidate in candidates:
-			cand_count += len(candidates[candidate])
-			agency_stops_set.add(candidate)
-		agency_stops = list(agency_stops_set)
-		if cand_count > config.MAX_CANDIDATE_COUNT_PER_STOP_BEFORE_ONLY_BEST_PER_QUAY_ARE_CONSIDERED:
-			for candidate in candidates:
-				# retain only best candidate to reduce complexity
-				if candidates[candidate]: 
-					candidates[candidate].sort(reverse = True, key = get_rating)
-					candidates[candidate] = [candidates[candidate][0]]
-					
+def min_cost_assignment(costs):
+	"""
+	Solves the assignment problem for the cost matrix costs (n rows, m >= n columns, np.inf for forbidden pairs),
+	i.e. assigns every row to a distinct column such that the sum of their costs is minimal, using the
+	Hungarian method with shortest augmenting paths (O(n^2 * m)). Every row must have at least one allowed column.
+	Returns the column assigned to each row. Of equally cheap columns, the one with the lowest index is preferred.
+	"""
+	(n, m) = costs.shape
+	# potentials of rows and columns, column 0 is a virtual one the augmenting path of each row starts from
+	u = np.zeros(n + 1)
+	v = np.zeros(m + 1)
+	# row (1-based) assigned to each column, 0 if none
+	row_of_column = np.zeros(m + 1, dtype=np.intp)
+	for row in range(1, n + 1):
+		row_of_column[0] = row
+		column = 0
+		min_reduced_costs = np.full(m + 1, np.inf)
+		previous_column = np.zeros(m + 1, dtype=np.intp)
+		used = np.zeros(m + 1, dtype=bool)
+		while row_of_column[column] != 0:
+			used[column] = True
+			current_row = row_of_column[column]
+			reduced_costs = costs[current_row - 1] - u[current_row] - v[1:]
+			improved = ~used[1:] & (reduced_costs < min_reduced_costs[1:])
+			min_reduced_costs[1:][improved] = reduced_costs[improved]
+			previous_column[1:][improved] = column
+			next_column = int(np.argmin(np.where(used[1:], np.inf, min_reduced_costs[1:]))) + 1
+			delta = min_reduced_costs[next_column]
+			u[row_of_column[used]] += delta
+			v[used] -= delta
+			min_reduced_costs[~used] -= delta
+			column = next_column
+		# augment along the path found
+		while column != 0:
+			row_of_column[column] = row_of_column[previous_column[column]]
+			column = previous_column[column]
+	columns = np.empty(n, dtype=np.intp)
+	columns[row_of_column[1:][row_of_column[1:] > 0] - 1] = np.nonzero(row_of_column[1:])[0]
+	return columns
+
+def best_unique_matches(candidates):
+	"""
+	Returns the (rating, matches) of the assignment of candidates (per agency stop the list of its candidate rows)
+	having the best get_total_rating_sum, i.e. matching every agency stop to at most one and every osm stop
+	to at most one agency stop.
+
+	As get_total_rating_sum rates unmatched stops with RATING_BELOW_CANDIDATES_ARE_IGNORED, the best assignment
+	maximizes the sum of (rating - RATING_BELOW_CANDIDATES_ARE_IGNORED) of the matches, which is solved as
+	weighted bipartite assignment with an unmatched column per agency stop. Only candidates rated better than
+	unmatched are matched.
+	"""
+	agency_stops = sorted(candidates)
 	agency_stops_cnt = len(agency_stops)
-	if matched_index < agency_stops_cnt:
-		stop_candidates = candidates.get(agency_stops[matched_index])
-		best_rating = 0
-		best_matches = []
-		(best_rating, best_matches) = best_unique_matches(candidates, agency_stops, matches.copy(), matched_index+1, already_matched_osm)
-		for candidate in stop_candidates:
-			candidate_id = candidate["osm_id"]
-			if not candidate_id in already_matched_osm:
-				(rating, current_matches) = best_unique_matches(candidates, agency_stops, matches.copy()+[candidate], matched_index+1, already_matched_osm+[candidate_id])
-				if rating > best_rating:
-					best_rating = rating
-					best_matches = current_matches
-		return (best_rating, best_matches)
-	else:
+	if agency_stops_cnt == 0:
+		return (0.0, [])
+	if agency_stops_cnt == 1:
+		stop_candidates = [candidate for candidate in candidates[agency_stops[0]] if candidate['rating'] > config.RATING_BELOW_CANDIDATES_ARE_IGNORED]
+		matches = [max(stop_candidates, key = get_rating)] if stop_candidates else []
 		return (get_total_rating_sum(matches, agency_stops_cnt), matches)
 
+	osm_columns = {}
+	best_candidates = {}
+	for (row, ifopt_id) in enumerate(agency_stops):
+		for candidate in candidates[ifopt_id]:
+			column = osm_columns.setdefault(candidate['osm_id'], len(osm_columns))
+			if candidate['rating'] > config.RATING_BELOW_CANDIDATES_ARE_IGNORED and (
+				(row, column) not in best_candidates or candidate['rating'] > best_candidates[(row, column)]['rating']):
+				best_candidates[(row, column)] = candidate
+	# columns of osm stops, followed by one unmatched column per agency stop
+	costs = np.full((agency_stops_cnt, len(osm_columns) + agency_stops_cnt), np.inf)
+	for ((row, column), candidate) in best_candidates.items():
+		costs[row, column] = config.RATING_BELOW_CANDIDATES_ARE_IGNORED - candidate['rating']
+	costs[np.arange(agency_stops_cnt), len(osm_columns) + np.arange(agency_stops_cnt)] = 0.0
+
+	matches = [best_candidates[(row, column)] for (row, column) in enumerate(min_cost_assignment(costs).tolist()) if column < len(osm_columns)]
+	return (get_total_rating_sum(matches, agency_stops_cnt), matches)
+
 def parent_station_id(ifopt_id):
 	return ifopt_id[:ifopt_id.index(':',9)]
 
 def is_quai(ifopt_id):
 	return ifopt_id.find(':',9) > -1
 
+def resolve_conflicts(matches, best_rating_by_osm_id = None):
+	"""
+	Returns matches (rows having ifopt_id, osm_id, rating and name_distance) without those conflicting with others:
+	matches rated worse than another match of the same osm stop (whose best rating is given by best_rating_by_osm_id,
+	by default the best of matches) and, of the remaining, matches rated worse than another match of the same agency stop
+	with a different name_distance. Like the DELETE statements this replaces, all matches of a dropped (ifopt_id, osm_id) are dropped.
+	"""
+	if best_rating_by_osm_id is None:
+		best_rating_by_osm_id = {}
+		for match in matches:
+			if match["osm_id"] not in best_rating_by_osm_id or match["rating"] > best_rating_by_osm_id[match["osm_id"]]:
+				best_rating_by_osm_id[match["osm_id"]] = match["rating"]
+	worse_osm_matches = set((match["ifopt_id"], match["osm_id"]) for match in matches
+		if match["rating"] < best_rating_by_osm_id[match["osm_id"]])
+	matches = [match for match in matches if (match["ifopt_id"], match["osm_id"]) not in worse_osm_matches]
+
+	matches_by_ifopt_id = defaultdict(list)
+	for match in matches:
+		matches_by_ifopt_id[match["ifopt_id"]].append(match)
+	# if name is equal, official stop might be not have quaies
+	worse_named_matches = set((match["ifopt_id"], match["osm_id"]) for stop_matches in matches_by_ifopt_id.values() if len(stop_matches) > 1
+		for match in stop_matches if any(match["rating"] < other["rating"] and match["name_distance"] is not None
+			and other["name_distance"] is not None and match["name_distance"] != other["name_distance"] for other in stop_matches))
+	return [match for match in matches if (match["ifopt_id"], match["osm_id"]) not in worse_named_matches]
+
+def pick_component_indexes(component):
+	"""
+	Picks the best unique matches of component, a list of (ifopt_id, osm_id, rating, name_distance) candidate rows
+	(ordered by ifopt_id and descending rating) of a connected component of the CandidateGraph, in one exact assignment
+	(see best_unique_matches), and returns the indexes of the picked rows in component.
+	Every osm stop is matched at most once, every quai at most once, while a stop which is no quai (and might have no quais
+	modelled) may be matched to each of its candidates, named alike (i.e. having the same name_distance) as its best one.
+	"""
+	candidates = {}
+	best_name_distances = {}
+	for (index, (ifopt_id, osm_id, rating, name_distance)) in enumerate(component):
+		candidate = {"ifopt_id": ifopt_id, "osm_id": osm_id, "rating": rating, "index": index}
+		if is_quai(ifopt_id):
+			candidates.setdefault((ifopt_id, -1), []).append(candidate)
+		else:
+			best_name_distance = best_name_distances.setdefault(ifopt_id, name_distance)
+			if name_distance is None or best_name_distance is None or name_distance == best_name_distance:
+				candidates[(ifopt_id, index)] = [candidate]
+	(rating, matches) = best_unique_matches(candidates)
+	return sorted(match["index"] for match in matches)
+
+def split_component(stop_ids):
+	"""
+	Returns the parts of at most PICK_COMPONENT_MAX_STOPS of stop_ids (the official stops of a connected component),
+	splitting them at parent station boundaries, i.e. a parent station and its quais are always part of the same part
+	"""
+	def parent_station(stop_id):
+		return parent_station_id(stop_id) if is_quai(stop_id) else stop_id
+	parts = [[]]
+	for (parent_id, group) in groupby(sorted(stop_ids, key = lambda stop_id: (parent_station(stop_id), stop_id)), parent_station):
+		group = list(group)
+		if parts[-1] and len(parts[-1]) + len(group) > config.PICK_COMPONENT_MAX_STOPS:
+			parts.append([])
+		parts[-1].extend(group)
+	return parts
+
+def pick_chunk(chunk):
+	return [(part_index, pick_component_indexes(part)) for (part_index, part) in chunk]
+
 class MatchPicker():
 
-	def __init__(self, db):
+	def __init__(self, db, processes = config.PICK_PROCESSES):
 		self.db = db
+		self.processes = processes
 		self.logger = logging.getLogger('osm_stop_matcher.MatchPicker')
 
 
-	def pick_matches(self, log_only=False, stop_id_prefix=''):
+	def pick_matches(self, log_only=False, stop_id_prefix='', stop_ids=None, candidates=None, loader=None):
+		"""
+		Picks the best matches from candidates. Candidates are partitioned into the connected components of their
+		CandidateGraph, which are the units of work: every component is solved exactly on its own (see pick_component_indexes),
+		as matches of different components can't conflict. Only components of more than PICK_COMPONENT_MAX_STOPS official stops
+		are split into parts (see split_component), whose matches conflicting with those of other parts are dropped by resolve_conflicts.
+		If stop_ids (e.g. the stops rematched by an incremental StopMatcher run) are given, only the matches of these stops
+		and their neighbours are repicked (see create_repicked_stop_ids).
+		The candidates of all stops can be given as rows (e.g. by StopMatcher, while matching), ordered like index ifopt_index,
+		instead of reading them from table candidates. They are consumed by partition_candidates, before any component is picked,
+		as components are complete only when all candidates are added.
+		Matches are written via loader, if given (e.g. by StopMatcher, still loading the candidates), otherwise via a BulkLoader of its own.
+		"""
 		if config.SIMPLE_MATCH_PICKER:
+			if candidates is not None:
+				# the simple picker reads table candidates, which is written while the given candidates
+				# are consumed, so they are consumed here, before picking, and otherwise discarded
+				deque(candidates, maxlen = 0)
 			return self.simple_pick_matches()
 
-		cur = self.db.cursor()
-		
-		if not log_only:
-			cur.execute("DELETE FROM matches")
-
-		cur.execute("SELECT * FROM candidates WHERE rating >= ? AND ifopt_id like ? ORDER BY ifopt_id", [config.RATING_BELOW_CANDIDATES_ARE_IGNORED, stop_id_prefix+'%'])
-		rows = cur.fetchall()
-		self.logger.info("Picking matches from %d candidates", len(rows))
-		matches = []
-		idx = 0
-		ifopt_id_col = 0
-		matchset_count = 0	
-		while idx < len(rows):
-
-			first = True
-			subset_size = 0
-			matchset_count += 1
-			candidates = {}
-			# Collect all matches for same parent stop (assuming their stop_id have same leading <country>:<district>:<parentid> )
-			while idx < len(rows) and (first or (is_quai(rows[idx-1][ifopt_id_col]) and is_quai(rows[idx][ifopt_id_col]) and parent_station_id(rows[idx][ifopt_id_col]) == parent_station_id(rows[idx-1][ifopt_id_col]))):
-				first = False
-				ifopt_id = rows[idx]["ifopt_id"]
-
-				if not ifopt_id in candidates:
-					candidates[ifopt_id] = []
-				candidates[ifopt_id].append(rows[idx])
+		if stop_ids is not None and not table_exists(self.db, "matches"):
+			self.logger.info('No previously picked matches found, picking all matches')
+			stop_ids = None
 
-				if log_only:
-					self.logger.debug("Evaluate %s, %s, %s", rows[idx]["ifopt_id"], rows[idx]["osm_id"], rows[idx]["rating"])
+		with loader or BulkLoader(self.db) as loader:
+			if stop_ids is None:
+				if candidates is None:
+					candidates = self.db.execute("""SELECT * FROM candidates WHERE rating >= ? AND ifopt_id like ?
+						ORDER BY ifopt_id, rating DESC, rowid""", [config.RATING_BELOW_CANDIDATES_ARE_IGNORED, stop_id_prefix+'%'])
+			else:
+				# created within the loader, as changing pragma temp_store drops temp tables
+				self.logger.info("Repicking matches of %s official stops", self.create_repicked_stop_ids(stop_ids))
+				candidates = self.db.execute("""SELECT candidates.* FROM temp.repicked_stop_ids JOIN candidates USING (ifopt_id)
+					WHERE rating >= ? AND osm_id NOT IN (SELECT osm_id FROM matches WHERE ifopt_id NOT IN (SELECT ifopt_id FROM temp.repicked_stop_ids))
+					ORDER BY ifopt_id, rating DESC, candidates.rowid""", [config.RATING_BELOW_CANDIDATES_ARE_IGNORED])
 
-				subset_size += 1
-				idx += 1
+			graph = CandidateGraph()
+			# streamed (or queried) candidates are consumed completely here, before any match is picked
+			stop_rows = self.partition_candidates(candidates, graph)
+			self.log_component_statistics(graph)
 
-			if subset_size < 50:
-				# pick best matches
-				(rating, matches) = best_unique_matches(candidates)
-				if not log_only:
-					self.import_matches(matches)
-				else:
-					for match in matches:
+			components = list(self.component_parts(stop_rows, graph))
+			# the parts of all components are picked at once, so the largest are scheduled first
+			picked_parts = self.picked_parts([part for (component, parts) in components for part in parts], log_only)
+			matches = []
+			candidate_count = 0
+			for (component, parts) in components:
+				component_matches = []
+				for (part, row_indexes) in islice(picked_parts, len(parts)):
+					candidate_count += len(part)
+					component_matches.extend(part[index] for index in row_indexes)
+				if len(parts) > 1:
+					part_matches = component_matches
+					component_matches = resolve_conflicts(part_matches)
+					self.logger.info("Picked %d matches of component %s in %d parts, of which %d were dropped as conflicting with better ones",
+						len(component_matches), component, len(parts), len(part_matches) - len(component_matches))
+				if log_only:
+					for part in parts:
+						for row in part:
+							self.logger.debug("Evaluate %s, %s, %s", row["ifopt_id"], row["osm_id"], row["rating"])
+					for match in component_matches:
 						self.logger.debug("Matched %s, %s, %s", match["ifopt_id"], match["osm_id"], match["rating"])
-			else:
-				self.logger.debug('Matching bereiche as subset_size too large: %s for %s', subset_size, candidates)
-				bereiche = {}
-				for ifopt_id in candidates:
-					bereich_id = ifopt_id[:ifopt_id.rindex(':')]
-					if not bereich_id in bereiche:
-						bereiche[bereich_id] = {}
-					bereiche[bereich_id][ifopt_id] = candidates[ifopt_id]
-				for bereich_id in bereiche:
-					(rating, matches) = best_unique_matches(bereiche[bereich_id])
-					if not log_only:
-						self.import_matches(matches)
-					else:
-						self.logger.debug("Matched %s", matches)
-
-			if matchset_count % 2500 == 0:
-				self.logger.info('Matched %s stops...', matchset_count)
-
-		if not log_only:
-			self.logger.info('Imported matches')
-			self.db.execute("""DELETE FROM matches 
-				                WHERE (ifopt_id, osm_id) IN (
-				                 SELECT c2.ifopt_id, c2.osm_id
-				                   FROM matches c1, matches c2 
-				                  WHERE c1.osm_id = c2.osm_id 
-				                    AND c2.rating < c1.rating)""")
-			self.logger.info('Deleted worse matches if one osm_stop is associated with multiple agency stops')
-			self.db.execute("""DELETE FROM matches AS md WHERE (md.ifopt_id, md.osm_id) IN (
-								SELECT mr.ifopt_id, mr.osm_id
-								  FROM matches mr, matches mk 
-								 WHERE mr.ifopt_id=mk.ifopt_id
-								  AND mr.rating < mk.rating
-								  AND mr.name_distance != mk.name_distance)""")
-			self.logger.info('Deleted matches with worse rating if multiple osm_stop matches same agency stop and name differs. If name is equal, official stop might be not have quaies')
-			self.db.commit()
+				matches.extend(component_matches)
+			self.logger.info("Picked %d matches from %d candidates", len(matches), candidate_count)
+
+			if not log_only:
+				if stop_ids is None:
+					self.db.execute("DELETE FROM matches")
+				else:
+					self.db.execute("DELETE FROM matches WHERE ifopt_id IN (SELECT ifopt_id FROM temp.repicked_stop_ids)")
+				loader.insert('matches', matches)
+			if stop_ids is not None:
+				self.db.execute("DROP TABLE temp.repicked_stop_ids")
+
+	def partition_candidates(self, rows, graph):
+		"""
+		Consumes the candidate rows (having ifopt_id and osm_id, ordered by ifopt_id), adding them to graph,
+		and returns {ifopt_id: candidate rows} of all official stops
+		"""
+		stop_rows = {}
+		for row in rows:
+			graph.add(row["ifopt_id"], row["osm_id"])
+			stop_rows.setdefault(row["ifopt_id"], []).append(row)
+		return stop_rows
+
+	def component_parts(self, stop_rows, graph):
+		"""
+		Yields (component, parts) of all components of graph (ordered by component), where parts are the lists of
+		candidate rows of the component, usually one, unless the component is split (see split_component)
+		"""
+		stops_by_component = defaultdict(list)
+		for (ifopt_id, component) in graph.components().items():
+			stops_by_component[component].append(ifopt_id)
+		for component in sorted(stops_by_component):
+			yield (component, [[row for stop_id in sorted(part) for row in stop_rows[stop_id]] for part in split_component(stops_by_component[component])])
+
+	def create_repicked_stop_ids(self, stop_ids):
+		"""
+		Creates table temp.repicked_stop_ids of the stops whose matches are repicked, if stop_ids changed: the parent stations
+		(and all their quais) of stop_ids and the stops sharing an osm stop with their candidates or previous matches.
+		Other stops retain their matches, so the osm stops matched by them are not available to the repicked stops.
+		Returns the number of repicked stops.
+		"""
+		self.db.execute("DROP TABLE IF EXISTS temp.changed_stop_ids")
+		self.db.execute("CREATE TEMP TABLE changed_stop_ids (ifopt_id TEXT PRIMARY KEY, parent_id TEXT)")
+		self.db.executemany("INSERT OR IGNORE INTO temp.changed_stop_ids VALUES (?,?)",
+			((stop_id, parent_station_id(stop_id) if is_quai(stop_id) else stop_id) for stop_id in stop_ids))
+		self.db.execute("DROP TABLE IF EXISTS temp.repicked_stop_ids")
+		self.db.execute("""CREATE TEMP TABLE repicked_stop_ids AS
+			WITH group_stop_ids (ifopt_id) AS (
+				SELECT ifopt_id FROM temp.changed_stop_ids
+				 UNION
+				SELECT candidates.ifopt_id FROM temp.changed_stop_ids changed JOIN candidates
+				    ON candidates.ifopt_id = changed.parent_id
+				    OR candidates.ifopt_id >= changed.parent_id || ':' AND candidates.ifopt_id < changed.parent_id || ';'),
+			shared_osm_ids (osm_id) AS (
+				SELECT osm_id FROM candidates WHERE ifopt_id IN group_stop_ids AND rating >= ?
+				 UNION
+				SELECT osm_id FROM matches WHERE ifopt_id IN group_stop_ids)
+			SELECT ifopt_id FROM group_stop_ids
+			 UNION
+			SELECT ifopt_id FROM candidates WHERE osm_id IN shared_osm_ids AND rating >= ?""",
+			[config.RATING_BELOW_CANDIDATES_ARE_IGNORED, config.RATING_BELOW_CANDIDATES_ARE_IGNORED])
+		self.db.execute("DROP TABLE temp.changed_stop_ids")
+		return self.db.execute("SELECT count(*) FROM temp.repicked_stop_ids").fetchone()[0]
+
+	def log_component_statistics(self, graph):
+		"""
+		Logs the size distribution of graph's components and the largest ones, so pathological clusters become visible
+		"""
+		sizes = graph.component_sizes()
+		if not sizes:
+			self.logger.info("No candidates to pick matches from")
+			return
+		counts = np.array(list(sizes.values()))
+		self.logger.info("Partitioned %s candidates of %s official stops and %s osm stops into %s connected components",
+			counts[:, 2].sum(), counts[:, 0].sum(), counts[:, 1].sum(), len(counts))
+		for (column, name) in enumerate(['official stops', 'osm stops', 'candidates']):
+			(median, percentile_99) = np.percentile(counts[:, column], [50, 99])
+			self.logger.info("%s per component: median %s, 99th percentile %s, max %s", name.capitalize(), median, percentile_99, counts[:, column].max())
+		for (component, (stop_count, osm_count, candidate_count)) in sorted(sizes.items(), key = lambda item: -item[1][2])[:config.PICK_LOGGED_COMPONENTS]:
+			self.logger.info("Component %s: %s official stops, %s osm stops, %s candidates", component, stop_count, osm_count, candidate_count)
+		split_count = sum(1 for (stop_count, osm_count, candidate_count) in sizes.values() if stop_count > config.PICK_COMPONENT_MAX_STOPS)
+		if split_count:
+			self.logger.info("%s components of more than %s official stops are split into parts", split_count, config.PICK_COMPONENT_MAX_STOPS)
+
+	def picked_parts(self, parts, log_only = False):
+		"""
+		Picks parts, the lists of candidate rows of components (see component_parts), and returns an iterator of
+		(part, picked row indexes) in the order of parts
+		"""
+		if self.processes > 1 and not log_only and len(parts) > 1:
+			self.logger.info("Picking matches with %s processes", self.processes)
+			with multiprocessing.Pool(self.processes) as pool:
+				return iter(self.picked_window(parts, self.pick_window(pool, [self.part_candidates(part) for part in parts])))
+		return ((part, pick_component_indexes(self.part_candidates(part))) for part in parts)
+
+	def part_candidates(self, part):
+		"""
+		Returns the rows of part as (ifopt_id, osm_id, rating, name_distance), as needed by pick_component_indexes
+		"""
+		return [(row["ifopt_id"], row["osm_id"], row["rating"], row["name_distance"]) for row in part]
+
+	def pick_window(self, pool, parts):
+		"""
+		Starts picking parts with pool and returns the AsyncResult of the picked chunks (see picked_window).
+		Largest parts are picked first, so huge components don't delay the end, smaller ones in chunks of similar total size.
+		"""
+		order = sorted(range(len(parts)), key = lambda part_index: -len(parts[part_index]))
+		chunk_size = max(1, sum(len(part) for part in parts) // (8 * self.processes))
+		chunks = []
+		chunk = []
+		chunk_rows = 0
+		for part_index in order:
+			chunk.append((part_index, parts[part_index]))
+			chunk_rows += len(parts[part_index])
+			if chunk_rows >= chunk_size:
+				chunks.append(chunk)
+				chunk = []
+				chunk_rows = 0
+		if chunk:
+			chunks.append(chunk)
+		return pool.map_async(pick_chunk, chunks, chunksize = 1)
+
+	def picked_window(self, window, picking):
+		"""
+		Waits until the parts of window are picked (see pick_window) and returns (part, picked row indexes) in the order of window
+		"""
+		picked_parts = [None] * len(window)
+		for picked_chunk in picking.get():
+			for (part_index, row_indexes) in picked_chunk:
+				picked_parts[part_index] = row_indexes
+		return zip(window, picked_parts)
 
 	def simple_pick_matches(self):
 		self.logger.info('Simple match picking...')
@@ -171,11 +402,6 @@ class MatchPicker():
 
 		self.db.commit()
 
-	def import_matches(self, matches):
-		cur = self.db.cursor()
-		cur.executemany("INSERT INTO matches VALUES(?,?,?,?,?,?,?,?,?)", matches)
-		self.db.commit()
-
 # run e.g. via python3 -m log_only -p 'de:08111:2039:' -d out/stops.db
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S', handlers=[
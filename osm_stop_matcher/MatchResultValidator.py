@@ -1,10 +1,19 @@
 import logging
 
 class MatchResultValidator():
-	def __init__(self, db):
+	def __init__(self, db, scope = None):
 		self.db = db
+		# if a prepared RegionScope is given, only assertions on stops in scope are checked
+		self.scope = scope
 		self.logger = logging.getLogger('osm_stop_matcher.MatchResultValidator')
 
+	def in_scope(self, ifopt_id = None, osm_id = None):
+		if not self.scope:
+			return True
+		if ifopt_id:
+			return self.db.execute("SELECT 1 FROM temp.scope_stop_ids WHERE globaleID=?", [ifopt_id]).fetchone() is not None
+		return self.db.execute("SELECT 1 FROM temp.scope_osm_ids WHERE osm_id=?", [osm_id]).fetchone() is not None
+
 	def report_error(self, msg, ifopt_id, osm_id, note):
 		if ifopt_id:
 			cur = self.db.execute("SELECT lat, lon FROM haltestellen_unified WHERE globaleID=?", [ifopt_id])
@@ -17,21 +26,29 @@ class MatchResultValidator():
 			self.logger.warning("%s %s", msg.format(osm_id), "({})".format(note))
 
 	def check_matched(self, ifopt_id, osm_id, note = ''):
+		if not self.in_scope(ifopt_id):
+			return
 		cur = self.db.execute("SELECT * FROM matches WHERE ifopt_id=? AND osm_id = ?", [ifopt_id, osm_id])
 		if not len(cur.fetchall())>0:
 			self.report_error("ERROR: Expected match is missing: {}->{}", ifopt_id, osm_id, note)
 
 	def check_not_matched(self, ifopt_id, osm_id, note = ''):
+		if not self.in_scope(ifopt_id):
+			return
 		cur = self.db.execute("SELECT * FROM matches WHERE ifopt_id=? AND osm_id = ?", [ifopt_id, osm_id])
 		if not len(cur.fetchall())==0:
 			self.report_error("ERROR: Got unexpected match for: {}->{}",ifopt_id, osm_id, note)
 
 	def check_not_to_match(self, osm_id, note = ''):
+		if not self.in_scope(osm_id = osm_id):
+			return
 		cur = self.db.execute("SELECT * FROM osm_stops WHERE osm_id=? ", [osm_id])
 		if not len(cur.fetchall())==0:
 			self.report_error("ERROR: Got unexpected osm_stop to match for:", None, osm_id, note)
 
 	def check_name(self, osm_id, name):
+		if not self.in_scope(osm_id = osm_id):
+			return
 		cur = self.db.execute("SELECT * FROM osm_stops WHERE osm_id=? ", [osm_id])
 		stop = cur.fetchone()
 		if not stop:
@@ -0,0 +1,68 @@
+import logging
+import zlib
+
+from osm_stop_matcher.util import drop_table_if_exists
+
+from . import config
+
+class MatchTrace():
+	"""
+	Records why StopMatcher accepted or rejected the candidates of official stops
+	(reason is one of distance, mode, candidate_limit, name or rating for rejected candidates)
+	and writes them in batches to table match_trace.
+
+	Only stops whose globaleID starts with id_prefix are traced, of these a deterministic
+	sample (by hash of the globaleID) of sample_rate. Without db (e.g. in matching worker processes),
+	records are only buffered until they are popped.
+	"""
+
+	COLUMNS = "ifopt_id, osm_id, decision, reason, distance, name_distance, rating, platform_matches, successor_rating, mode_rating"
+
+	def __init__(self, db, id_prefix = config.MATCH_TRACE_ID_PREFIX, sample_rate = config.MATCH_TRACE_SAMPLE_RATE, batch_size = config.BULK_LOAD_BATCH_SIZE):
+		self.db = db
+		self.id_prefix = id_prefix or ''
+		self.sample_rate = sample_rate
+		self.batch_size = batch_size
+		self.rows = []
+		self.count = 0
+		self.logger = logging.getLogger('osm_stop_matcher.MatchTrace')
+
+	def create_table(self):
+		drop_table_if_exists(self.db, "match_trace")
+		self.db.execute('''CREATE TABLE match_trace
+			(ifopt_id TEXT, osm_id TEXT, decision TEXT, reason TEXT, distance REAL, name_distance REAL, rating REAL,
+			 platform_matches REAL, successor_rating REAL, mode_rating REAL)''')
+
+	def traces(self, stop_id):
+		return (stop_id.startswith(self.id_prefix) and
+			(self.sample_rate >= 1.0 or zlib.crc32(stop_id.encode('utf-8')) % 10000 < self.sample_rate * 10000))
+
+	def accept(self, stop_id, osm_id, distance, name_distance, rating, platform_matches, successor_rating, mode_rating):
+		self.rows.append((stop_id, osm_id, 'accepted', None, distance, name_distance, rating, platform_matches, successor_rating, mode_rating))
+		self.flush_if_full()
+
+	def reject(self, stop_id, osm_id, reason, distance, name_distance = None, rating = None, platform_matches = None, successor_rating = None, mode_rating = None):
+		self.rows.append((stop_id, osm_id, 'rejected', reason, distance, name_distance, rating, platform_matches, successor_rating, mode_rating))
+		self.flush_if_full()
+
+	def extend(self, rows):
+		self.rows.extend(rows)
+		self.flush_if_full()
+
+	def pop_rows(self):
+		rows = self.rows
+		self.rows = []
+		return rows
+
+	def flush_if_full(self):
+		if self.db and len(self.rows) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		self.db.executemany("INSERT INTO match_trace ({}) VALUES (?,?,?,?,?,?,?,?,?,?)".format(self.COLUMNS), self.rows)
+		self.count += len(self.rows)
+		self.rows = []
+
+	def close(self):
+		self.flush()
+		self.logger.info("Traced %s candidate decisions", self.count)
@@ -0,0 +1,27 @@
+from osm_stop_matcher.Rater import TableRater
+
+from . import config
+
+class ModeRater(TableRater):
+	"""
+	Rates whether the osm stop's mode matches the official stop's mode
+	"""
+
+	def stop_value(self, stop):
+		return stop["mode"]
+
+	def candidate_value(self, candidate):
+		return candidate["mode"]
+
+	def rate_values(self, stop_mode, candidate_mode):
+		if (candidate_mode == stop_mode or
+			candidate_mode == 'trainish' and stop_mode in ['train', 'light_rail']):
+			return 1
+		elif not stop_mode:
+			# official stop not served, will result in greater malus
+			return config.UNSERVED_STOP_RATING
+		elif not candidate_mode:
+			# than OSM mode unknown
+			return config.UNKNOWN_MODE_RATING
+		else:
+			return 0
@@ -0,0 +1,81 @@
+import logging
+
+import ngram
+import numpy as np
+
+from osm_stop_matcher.CharacterProfiles import CharacterProfiles
+from osm_stop_matcher.Rater import Rater
+
+from . import config
+
+class NameRater(Rater):
+	"""
+	Rates the similarity of the osm stop's normalized name to the official stop's normalized short and long name.
+	Batches are rated via the character profiles of the osm stop names, single candidates via ngram.
+	"""
+
+	def __init__(self):
+		self.logger = logging.getLogger('osm_stop_matcher.NameRater')
+
+	def prepare(self, osm_stop_list):
+		normalized_osm_names = [stop["name_normalized"] for stop in osm_stop_list]
+		self.osm_name_profiles = CharacterProfiles(normalized_osm_names)
+		self.osm_name_rows = np.array([self.osm_name_profiles.row(name) for name in normalized_osm_names], dtype=np.intp)
+		self.osm_without_name = np.array([not name for name in normalized_osm_names], dtype=bool)
+
+	def rate(self, stop, candidate):
+		return self.rate_name_equivalence(stop, candidate)[0]
+
+	def rate_name_equivalence(self, stop, candidate):
+		"""
+		Returns the name similarity and the official stop name (short or long) it was rated with
+		"""
+		osm_name = candidate["name_normalized"]
+		name_short = stop["name_normalized"]
+		name_long = stop["name_long_normalized"]
+
+		if osm_name and osm_name in name_short:
+			# If full (normalized) osm_name is part of the official stop_name,
+			# we deem this a full match. I.E. as official stop names often include 
+			# additional city/settelment names
+			return (1.0, stop["Haltestelle"])
+
+		name_distance_short_name = ngram.NGram.compare(name_short, osm_name, N=1)
+		name_distance_long_name = ngram.NGram.compare(name_long, osm_name, N=1)
+		if not name_short and not name_long:
+			self.logger.debug("Stop %s has no name. Use fix name_distance", stop["globaleID"])
+			name_distance_short_name = config.MINIMUM_NAME_SIMILARITY
+			name_distance_long_name = config.MINIMUM_NAME_SIMILARITY
+		elif not osm_name:
+			self.logger.debug("OSM stop %s has no name. Use fix name_distance", candidate["id"])
+			name_distance_short_name = config.MINIMUM_NAME_SIMILARITY
+			name_distance_long_name = config.MINIMUM_NAME_SIMILARITY
+		
+		if name_distance_short_name > name_distance_long_name:
+			return (name_distance_short_name, stop["Haltestelle"])
+		else:
+			return (name_distance_long_name, stop["Haltestelle_lang"])
+
+	def name_similarities(self, batch):
+		"""
+		Computes the ngram similarities of the normalized short and long names of the batch's stops
+		to the normalized names of their candidates in one step.
+		"""
+		stops = batch.stops
+		normalized_names = [stop[name_column] for name_column in ("name_normalized", "name_long_normalized") for stop in stops]
+		(profiles, lengths) = self.osm_name_profiles.profile(normalized_names)
+		osm_name_rows = self.osm_name_rows[batch.candidate_ids]
+		short_name_similarities = self.osm_name_profiles.similarities(profiles[batch.stop_indexes], lengths[batch.stop_indexes], osm_name_rows)
+		long_name_indexes = batch.stop_indexes + len(stops)
+		long_name_similarities = self.osm_name_profiles.similarities(profiles[long_name_indexes], lengths[long_name_indexes], osm_name_rows)
+		return (short_name_similarities, long_name_similarities)
+
+	def rate_batch(self, batch):
+		(short_name_similarities, long_name_similarities) = self.name_similarities(batch)
+		stops_without_name = np.array([not stop["name_normalized"] and not stop["name_long_normalized"] for stop in batch.stops], dtype=bool)
+		without_name = stops_without_name[batch.stop_indexes] | self.osm_without_name[batch.candidate_ids]
+		similarities = np.where(without_name, config.MINIMUM_NAME_SIMILARITY,
+			np.where(short_name_similarities > long_name_similarities, short_name_similarities, long_name_similarities))
+		name_contained = np.array([bool(candidate["name_normalized"]) and candidate["name_normalized"] in stop["name_normalized"]
+			for (stop, candidate) in batch.pairs()], dtype=bool)
+		return np.where(name_contained, 1.0, similarities)
@@ -1,5 +1,6 @@
 import csv
 import datetime
+from .BulkLoader import BulkLoader
 from .util import xstr, drop_table_if_exists
 
 def reformat_date(date):
@@ -23,7 +24,7 @@ class NvbwStopsImporter():
 
 		with open(stops_file,'r',encoding='iso-8859-1') as csvfile:
 			dr = csv.DictReader(csvfile, delimiter=';', quotechar='"')
-			to_db = [(
+			to_db = ((
 				xstr(row['Landkreis']), 
 				xstr(row['Gemeinde']), 
 				xstr(row['Ortsteil']),
@@ -56,14 +57,15 @@ class NvbwStopsImporter():
 				xstr(row['Schmalspurbahn_Verbindung']),
 				xstr(row['Eisenbahn_Verbindung']),
 				xstr(row['Faehren_Verbindung']),
-				) for row in dr]
+				) for row in dr)
 
-			cur.executemany("""INSERT INTO haltestellen (Landkreis, Gemeinde, Ortsteil, Haltestelle, Haltestelle_lang, 
+			with BulkLoader(self.db) as loader:
+				loader.insert('haltestellen', to_db, """Landkreis, Gemeinde, Ortsteil, Haltestelle, Haltestelle_lang, 
 					HalteBeschreibung, globaleID, HalteTyp, gueltigAb, gueltigBis, lat, lon, Name_Bereich, globaleID_Bereich, 
 					gueltigAbBereich, gueltigBisBereich, lat_Bereich, lon_Bereich, Name_Steig, globaleID_Steig, 
 					gueltigAbSteig, gueltigBisSteig, lat_Steig, lon_Steig, 
 					Fuss_Verbindung, Fahrrad_Verbindung, Individualverkehr_Verbindung, Bus_Verbindung, Strassenbahn_Verbindung, 
-					Schmalspurbahn_Verbindung, Eisenbahn_Verbindung, Faehren_Verbindung) VALUES (?{})""".format(",?"*31), to_db)
+					Schmalspurbahn_Verbindung, Eisenbahn_Verbindung, Faehren_Verbindung""")
 
 		# workaround https://github.com/mfdz/nvbw-haltestellen-issues/issues/25
 		cur.execute("UPDATE haltestellen SET gueltigBis = NULL WHERE gueltigBis = Date('1970-01-01')")
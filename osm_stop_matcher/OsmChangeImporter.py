@@ -0,0 +1,298 @@
+import logging
+import osmium
+from shapely.geometry import Point
+
+from osm_stop_matcher.BulkLoader import BulkLoader
+from osm_stop_matcher.OsmStopsImporter import OsmStopsImporter, PlatformNodes
+from osm_stop_matcher.util import osm_id, parse_osm_id
+
+from . import config
+
+# osm_stops columns besides the geometry, next/prev_stops and match_state
+OSM_STOPS_RAW_COLUMNS = """osm_id, name, network, operator, railway, highway, public_transport, lat, lon,
+	mode, type, ref, ref_key, assumed_platform, empty_name, kerb_approach_aid, wheelchair, tactile_paving"""
+
+class OsmChangeImporter(OsmStopsImporter):
+	"""
+	Applies an OSM change file (.osc, .osc.gz) to the database of a previous full import.
+
+	Changes are applied to the raw tables (osm_stops_raw, osm_route_edges, platform_nodes,
+	osm_node_locations, osm_stop_areas, osm_stop_area_members). Afterwards, the derived
+	osm_stops are recomputed for the neighbourhood of the changed stops only:
+	the usual post-processing runs on a working set of raw stops in temp tables
+	which shadow the main tables, and only the affected stops are written back.
+
+	Note: post-processing rules are evaluated against neighbours within
+	config.OSM_UPDATE_NEIGHBOURHOOD of the affected stops. Cascading effects
+	reaching further than this are not propagated. Ambiguous inheritance (a node
+	of multiple platform ways, a member of multiple stop areas) may resolve
+	differently than in a full import.
+	"""
+
+	def __init__(self, db, osc_file):
+		osmium.SimpleHandler.__init__(self)
+		self.logger = logging.getLogger('osm_stop_matcher.OsmChangeImporter')
+		self.db = db
+		self.loader = BulkLoader(db)
+		self.init_collected_data()
+		self.changed_nodes = {}
+		self.changed_ways = {}
+		self.changed_relations = {}
+		self.apply_file(osc_file)
+		self.logger.info("Read %s changed nodes, %s ways and %s relations from %s",
+			len(self.changed_nodes), len(self.changed_ways), len(self.changed_relations), osc_file)
+		with self.loader:
+			changed_stops = self.apply_changes()
+			self.logger.info("Applied changes to raw osm tables")
+			self.update_neighbourhood(changed_stops)
+			self.logger.info("Updated osm_stops in the neighbourhood of %s changed stops", len(changed_stops))
+
+	def is_newer(self, changes, osm_object):
+		return not osm_object.id in changes or changes[osm_object.id][0] < osm_object.version
+
+	def node(self, n):
+		if self.is_newer(self.changed_nodes, n):
+			location = (n.location.lon, n.location.lat) if not n.deleted and n.location.valid() else None
+			self.changed_nodes[n.id] = (n.version, n.deleted, {tag.k: tag.v for tag in n.tags}, location)
+
+	def way(self, w):
+		if self.is_newer(self.changed_ways, w):
+			self.changed_ways[w.id] = (w.version, w.deleted, {tag.k: tag.v for tag in w.tags}, [n.ref for n in w.nodes])
+
+	def relation(self, r):
+		if self.is_newer(self.changed_relations, r):
+			members = [osmium.osm.RelationMember(m.ref, m.type, m.role) for m in r.members]
+			self.changed_relations[r.id] = (r.version, r.deleted, {tag.k: tag.v for tag in r.tags}, members)
+
+	def store_osm_stops(self, rows):
+		self.loader.insert('osm_stops_raw', rows, OSM_STOPS_RAW_COLUMNS)
+
+	def delete_raw_stops(self, osm_ids):
+		self.db.executemany("DELETE FROM osm_stops_raw WHERE osm_id=?", [(osm_id,) for osm_id in osm_ids])
+
+	def apply_changes(self):
+		"""
+		Applies the collected changes to the raw tables and returns the set of osm_ids
+		whose raw stop, route edges or stop area membership changed.
+		"""
+		self.old_locations = self.raw_locations(["n" + str(node_id) for node_id in self.changed_nodes] + 
+			["w" + str(way_id) for way_id in self.changed_ways])
+		changed_stops = set()
+		changed_stops.update(self.apply_node_changes())
+		changed_stops.update(self.apply_way_changes())
+		changed_stops.update(self.apply_relation_changes())
+		self.store_osm_stops(self.rows_to_import)
+		self.rows_to_import = []
+		return changed_stops
+
+	def apply_node_changes(self):
+		node_ids = ["n" + str(node_id) for node_id in self.changed_nodes]
+		changed_stops = self.existing_ids("SELECT osm_id FROM osm_stops_raw WHERE osm_id=?", node_ids)
+		self.delete_raw_stops(node_ids)
+		for (node_id, (version, deleted, tags, location)) in self.changed_nodes.items():
+			stop_type = self.extract_stop_type(tags) if not deleted else None
+			if stop_type and location:
+				self.extract_and_store_stop(stop_type, "n" + str(node_id), tags, Point(location))
+				changed_stops.add("n" + str(node_id))
+
+		# Moved nodes of stop ways require updating the way's location
+		way_nodes = self.existing_ids("SELECT node_id FROM osm_node_locations WHERE node_id=?", node_ids)
+		rows = []
+		for node_id in way_nodes:
+			location = self.changed_nodes[int(node_id[1:])][3]
+			if location:
+				rows.append((location[1], location[0], node_id))
+		self.db.executemany("UPDATE osm_node_locations SET lat=?, lon=? WHERE node_id=?", rows)
+		self.moved_ways = self.existing_ids("SELECT way_id FROM platform_nodes WHERE node_id=?", [row[2] for row in rows])
+		return changed_stops
+
+	def apply_way_changes(self):
+		way_ids = ["w" + str(way_id) for way_id in self.changed_ways]
+		changed_stops = self.existing_ids("SELECT osm_id FROM osm_stops_raw WHERE osm_id=?", way_ids)
+
+		self.old_locations.update(self.raw_locations(self.moved_ways))
+		self.delete_raw_stops(way_ids)
+
+		ways = {}
+		for way_id in self.moved_ways.difference(way_ids):
+			cur = self.db.execute("SELECT type FROM osm_stops_raw WHERE osm_id=?", [way_id])
+			stop = cur.fetchone()
+			if stop:
+				cur = self.db.execute("SELECT node_id FROM platform_nodes WHERE way_id=? ORDER BY rowid", [way_id])
+				ways[int(way_id[1:])] = (stop[0], None, [int(row[0][1:]) for row in cur.fetchall()])
+		for (way_id, (version, deleted, tags, node_refs)) in self.changed_ways.items():
+			stop_type = self.extract_stop_type(tags) if not deleted else None
+			if stop_type:
+				ways[way_id] = (stop_type, tags, node_refs)
+
+		self.db.executemany("DELETE FROM platform_nodes WHERE way_id=?", [(way_id,) for way_id in way_ids])
+		locations = self.node_locations(ways)
+		for (way_id, (stop_type, tags, node_refs)) in ways.items():
+			if tags is None:
+				# Only the geometry of this way changed
+				try:
+					location = self.way_location(node_refs, locations)
+					self.db.execute("UPDATE osm_stops_raw SET lat=?, lon=? WHERE osm_id=?", (location.y, location.x, "w" + str(way_id)))
+				except Exception as err:
+					self.logger.error("Error updating location of way %s: %s", way_id, err)
+			else:
+				self.store_stop_way(way_id, self.extract_stop(stop_type, "w" + str(way_id), tags), node_refs, locations)
+			changed_stops.add("w" + str(way_id))
+
+		self.loader.insert('platform_nodes', self.platform_nodes)
+		self.db.executemany("INSERT OR REPLACE INTO osm_node_locations VALUES (?,?,?)",
+			[("n" + str(ref), lat, lon) for (ref, (lon, lat)) in self.way_node_locations.items()])
+		self.platform_nodes = PlatformNodes()
+		return changed_stops
+
+	def node_locations(self, ways):
+		locations = {}
+		for (way_id, (stop_type, tags, node_refs)) in ways.items():
+			for ref in node_refs:
+				if ref in self.changed_nodes and self.changed_nodes[ref][3]:
+					locations[ref] = self.changed_nodes[ref][3]
+				elif not ref in locations:
+					cur = self.db.execute("""SELECT lon, lat FROM osm_node_locations WHERE node_id=?
+						UNION ALL SELECT lon, lat FROM osm_stops_raw WHERE osm_id=?""", ["n" + str(ref)] * 2)
+					location = cur.fetchone()
+					if location:
+						locations[ref] = (location[0], location[1])
+					else:
+						# Only stop way nodes are retained, so a way becoming a stop without its nodes being part
+						# of the change can't be located. It will be imported with the next full import.
+						self.logger.warning("No location for node %s of stop way %s", ref, way_id)
+		return locations
+
+	def apply_relation_changes(self):
+		changed_stops = set()
+		changed_edges = set()
+		for (relation_id, (version, deleted, tags, members)) in self.changed_relations.items():
+			cur = self.db.execute("SELECT pred_id, succ_id FROM osm_route_edges WHERE route_id=?", [str(relation_id)])
+			changed_edges.update(cur.fetchall())
+			cur = self.db.execute("SELECT member_id FROM osm_stop_area_members WHERE stop_area_id=?", [str(relation_id)])
+			changed_stops.update(row[0] for row in cur.fetchall())
+			self.db.execute("DELETE FROM osm_route_edges WHERE route_id=?", [str(relation_id)])
+			self.db.execute("DELETE FROM osm_stop_areas WHERE osm_id=?", [relation_id])
+			self.db.execute("DELETE FROM osm_stop_area_members WHERE stop_area_id=?", [str(relation_id)])
+			if not deleted:
+				OsmStopsImporter.relation(self, osmium.osm.mutable.Relation(id = relation_id, members = members, tags = tags))
+
+		route_edges = list(self.route_edges.rows())
+		self.loader.insert('osm_route_edges', route_edges)
+		changed_edges.update((pred_id, succ_id) for (route_id, pred_id, succ_id) in route_edges)
+		for (pred_id, succ_id) in changed_edges:
+			changed_stops.update((pred_id, succ_id))
+			if config.OSM_EXPORT_SUCCESSORS:
+				self.db.execute("DELETE FROM successor WHERE pred_id=? AND succ_id=?", (pred_id, succ_id))
+				self.db.execute("""INSERT INTO successor SELECT DISTINCT pred_id, succ_id FROM osm_route_edges 
+					WHERE pred_id=? AND succ_id=?""", (pred_id, succ_id))
+		# A stop belongs to the last stop area it is member of, so updated areas take precedence
+		member_ids = [osm_id(key) for key in self.area_for_stop]
+		self.db.executemany("DELETE FROM osm_stop_area_members WHERE member_id=?", [(member_id,) for member_id in member_ids])
+		changed_stops.update(member_ids)
+		self.store_stop_areas()
+		return changed_stops
+
+	def raw_locations(self, osm_ids):
+		locations = {}
+		for osm_id in osm_ids:
+			stop = self.db.execute("SELECT lat, lon FROM osm_stops_raw WHERE osm_id=?", [osm_id]).fetchone()
+			if stop:
+				locations[osm_id] = (stop[0], stop[1])
+		return locations
+
+	def stops_in_vicinity(self, lat, lon):
+		radius = config.OSM_UPDATE_NEIGHBOURHOOD
+		cur = self.db.execute("""SELECT osm_id FROM osm_stops_raw
+			WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?""",
+			(lat - radius, lat + radius, lon - radius, lon + radius))
+		return [row[0] for row in cur.fetchall()]
+
+	def existing_ids(self, query, ids):
+		existing = set()
+		for id in ids:
+			row = self.db.execute(query, [id]).fetchone()
+			if row:
+				existing.add(row[0])
+		return existing
+
+	def neighbours(self, osm_ids):
+		"""
+		Returns osm_ids which are within config.OSM_UPDATE_NEIGHBOURHOOD of the given stops
+		or related to them via route edges, platform ways or stop areas.
+		"""
+		neighbours = set(osm_ids)
+		for osm_id in osm_ids:
+			for query in ["SELECT succ_id FROM osm_route_edges WHERE pred_id=?",
+				"SELECT pred_id FROM osm_route_edges WHERE succ_id=?",
+				"SELECT node_id FROM platform_nodes WHERE way_id=?",
+				"SELECT way_id FROM platform_nodes WHERE node_id=?",
+				"""SELECT o.member_id FROM osm_stop_area_members m JOIN osm_stop_area_members o
+				    ON o.stop_area_id = m.stop_area_id WHERE m.member_id=?"""]:
+				neighbours.update(row[0] for row in self.db.execute(query, [osm_id]).fetchall())
+			stop = self.db.execute("SELECT lat, lon FROM osm_stops_raw WHERE osm_id=?", [osm_id]).fetchone()
+			if stop:
+				neighbours.update(self.stops_in_vicinity(stop[0], stop[1]))
+		return neighbours
+
+	def update_neighbourhood(self, changed_stops):
+		# Deleted or moved stops affect their former neighbours as well
+		for (lat, lon) in self.old_locations.values():
+			changed_stops.update(self.stops_in_vicinity(lat, lon))
+		affected = self.neighbours(changed_stops)
+		working_set = self.neighbours(affected)
+		self.logger.info("Recomputing %s affected stops using a working set of %s stops", len(affected), len(working_set))
+
+		self.create_working_set_tables(working_set, affected)
+		self.add_prev_and_next_stop_names()
+		self.update_infos_inherited_from_stop_areas_and_platforms()
+		self.deduce_missing_names_from_close_by_stops()
+		self.only_keep_more_specific_stops_for_matching()
+
+		self.db.execute("DELETE FROM main.osm_stops WHERE osm_id IN (SELECT osm_id FROM temp.affected)")
+		self.db.execute("""INSERT INTO main.osm_stops ({0}, next_stops, prev_stops)
+			SELECT {0}, next_stops, prev_stops FROM temp.osm_stops
+			 WHERE osm_id IN (SELECT osm_id FROM temp.affected)""".format(OSM_STOPS_RAW_COLUMNS))
+		self.db.execute("""UPDATE main.osm_stops SET the_geom = MakePoint(lon, lat, 4326)
+			WHERE osm_id IN (SELECT osm_id FROM temp.affected)""")
+		for table in ['osm_stops', 'platform_nodes', 'osm_stop_area_members', 'working_set', 'affected']:
+			self.db.execute("DROP TABLE temp.{}".format(table))
+
+	def route_successors(self):
+		"""
+		Returns the route successors and stop way nodes of the working set
+		"""
+		cur = self.db.execute("""SELECT DISTINCT pred_id, succ_id FROM main.osm_route_edges
+			 WHERE pred_id IN (SELECT osm_id FROM temp.working_set) OR succ_id IN (SELECT osm_id FROM temp.working_set)""")
+		successors = cur.fetchall()
+		nodes_of_way = {}
+		for (way_id, node_id) in self.db.execute("SELECT way_id, node_id FROM temp.platform_nodes ORDER BY rowid"):
+			nodes_of_way.setdefault(way_id, []).append(node_id)
+		return (successors, nodes_of_way)
+
+	def create_working_set_tables(self, working_set, affected):
+		"""
+		Creates temp tables which shadow osm_stops, platform_nodes and osm_stop_area_members
+		for the working set, so that the post-processing of OsmStopsImporter operates on them.
+		"""
+		self.db.execute("CREATE TEMP TABLE working_set (osm_id TEXT PRIMARY KEY)")
+		self.db.executemany("INSERT INTO temp.working_set VALUES (?)", [(osm_id,) for osm_id in working_set])
+		self.db.execute("CREATE TEMP TABLE affected (osm_id TEXT PRIMARY KEY)")
+		self.db.executemany("INSERT INTO temp.affected VALUES (?)", [(osm_id,) for osm_id in affected])
+		self.db.execute("""CREATE TEMP TABLE osm_stops AS
+			SELECT {} FROM main.osm_stops_raw WHERE osm_id IN (SELECT osm_id FROM temp.working_set)""".format(OSM_STOPS_RAW_COLUMNS))
+		self.db.execute("""CREATE TEMP TABLE platform_nodes AS
+			SELECT * FROM main.platform_nodes
+			 WHERE way_id IN (SELECT osm_id FROM temp.working_set) OR node_id IN (SELECT osm_id FROM temp.working_set)""")
+		self.db.execute("""CREATE TEMP TABLE osm_stop_area_members AS
+			SELECT * FROM main.osm_stop_area_members WHERE member_id IN (SELECT osm_id FROM temp.working_set)""")
+		self.db.execute("CREATE INDEX temp.tmp_pl_nd_idx ON platform_nodes(node_id)")
+		self.db.execute("CREATE INDEX temp.tmp_pl_wy_idx ON platform_nodes(way_id)")
+		self.db.execute("CREATE INDEX temp.tmp_stops_lat_lon ON osm_stops(lat,lon)")
+		self.db.execute("CREATE INDEX temp.tmp_stops_id_idx ON osm_stops(osm_id)")
+
+		self.area_for_stop = {}
+		cur = self.db.execute("""SELECT m.member_id, a.osm_id, a.name FROM temp.osm_stop_area_members m
+			JOIN main.osm_stop_areas a ON a.osm_id = m.stop_area_id""")
+		for row in cur.fetchall():
+			self.area_for_stop[parse_osm_id(row[0])] = {"id": row[1], "name": row[2]}
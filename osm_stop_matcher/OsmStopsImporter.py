@@ -1,35 +1,336 @@
 import logging
+import multiprocessing
+from array import array
+from collections import namedtuple
 import osmium
 import re
+import resource
+import struct
 import shapely.wkb as wkblib
-from shapely.geometry import Point
+from shapely.geometry import LineString, Point
 import sys
-from osm_stop_matcher.util import  drop_table_if_exists
+from osm_stop_matcher.util import  drop_table_if_exists, osm_key, osm_id, osm_type_and_ref, parse_osm_id, peak_memory_mb
+
+from . import config
+from .BulkLoader import BulkLoader
+from .OsmStopsPruner import OsmStopsPruner
 
 # A global factory that creates WKB from a osmium geometry
 wkbfab = osmium.geom.WKBFactory()
 
+# Tags of nodes and ways which extract_stop_type accepts as stop
+STOP_TAGS = (
+	('public_transport', 'station'),
+	('public_transport', 'stop_position'),
+	('public_transport', 'platform'),
+	('railway', 'stop'),
+	('railway', 'tram_stop'),
+	('railway', 'halt'),
+	('highway', 'bus_stop'),
+	)
+
+# A stop as extracted from its tags, whose fields are the columns of table osm_stops, so it is inserted as is.
+# Tags are not retained.
+OsmStop = namedtuple('OsmStop', ['osm_id', 'name', 'network', 'operator', 'railway', 'highway', 'public_transport', 'lat', 'lon',
+	'mode', 'type', 'ref', 'ref_key', 'assumed_platform', 'empty_name', 'kerb_approach_aid', 'wheelchair', 'tactile_paving'])
+
+class RouteEdges():
+	"""
+	(route, predecessor, successor) edges between consecutive route members.
+	Members are stored as osm_keys in typed arrays, which require a fraction
+	of the memory of tuples of osm_id strings.
+	"""
+	__slots__ = ('route_ids', 'pred_keys', 'succ_keys')
+
+	def __init__(self):
+		self.route_ids = array('q')
+		self.pred_keys = array('q')
+		self.succ_keys = array('q')
+
+	def __len__(self):
+		return len(self.route_ids)
+
+	def append(self, route_id, pred_key, succ_key):
+		self.route_ids.append(route_id)
+		self.pred_keys.append(pred_key)
+		self.succ_keys.append(succ_key)
+
+	def extend(self, edges):
+		self.route_ids.extend(edges.route_ids)
+		self.pred_keys.extend(edges.pred_keys)
+		self.succ_keys.extend(edges.succ_keys)
+
+	def rows(self):
+		"""
+		Yields (route_id, pred_id, succ_id) as stored in osm_route_edges
+		"""
+		for (route_id, pred_key, succ_key) in zip(self.route_ids, self.pred_keys, self.succ_keys):
+			yield (str(route_id), osm_id(pred_key), osm_id(succ_key))
+
+	def successors(self):
+		"""
+		Returns the distinct (pred_key, succ_key) pairs
+		"""
+		return set(zip(self.pred_keys, self.succ_keys))
+
+class PlatformNodes():
+	"""
+	(way, node) pairs of stop ways, stored as ids in typed arrays.
+	Iterating yields (way_id, node_id) as stored in platform_nodes, e.g. ('w1', 'n2').
+	"""
+	__slots__ = ('way_ids', 'node_ids')
+
+	def __init__(self):
+		self.way_ids = array('q')
+		self.node_ids = array('q')
+
+	def __len__(self):
+		return len(self.way_ids)
+
+	def __iter__(self):
+		for (way_id, node_id) in zip(self.way_ids, self.node_ids):
+			yield ("w" + str(way_id), "n" + str(node_id))
+
+	def add_way(self, way_id, node_refs):
+		self.way_ids.extend([way_id] * len(node_refs))
+		self.node_ids.extend(node_refs)
+
+	def nodes_of_ways(self, way_ids):
+		"""
+		Returns the node_ids per way_id (both as stored in platform_nodes) of the given ways
+		"""
+		nodes = {}
+		for (way_id, node_id) in zip(self.way_ids, self.node_ids):
+			if way_id in way_ids:
+				nodes.setdefault("w" + str(way_id), []).append("n" + str(node_id))
+		return nodes
+
+class StopWaysAndRelationsCollector(osmium.SimpleHandler):
+	"""
+	First pass of the prefiltered import: collects stop ways (without locations)
+	and route/stop_area relations. Nodes are not read at all.
+	"""
+	def __init__(self, importer):
+		super(StopWaysAndRelationsCollector,self).__init__()
+		self.importer = importer
+
+	def way(self, w):
+		self.importer.collect_stop_way(w)
+
+	def relation(self, r):
+		self.importer.relation(r)
+
+	def filters(self):
+		return [
+			osmium.filter.TagFilter(*STOP_TAGS).enable_for(osmium.osm.WAY),
+			osmium.filter.KeyFilter('route', 'public_transport').enable_for(osmium.osm.RELATION),
+			]
+
+class StopNodesCollector(osmium.SimpleHandler):
+	"""
+	Second pass of the prefiltered import: stores all stop nodes.
+	"""
+	def __init__(self, importer):
+		super(StopNodesCollector,self).__init__()
+		self.importer = importer
+
+	def node(self, n):
+		self.importer.node(n)
+
+	def filters(self):
+		return [osmium.filter.TagFilter(*STOP_TAGS).enable_for(osmium.osm.NODE)]
+
+class StopWayNodeLocationsCollector(osmium.SimpleHandler):
+	"""
+	Third pass of the prefiltered import: retrieves the locations of the nodes
+	of the stop ways collected in the first pass.
+	"""
+	def __init__(self, node_ids):
+		super(StopWayNodeLocationsCollector,self).__init__()
+		self.node_ids = node_ids
+		self.locations = {}
+
+	def node(self, n):
+		self.locations[n.id] = (n.location.lon, n.location.lat)
+
+	def filters(self):
+		return [osmium.filter.IdFilter(self.node_ids).enable_for(osmium.osm.NODE)]
+
+def read_varint(buffer, pos):
+	result = 0
+	shift = 0
+	while True:
+		byte = buffer[pos]
+		pos += 1
+		result |= (byte & 0x7f) << shift
+		if not byte & 0x80:
+			return (result, pos)
+		shift += 7
+
+def parse_blob_header(buffer):
+	"""
+	Returns (type, datasize) of a protobuf encoded pbf BlobHeader.
+	"""
+	pos = 0
+	blob_type = None
+	datasize = 0
+	while pos < len(buffer):
+		(key, pos) = read_varint(buffer, pos)
+		(field, wire_type) = (key >> 3, key & 0x07)
+		if wire_type == 0:
+			(value, pos) = read_varint(buffer, pos)
+			if field == 3:
+				datasize = value
+		elif wire_type == 2:
+			(length, pos) = read_varint(buffer, pos)
+			if field == 1:
+				blob_type = buffer[pos:pos+length].decode('utf-8')
+			pos += length
+		elif wire_type == 1:
+			pos += 8
+		elif wire_type == 5:
+			pos += 4
+		else:
+			raise ValueError("Unsupported wire type {} in BlobHeader".format(wire_type))
+	return (blob_type, datasize)
+
+def pbf_blocks(osm_file):
+	"""
+	Yields (type, offset, length) for every block of a pbf file.
+	"""
+	with open(osm_file, 'rb') as f:
+		offset = 0
+		while True:
+			prefix = f.read(4)
+			if len(prefix) < 4:
+				return
+			(header_length,) = struct.unpack('>I', prefix)
+			(blob_type, datasize) = parse_blob_header(f.read(header_length))
+			length = 4 + header_length + datasize
+			f.seek(offset + length)
+			yield (blob_type, offset, length)
+			offset += length
+
+def split_pbf(osm_file, shard_size):
+	"""
+	Splits a pbf file into consecutive ranges of data blocks of about shard_size bytes.
+	Returns the byte range of the OSMHeader block and the list of shard byte ranges.
+	"""
+	header = None
+	shards = []
+	start = None
+	end = None
+	for (blob_type, offset, length) in pbf_blocks(osm_file):
+		if blob_type == 'OSMHeader':
+			header = (offset, offset + length)
+			continue
+		if start is None:
+			start = offset
+		end = offset + length
+		if end - start >= shard_size:
+			shards.append((start, end))
+			start = None
+	if start is not None:
+		shards.append((start, end))
+	return (header, shards)
+
+def read_pbf_shard(osm_file, header, shard):
+	with open(osm_file, 'rb') as f:
+		f.seek(header[0])
+		buffer = f.read(header[1] - header[0])
+		f.seek(shard[0])
+		return buffer + f.read(shard[1] - shard[0])
+
+# Workers are forked from a fresh server process, as workers forked from a process which already
+# read osm data may deadlock in libosmium's thread pool
+shard_pool_context = multiprocessing.get_context('forkserver')
+
+# Node ids whose locations are retrieved by parse_pbf_shard_way_node_locations.
+# Set per worker process by the pool initializer to avoid sending them with every shard. 
+shard_way_node_ids = None
+
+def init_way_node_locations_worker(node_ids):
+	global shard_way_node_ids
+	shard_way_node_ids = node_ids
+
+def parse_pbf_shard_ways_and_relations(task):
+	(osm_file, header, shard) = task
+	parser = OsmStopsShardParser()
+	collector = StopWaysAndRelationsCollector(parser)
+	collector.apply_buffer(read_pbf_shard(osm_file, header, shard), 'pbf', filters = collector.filters())
+	return (parser.stop_ways, parser.route_edges, parser.stop_areas, parser.area_for_stop)
+
+def parse_pbf_shard_nodes(task):
+	(osm_file, header, shard) = task
+	parser = OsmStopsShardParser()
+	collector = StopNodesCollector(parser)
+	collector.apply_buffer(read_pbf_shard(osm_file, header, shard), 'pbf', filters = collector.filters())
+	return parser.stored_rows + parser.rows_to_import
+
+def parse_pbf_shard_way_node_locations(task):
+	(osm_file, header, shard) = task
+	collector = StopWayNodeLocationsCollector(shard_way_node_ids)
+	collector.apply_buffer(read_pbf_shard(osm_file, header, shard), 'pbf', filters = collector.filters())
+	return collector.locations
 
 class OsmStopsImporter(osmium.SimpleHandler):
-	counter = 0
-	pred = {}
-	succ = {}
-	stop_areas = {}
-	area_for_stop = {}
-	platform_nodes = []
-
-	def __init__(self, db, osm_file):
+
+	def __init__(self, db, osm_file, prefilter = config.OSM_IMPORT_PREFILTER, processes = config.OSM_IMPORT_PROCESSES):
 		super(OsmStopsImporter,self).__init__()
 		self.logger = logging.getLogger('osm_stop_matcher.OsmStopsImporter')
 		self.db = db
-		self.rows_to_import = [] 
-		self.setup_osm_tables()
-		self.logger.info("Created osm tables")
-		self.apply_file(osm_file, locations=True)
-		self.logger.info("Loaded osm data")
-		self.export_osm_stops()
-		self.logger.info("Exported osm data")
-		
+		self.loader = BulkLoader(db)
+		self.init_collected_data()
+		with self.loader:
+			self.setup_osm_tables()
+			self.logger.info("Created osm tables")
+			if prefilter and processes > 1 and osm_file.endswith('.pbf'):
+				self.apply_file_sharded(osm_file, processes)
+			elif prefilter:
+				self.apply_file_prefiltered(osm_file)
+			else:
+				self.apply_file(osm_file, locations=True)
+			self.logger.info("Loaded osm data")
+			self.export_osm_stops()
+			self.logger.info("Exported osm data")
+		self.logger.info("Peak memory: %s MB, largest worker process: %s MB", peak_memory_mb(), peak_memory_mb(resource.RUSAGE_CHILDREN))
+
+	def init_collected_data(self):
+		self.counter = 0
+		self.rows_to_import = []
+		self.stop_ways = []
+		self.stop_areas = {}
+		# stop_area dict per osm_key of member
+		self.area_for_stop = {}
+		self.platform_nodes = PlatformNodes()
+		self.route_edges = RouteEdges()
+		self.way_node_locations = {}
+
+	def apply_file_prefiltered(self, osm_file):
+		"""
+		Imports osm_file in three filtered passes, so that only stops, route and 
+		stop_area relations and the nodes of stop ways are handed to python 
+		and only the locations of stop way nodes are retained.
+		"""
+		collector = StopWaysAndRelationsCollector(self)
+		collector.apply_file(osm_file, filters = collector.filters())
+		self.logger.info("Collected %s stop ways and route/stop_area relations", len(self.stop_ways))
+
+		collector = StopNodesCollector(self)
+		collector.apply_file(osm_file, filters = collector.filters())
+		self.logger.info("Collected stop nodes")
+
+		node_ids = set()
+		for (way_id, stop, node_refs) in self.stop_ways:
+			node_ids.update(node_refs)
+		collector = StopWayNodeLocationsCollector(node_ids)
+		collector.apply_file(osm_file, filters = collector.filters())
+		self.logger.info("Collected locations of %s stop way nodes", len(collector.locations))
+
+		for (way_id, stop, node_refs) in self.stop_ways:
+			self.store_stop_way(way_id, stop, node_refs, collector.locations)
+		self.stop_ways = []
+
 	def setup_osm_tables(self):
 		drop_table_if_exists(self.db, 'osm_stops')
 		self.db.execute('''CREATE TABLE osm_stops
@@ -46,13 +347,23 @@ class OsmStopsImporter(osmium.SimpleHandler):
 			(stop_area_id TEXT, member_id TEXT)''')
 
 		drop_table_if_exists(self.db, 'successor')
-		self.db.execute('''CREATE TABLE successor
-			(pred_id TEXT, succ_id TEXT)''')
+		if config.OSM_EXPORT_SUCCESSORS:
+			self.db.execute('''CREATE TABLE successor
+				(pred_id TEXT, succ_id TEXT)''')
 
 		drop_table_if_exists(self.db, 'platform_nodes')
 		self.db.execute('''CREATE TABLE platform_nodes
 			(way_id TEXT, node_id TEXT)''')
 
+		# Raw (not post-processed) state, retained for incremental updates via OsmChangeImporter
+		drop_table_if_exists(self.db, 'osm_route_edges')
+		self.db.execute('''CREATE TABLE osm_route_edges
+			(route_id TEXT, pred_id TEXT, succ_id TEXT)''')
+
+		drop_table_if_exists(self.db, 'osm_node_locations')
+		self.db.execute('''CREATE TABLE osm_node_locations
+			(node_id TEXT PRIMARY KEY, lat REAL, lon REAL)''')
+
 	def node(self, n):
 		stop_type = self.extract_stop_type(n.tags)
 		if stop_type:
@@ -67,42 +378,91 @@ class OsmStopsImporter(osmium.SimpleHandler):
 				location = line.centroid if line.is_ring else line.interpolate(0.5, normalized = True)
 				self.extract_and_store_stop(stop_type, "w" + str(w.id), w.tags, location)
 				self.cache_platform_nodes(w)
+				for n in w.nodes:
+					self.way_node_locations[n.ref] = (n.location.lon, n.location.lat)
 			except Exception as err:
 				self.logger.error("Error handling way %s: %s %s", w.id, err, w)
 	
+	def apply_file_sharded(self, osm_file, processes):
+		"""
+		Imports osm_file like apply_file_prefiltered, but parses shards of 
+		consecutive pbf blocks in parallel worker processes. Shard results
+		are merged in file order, so the result equals a sequential import.
+		"""
+		(header, shards) = split_pbf(osm_file, config.OSM_IMPORT_SHARD_SIZE)
+		tasks = [(osm_file, header, shard) for shard in shards]
+		self.logger.info("Split %s into %s shards, parsing them with %s processes", osm_file, len(shards), processes)
+
+		with shard_pool_context.Pool(processes) as pool:
+			# Both passes are independent, so submit nodes before waiting for ways and relations
+			node_results = pool.imap(parse_pbf_shard_nodes, tasks)
+			for (stop_ways, route_edges, stop_areas, area_for_stop) in pool.imap(parse_pbf_shard_ways_and_relations, tasks):
+				self.stop_ways.extend(stop_ways)
+				self.route_edges.extend(route_edges)
+				self.stop_areas.update(stop_areas)
+				self.area_for_stop.update(area_for_stop)
+			self.logger.info("Collected %s stop ways and route/stop_area relations", len(self.stop_ways))
+
+			for rows in node_results:
+				self.counter += len(rows)
+				self.store_osm_stops(rows)
+			self.logger.info("Collected %s stop nodes", self.counter)
+
+		node_ids = set()
+		for (way_id, stop, node_refs) in self.stop_ways:
+			node_ids.update(node_refs)
+		locations = {}
+		with shard_pool_context.Pool(processes, init_way_node_locations_worker, (node_ids,)) as pool:
+			for shard_locations in pool.imap(parse_pbf_shard_way_node_locations, tasks):
+				locations.update(shard_locations)
+		self.logger.info("Collected locations of %s stop way nodes", len(locations))
+
+		for (way_id, stop, node_refs) in self.stop_ways:
+			self.store_stop_way(way_id, stop, node_refs, locations)
+		self.stop_ways = []
+
+	def collect_stop_way(self, w):
+		stop_type = self.extract_stop_type(w.tags)
+		if stop_type:
+			self.stop_ways.append((w.id, self.extract_stop(stop_type, "w" + str(w.id), w.tags), array('q', (n.ref for n in w.nodes))))
+
+	def store_stop_way(self, way_id, stop, node_refs, locations):
+		"""
+		Stores stop, the OsmStop of way way_id extracted before its location was known, located by its node_refs' locations
+		"""
+		try:
+			location = self.way_location(node_refs, locations)
+			self.store_osm_stop(stop._replace(lat = location.y, lon = location.x))
+			self.cache_platform_node_refs(way_id, node_refs)
+			for ref in node_refs:
+				self.way_node_locations[ref] = locations[ref]
+		except Exception as err:
+			self.logger.error("Error handling way %s: %s", way_id, err)
+
+	def way_location(self, node_refs, locations):
+		coords = []
+		for ref in node_refs:
+			coord = locations[ref]
+			# Like the WKBFactory, skip consecutive duplicate locations
+			if not coords or coords[-1] != coord:
+				coords.append(coord)
+		line = LineString(coords)
+		return line.centroid if line.is_ring else line.interpolate(0.5, normalized = True)
+
 	def cache_platform_nodes(self, w):
-		way_id = "w" + str(w.id)
-		for n in w.nodes:
-			self.platform_nodes.append((way_id, "n" + str(n.ref)))
+		self.cache_platform_node_refs(w.id, [n.ref for n in w.nodes])
+
+	def cache_platform_node_refs(self, way_id, node_refs):
+		self.platform_nodes.add_way(way_id, node_refs)
 
 	def store_osm_stop(self, stop):
-		lat = stop["lat"]
-		lon = stop["lon"]
-		
-		self.rows_to_import.append((
-			stop["id"], 
-			stop["tags"].get("name"), 
-			stop["tags"].get("network"), 
-			stop["tags"].get("operator"),
-			stop["tags"].get("railway"),
-			stop["tags"].get("highway"),
-			stop["tags"].get("public_transport"),
-			lat,
-			lon,
-			stop["mode"],
-			stop["type"],
-			stop["ref"],
-			stop["ref_key"],
-			stop["assumed_platform"],
-			0,
-			stop["tags"].get("kerb:approach_aid"),
-			stop["tags"].get("wheelchair"),
-			stop["tags"].get("tactile_paving"),
-			))
-				
-		if self.counter % 1000 == 0:
+		self.counter += 1
+		self.rows_to_import.append(stop)
+		if len(self.rows_to_import) >= config.BULK_LOAD_BATCH_SIZE:
 			self.store_osm_stops(self.rows_to_import)
 			self.rows_to_import = []
+		if self.counter % 10000 == 0:
+			self.logger.info("Imported %s stops", self.counter)
 
 	def relation(self, r):
 		if r.tags.get("route"): 
@@ -115,20 +475,15 @@ class OsmStopsImporter(osmium.SimpleHandler):
 		current = {}
 		for m in r.members:
 			if m.role in ["platform", "stop"]:
-				current[m.role] = m.type + str(m.ref)
-				self.cache_predecessor(current[m.role], predecessor.get(m.role))
+				current[m.role] = osm_key(m.type, m.ref)
+				self.cache_predecessor(current[m.role], predecessor.get(m.role), r.id)
 				predecessor[m.role] = current[m.role]
 	
-	def cache_predecessor(self, current, predecessor):
-		if not predecessor:
+	def cache_predecessor(self, current, predecessor, route_id):
+		if predecessor is None:
 			return
 
-		if not current in self.pred:
-			self.pred[current] = set()
-		if not predecessor in self.succ:
-			self.succ[predecessor] = set()
-		self.pred[current].add(predecessor)
-		self.succ[predecessor].add(current)
+		self.route_edges.append(route_id, predecessor, current)
 		
 	def relation_stop_area(self, r):
 		(ref_key, ref) = self.extract_ref(r.tags)
@@ -146,8 +501,7 @@ class OsmStopsImporter(osmium.SimpleHandler):
 						
 		for m in r.members:
 			if m.role in ("platform", "stop"):
-				current = m.type + str(m.ref)
-				self.area_for_stop[current] = area
+				self.area_for_stop[osm_key(m.type, m.ref)] = area
 
 	def store_stop_areas(self):
 		areas = []
@@ -163,18 +517,16 @@ class OsmStopsImporter(osmium.SimpleHandler):
 				area["ref"],
 				))
 
-		self.db.executemany('INSERT INTO osm_stop_areas VALUES (?,?,?,?,?,?,?)', areas)
-		self.db.commit()
+		self.loader.insert('osm_stop_areas', areas)
 
 		rows = []
 		for key in self.area_for_stop:
 			rows.append((
 				str(self.area_for_stop[key]["id"]),
-				key
+				osm_id(key)
 				))
 
-		self.db.executemany('INSERT INTO osm_stop_area_members VALUES (?,?)', rows)
-		self.db.commit()
+		self.loader.insert('osm_stop_area_members', rows)
 
 	def extract_stop_type(self, tags):
 		if tags.get('public_transport') == 'station':
@@ -188,26 +540,18 @@ class OsmStopsImporter(osmium.SimpleHandler):
 		else:
 			return None
 
-	def extract_and_store_stop(self, stop_type, osm_id, tags, location):	
-		self.counter += 1
+	def extract_stop(self, stop_type, osm_id, tags, location = None):
+		"""
+		Returns the OsmStop osm_id of type stop_type, extracted from tags and located at location (unknown, if None)
+		"""
 		(ref_key, ref) = self.extract_ref(tags)
-		assumed_platform = self.extract_platform(tags)
-		stop = {
-			"id": osm_id,
-			"lat": location.y,
-			"lon": location.x,
-			"tags": {tag.k: tag.v for tag in tags},
-			"mode": self.extract_stop_mode(tags),
-			"type": stop_type ,
-			"ref": ref,
-			"ref_key": ref_key,
-			"assumed_platform": assumed_platform
-		}
-
-		self.store_osm_stop(stop)
-		if self.counter % 10000 == 0:
-			self.logger.info("Imported %s stops", self.counter)
+		return OsmStop(osm_id, tags.get("name"), tags.get("network"), tags.get("operator"), tags.get("railway"), tags.get("highway"),
+			tags.get("public_transport"), location.y if location is not None else None, location.x if location is not None else None,
+			self.extract_stop_mode(tags), stop_type, ref, ref_key, self.extract_platform(tags), 0,
+			tags.get("kerb:approach_aid"), tags.get("wheelchair"), tags.get("tactile_paving"))
 
+	def extract_and_store_stop(self, stop_type, osm_id, tags, location):
+		self.store_osm_stop(self.extract_stop(stop_type, osm_id, tags, location))
 
 	def normalize_IFOPT(self, ifopt):
 		return ifopt.lower().replace("de:8", "de:08")
@@ -252,22 +596,33 @@ class OsmStopsImporter(osmium.SimpleHandler):
 		return None
 
 	def store_osm_stops(self, rows):
-		self.db.executemany('INSERT INTO osm_stops VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', rows)
-		self.db.commit()
+		self.loader.insert('osm_stops', rows)
 		
 	def store_platform_nodes(self):
-		self.db.executemany("INSERT INTO platform_nodes VALUES (?,?)", self.platform_nodes)
-		self.db.commit()
-
-	def store_successors(self, rows):
-		rows = []
-		for predecessor in self.succ:
-			for successor in self.succ[predecessor]:
-				rows.append((predecessor, successor))
-		self.db.executemany("INSERT INTO successor VALUES (?,?)", rows)
-		self.db.commit()
+		self.loader.insert('platform_nodes', self.platform_nodes)
+
+	def store_raw_osm_stops(self):
+		drop_table_if_exists(self.db, 'osm_stops_raw')
+		self.db.execute("CREATE TABLE osm_stops_raw AS SELECT * FROM osm_stops")
+		self.loader.insert('osm_route_edges', self.route_edges.rows())
+		# Raw tables are only queried by OsmChangeImporter, so their indexes are created after the import
+		self.loader.defer("CREATE INDEX raw_id_idx ON osm_stops_raw(osm_id)")
+		self.loader.defer("CREATE INDEX raw_lat_lon ON osm_stops_raw(lat,lon)")
+		self.loader.defer("CREATE INDEX route_edges_route_idx ON osm_route_edges(route_id)")
+		self.loader.defer("CREATE INDEX route_edges_pred_idx ON osm_route_edges(pred_id)")
+		self.loader.defer("CREATE INDEX route_edges_succ_idx ON osm_route_edges(succ_id)")
+		self.loader.insert('osm_node_locations', (("n" + str(ref), lat, lon) for (ref, (lon, lat)) in self.way_node_locations.items()))
+
+	def store_successors(self):
+		rows = [(osm_id(pred_key), osm_id(succ_key)) for (pred_key, succ_key) in self.route_edges.successors()]
+		self.loader.insert('successor', rows)
 
 	def only_keep_more_specific_stops_for_matching(self):
+		if config.OSM_PRUNE_IN_MEMORY:
+			return OsmStopsPruner(self.db).prune()
+		return self.only_keep_more_specific_stops_for_matching_in_db()
+
+	def only_keep_more_specific_stops_for_matching_in_db(self):
 		# We ignore stop positions on platforms like n4983922907, n4983922908, n4983924926, n4983924928 (9 occ in bw)
 		self.logger.info("Deleting stop_position which are node of a platform")
 		self.db.execute("""DELETE FROM osm_stops 
@@ -378,53 +733,57 @@ class OsmStopsImporter(osmium.SimpleHandler):
 			                    AND b.lon BETWEEN a.lon - 0.0001 AND a.lon +0.0001 
 			                    AND b.type='platform')""")
 
-		self.db.commit()
 	
+	def route_successors(self):
+		"""
+		Returns the distinct (pred_id, succ_id) pairs of consecutive route members
+		and the node_ids per way_id of those members which are stop ways.
+		"""
+		successors = self.route_edges.successors()
+		way_ids = set()
+		for pair in successors:
+			for key in pair:
+				(osm_type, ref) = osm_type_and_ref(key)
+				if osm_type == 'w':
+					way_ids.add(ref)
+		return ([(osm_id(pred_key), osm_id(succ_key)) for (pred_key, succ_key) in successors], self.platform_nodes.nodes_of_ways(way_ids))
+
 	def add_prev_and_next_stop_names(self):
-		drop_table_if_exists(self.db, 'SUCCESSOR_NAME')
-		drop_table_if_exists(self.db, 'PREDECESSOR_NAME')
-		
+		"""
+		Sets next_stops/prev_stops to the '/' separated, distinct names of a stop's successors/predecessors.
+		Nodes of a stop way inherit the successors/predecessors of the way.
+		"""
 		self.db.execute("""ALTER TABLE osm_stops ADD COLUMN next_stops TEXT""")
 		self.db.execute("""ALTER TABLE osm_stops ADD COLUMN prev_stops TEXT""")
-		self.db.execute("""CREATE TABLE PREDECESSOR_NAME AS 
-			SELECT succ_id osm_id, group_concat(name,'/') pred_name FROM (
-			  SELECT s.succ_id, o.name
-			    FROM successor s, osm_stops o
-			   WHERE s.pred_id = o.osm_id AND o.name IS NOT NULL
-			   UNION
-			  SELECT bus_stop.osm_id, o.name
-			    FROM successor s
-			    JOIN osm_stops o ON s.pred_id = o.osm_id
-			    JOIN platform_nodes pn ON s.succ_id = pn.way_id
-			    JOIN osm_stops bus_stop ON bus_stop.osm_id = pn.node_id 
-			   WHERE o.name IS NOT NULL
-			   )
-			GROUP BY succ_id""")
-		self.db.execute("""CREATE TABLE SUCCESSOR_NAME AS
-			SELECT pred_id osm_id, group_concat(name,'/') succ_name FROM (
-			  SELECT s.pred_id, o.name
-			    FROM successor s, osm_stops o
-			   WHERE s.succ_id = o.osm_id AND o.name IS NOT NULL
-			   UNION
-			  SELECT bus_stop.osm_id, o.name
-			    FROM successor s
-			    JOIN osm_stops o ON s.succ_id = o.osm_id
-			    JOIN platform_nodes pn ON s.pred_id = pn.way_id
-			    JOIN osm_stops bus_stop ON bus_stop.osm_id = pn.node_id 
-			   WHERE o.name IS NOT NULL)
-			GROUP BY pred_id""")
-		self.db.execute("CREATE INDEX PRED_NAME_INDEX on PREDECESSOR_NAME(osm_id)")
-		self.db.execute("CREATE INDEX SUCC_NAME_INDEX on SUCCESSOR_NAME(osm_id)")
-		self.db.execute("UPDATE osm_stops AS g SET next_stops = (SELECT succ_name FROM SUCCESSOR_NAME s WHERE s.osm_id=g.osm_id)")
-		self.db.execute("UPDATE osm_stops AS g SET prev_stops = (SELECT pred_name FROM PREDECESSOR_NAME s WHERE s.osm_id=g.osm_id)")
-		drop_table_if_exists(self.db, 'SUCCESSOR_NAME')
-		drop_table_if_exists(self.db, 'PREDECESSOR_NAME')
-		
-		self.db.commit()
+
+		names = dict(self.db.execute("SELECT osm_id, name FROM osm_stops").fetchall())
+		(successors, nodes_of_way) = self.route_successors()
+		pred_names = {}
+		succ_names = {}
+		def add_name(neighbour_names, stop_id, name):
+			if stop_id in names:
+				neighbour_names.setdefault(stop_id, set()).add(name)
+		for (pred_id, succ_id) in successors:
+			pred_name = names.get(pred_id)
+			if pred_name is not None:
+				add_name(pred_names, succ_id, pred_name)
+				for node_id in nodes_of_way.get(succ_id, []):
+					add_name(pred_names, node_id, pred_name)
+			succ_name = names.get(succ_id)
+			if succ_name is not None:
+				add_name(succ_names, pred_id, succ_name)
+				for node_id in nodes_of_way.get(pred_id, []):
+					add_name(succ_names, node_id, succ_name)
+
+		rows = []
+		for stop_id in succ_names.keys() | pred_names.keys():
+			next_stops = '/'.join(sorted(succ_names[stop_id])) if stop_id in succ_names else None
+			prev_stops = '/'.join(sorted(pred_names[stop_id])) if stop_id in pred_names else None
+			rows.append((next_stops, prev_stops, stop_id))
+		self.db.executemany("UPDATE osm_stops SET next_stops=?, prev_stops=? WHERE osm_id=?", rows)
 
 	def add_column_empty_name(self):
 		self.db.execute("""ALTER TABLE osm_stops ADD COLUMN empty_name INTEGER""")
-		self.db.commit()
 
 	def deduce_missing_names_from_close_by_stops(self):
 		cur = self.db.execute("""
@@ -446,7 +805,6 @@ class OsmStopsImporter(osmium.SimpleHandler):
 			if current != stop["osm_id"]:
 				current = stop["osm_id"]
 				self.db.execute("""UPDATE osm_stops SET name =?, empty_name=1 WHERE osm_id=?""", (stop["name"], stop["osm_id"]))
-		self.db.commit()
 
 	def update_infos_inherited_from_stop_areas_and_platforms(self):
 		# Note: we don't set empty_name flag, as we assume inheriting the name from platform should be good practice
@@ -454,19 +812,17 @@ class OsmStopsImporter(osmium.SimpleHandler):
 			(SELECT pw.name FROM platform_nodes p, osm_stops pw 
 			  WHERE o.osm_id=p.node_id AND pw.osm_id = p.way_id)
 			WHERE o.name IS NULL""")
-		self.db.commit()
 		self.logger.info("OSM: Updated empty stop names from platform names")
 
 		cur = self.db.execute("""SELECT osm_id FROM osm_stops WHERE name IS NULL""")
 		stops = cur.fetchall()
 		rows = []
 		for stop in stops:
-			stop_area = self.area_for_stop.get(stop["osm_id"])
+			stop_area = self.area_for_stop.get(parse_osm_id(stop["osm_id"]))
 			if stop_area:
 				rows.append((stop_area.get("name"), stop["osm_id"]))
 		# Note: we don't set empty_name, as we assume inheriting the name from stop_area should be good practice		
 		self.db.executemany("""UPDATE osm_stops SET name =? WHERE osm_id=?""", rows)
-		self.db.commit()
 		self.logger.info("OSM: Updated empty stop names inherited from stop_areas")
 
 		self.db.execute("""UPDATE osm_stops AS o SET empty_name=1, name = 
@@ -475,12 +831,10 @@ class OsmStopsImporter(osmium.SimpleHandler):
 			   AND a.lon BETWEEN o.lon - 0.0001 AND o.lon +0.0001 
 			   AND o.type='platform')
 			WHERE o.name IS NULL""")
-		self.db.commit()
 		self.logger.info("OSM: Updated empty stop names from stop_position close by")
 
 	def add_match_state(self):
 		self.db.execute("""ALTER TABLE osm_stops ADD COLUMN match_state TEXT""")
-		self.db.commit()
 
 	def create_indexes(self):
 		"""
@@ -490,17 +844,21 @@ class OsmStopsImporter(osmium.SimpleHandler):
 		self.db.execute("CREATE INDEX pl_wy_idx ON platform_nodes(way_id)")
 		self.db.execute("SELECT InitSpatialMetaData()")
 		self.db.execute("SELECT AddGeometryColumn('osm_stops', 'the_geom', 4326, 'POINT','XY')")
+		self.db.execute("UPDATE osm_stops SET the_geom = MakePoint(lon, lat, 4326)")
 		self.db.execute("""CREATE INDEX stops_lat_lon ON osm_stops(lat,lon)""")
 
 	def export_osm_stops(self):
 		self.store_osm_stops(self.rows_to_import)
 		self.logger.info("Stored osm stops")
+		self.store_raw_osm_stops()
+		self.logger.info("Stored raw osm stops, route edges and stop way node locations")
 		self.store_platform_nodes()
 		self.logger.info("Stored patform nodes")
 		self.store_stop_areas()
 		self.logger.info("Stored stop areas")	
-		self.store_successors(self.pred)
-		self.logger.info("Stored successors")
+		if config.OSM_EXPORT_SUCCESSORS:
+			self.store_successors()
+			self.logger.info("Stored successors")
 		self.create_indexes()
 		self.logger.info("Created osm indexes")
 		self.add_prev_and_next_stop_names()
@@ -514,3 +872,18 @@ class OsmStopsImporter(osmium.SimpleHandler):
 		self.add_match_state()
 		self.logger.info("Added match state")
 		
+
+class OsmStopsShardParser(OsmStopsImporter):
+	"""
+	Parses a shard of a pbf file in a worker process of OsmStopsImporter.apply_file_sharded.
+	Instead of writing to the database, stops are retained in memory and returned 
+	to the importing process.
+	"""
+	def __init__(self):
+		osmium.SimpleHandler.__init__(self)
+		self.logger = logging.getLogger('osm_stop_matcher.OsmStopsShardParser')
+		self.init_collected_data()
+		self.stored_rows = []
+
+	def store_osm_stops(self, rows):
+		self.stored_rows.extend(rows)
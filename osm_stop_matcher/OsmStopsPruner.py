@@ -0,0 +1,145 @@
+import logging
+import math
+from collections import defaultdict, namedtuple
+
+Stop = namedtuple('Stop', ['osm_id', 'name', 'railway', 'public_transport', 'lat', 'lon', 'mode', 'type', 'ref', 'ref_key'])
+
+TRAINISH_MODES = ('light_rail', 'train', 'tram', 'trainish')
+
+class SpatialGrid():
+	"""
+	Hashes stops by a key and a grid cell of twice the search radius,
+	so all stops within radius of a location are found in the 3x3 surrounding cells.
+	Stops with a NULL key are not indexed, as NULL never equals anything in SQL.
+	"""
+	def __init__(self, stops, key, radius):
+		self.key = key
+		self.radius = radius
+		self.cell_size = 2 * radius
+		self.cells = defaultdict(list)
+		for stop in stops:
+			stop_key = key(stop)
+			if stop_key is not None:
+				self.cells[(stop_key, self.cell(stop.lat), self.cell(stop.lon))].append(stop)
+
+	def cell(self, coord):
+		return math.floor(coord / self.cell_size)
+
+	def has_neighbour(self, stop, accept = None):
+		stop_key = self.key(stop)
+		if stop_key is None:
+			return False
+		# Same arithmetic as "s.lat BETWEEN h.lat-r AND h.lat+r" to get identical results at the border
+		min_lat, max_lat = stop.lat - self.radius, stop.lat + self.radius
+		min_lon, max_lon = stop.lon - self.radius, stop.lon + self.radius
+		lat_cell = self.cell(stop.lat)
+		lon_cell = self.cell(stop.lon)
+		for x in (lat_cell - 1, lat_cell, lat_cell + 1):
+			for y in (lon_cell - 1, lon_cell, lon_cell + 1):
+				for other in self.cells.get((stop_key, x, y), ()):
+					if (min_lat <= other.lat <= max_lat and min_lon <= other.lon <= max_lon
+						and (accept is None or accept(stop, other))):
+						return True
+		return False
+
+class OsmStopsPruner():
+	"""
+	Deletes less specific osm_stops, i.e. the stops which would else compete with
+	a better suited stop during matching. The rules are evaluated in memory in the same order
+	and with the same (SQL NULL) semantics as OsmStopsImporter.only_keep_more_specific_stops_for_matching_in_db,
+	every rule seeing only the stops retained by its predecessors.
+	All losers are finally deleted with a single statement, within the caller's transaction.
+	"""
+
+	def __init__(self, db):
+		self.db = db
+		self.logger = logging.getLogger('osm_stop_matcher.OsmStopsPruner')
+
+	def prune(self):
+		stops = [Stop._make(row) for row in self.db.execute(
+			"SELECT osm_id, name, railway, public_transport, lat, lon, mode, type, ref, ref_key FROM osm_stops")]
+		platform_nodes = self.db.execute("SELECT way_id, node_id FROM platform_nodes").fetchall()
+		stop_area_members = self.db.execute("SELECT stop_area_id, member_id FROM osm_stop_area_members").fetchall()
+
+		self.retained = {stop.osm_id: stop for stop in stops}
+		self.deleted = []
+
+		# We ignore stop positions on platforms like n4983922907, n4983922908, n4983924926, n4983924928 (9 occ in bw)
+		platform_node_ids = set(node_id for (way_id, node_id) in platform_nodes)
+		self.delete("Deleting stop_position which are node of a platform",
+			[stop for stop in self.retained.values() if stop.osm_id in platform_node_ids and stop.public_transport == 'stop_position'])
+
+		# We only retain halts where no stop in vicinity and with same name exists.
+		self.delete_if_in_vicinity("Deleting stations/halt if stop or platform with same name is in vicinity",
+			lambda h: h.type in ('halt', 'station'),
+			lambda s: s.type in ('stop', 'platform') and s.mode is not None and s.mode not in ('bus', 'tram'),
+			key = lambda s: s.name)
+
+		# We delete PTv1 tram_stops (often tagged in center of tram_stops) if there is at least one identically named stop_position in the vicinity.
+		self.delete_if_in_vicinity("Deleting tram_stops, if stop_position with same name is in vicinity",
+			lambda h: h.type == 'stop' and h.mode in ('tram', 'trainish') and h.railway == 'tram_stop' and h.public_transport is None,
+			lambda s: s.type == 'stop' and s.mode == 'tram' and s.public_transport == 'stop_position',
+			key = lambda s: s.name)
+
+		# We delete stop_positions for buses if there is a platform with the same name in the vicinity.
+		self.delete_if_in_vicinity("Deleting stop_positions for buses, if there is a platform with the same name in the vicinity.",
+			lambda h: h.type == 'stop' and h.mode == 'bus',
+			lambda s: s.type == 'platform' and s.mode == 'bus',
+			key = lambda s: s.name)
+
+		# We delete stop_positions for buses if there is a platform with the same IFOPT in the vicinity.
+		self.delete_if_in_vicinity("Deleting stop_positions for buses, if there is a platform with the same IFOPT in the vicinity.",
+			lambda h: h.type == 'stop' and h.mode == 'bus' and h.ref_key == 'ref:IFOPT',
+			lambda s: s.type == 'platform' and s.ref_key == 'ref:IFOPT',
+			key = lambda s: s.ref)
+
+		# We delete platforms for trains/lightrails/trams if there is a stop_position with trains/lightrails in the vicinity.
+		self.delete_if_in_vicinity("Deleting platforms for rains/lightrails/trams, if there is a stop_position with trains/lightrails in the vicinity.",
+			lambda h: h.type == 'platform' and h.mode in TRAINISH_MODES,
+			lambda s: s.type == 'stop' and s.mode in TRAINISH_MODES,
+			key = lambda s: s.name)
+
+		# We delete platforms which have already a bus_stop node, which we assign higher priority
+		# (thinking of a bus_station where multiple bus_stops may be assigned to a single platform..)
+		platforms_with_stop_nodes = set(way_id for (way_id, node_id) in platform_nodes if node_id in self.retained)
+		self.delete("Deleting platforms which have already a bus_stop node",
+			[stop for stop in self.retained.values() if stop.osm_id in platforms_with_stop_nodes])
+
+		# We delete bus stop_positions from stop_areas, where there are also platforms with mdoe bus
+		def is_bus(osm_id, stop_type):
+			stop = self.retained.get(osm_id)
+			return stop is not None and stop.mode == 'bus' and stop.type == stop_type
+		stop_areas_with_bus_platforms = set(stop_area_id for (stop_area_id, member_id) in stop_area_members if is_bus(member_id, 'platform'))
+		self.delete("OSM: Deleting stop_positions from stop_areas, where there are also platforms with mdoe bus",
+			[self.retained[member_id] for (stop_area_id, member_id) in stop_area_members
+				if stop_area_id in stop_areas_with_bus_platforms and is_bus(member_id, 'stop')])
+
+		# We delete bus stop_positions where there are bus platforms nearby https://github.com/mfdz/nvbw-osm-stop-comparison/issues/4
+		self.delete_if_in_vicinity("OSM: Deleting stop_positions where there are bus platforms",
+			lambda a: a.mode == 'bus' and a.public_transport == 'stop_position',
+			lambda b: b.mode == 'bus' and b.type == 'platform',
+			key = lambda s: s.mode,
+			radius = 0.0001,
+			accept = lambda a, b: a.osm_id != b.osm_id)
+
+		self.delete_losers()
+
+	def delete_if_in_vicinity(self, message, is_candidate, is_superior, key, radius = 0.01, accept = None):
+		grid = SpatialGrid([stop for stop in self.retained.values() if is_superior(stop)], key, radius)
+		self.delete(message, [stop for stop in self.retained.values() if is_candidate(stop) and grid.has_neighbour(stop, accept)])
+
+	def delete(self, message, losers):
+		self.logger.info(message)
+		deleted_count = len(self.deleted)
+		for stop in losers:
+			# a stop may be listed multiple times, e.g. as member of multiple stop_areas
+			if self.retained.pop(stop.osm_id, None) is not None:
+				self.deleted.append(stop.osm_id)
+		self.logger.debug("%s stops deleted", len(self.deleted) - deleted_count)
+
+	def delete_losers(self):
+		self.db.execute("CREATE TEMP TABLE pruned_osm_stops (osm_id TEXT PRIMARY KEY)")
+		self.db.executemany("INSERT INTO temp.pruned_osm_stops VALUES (?)", [(osm_id,) for osm_id in self.deleted])
+		self.db.execute("DELETE FROM osm_stops WHERE osm_id IN (SELECT osm_id FROM temp.pruned_osm_stops)")
+		self.db.execute("DROP TABLE temp.pruned_osm_stops")
+		self.logger.info("Deleted %s less specific osm_stops", len(self.deleted))
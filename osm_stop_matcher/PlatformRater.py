@@ -0,0 +1,23 @@
+from osm_stop_matcher.Rater import TableRater
+
+class PlatformRater(TableRater):
+	"""
+	Rates whether the osm stop's (assumed) platform matches the official stop's platform_code
+	"""
+
+	def stop_value(self, stop):
+		return stop["platform_code"]
+
+	def candidate_value(self, candidate):
+		return candidate["assumed_platform"]
+
+	def rate_values(self, ifopt_platform, candidate_platform):
+		if (ifopt_platform == None or ifopt_platform=='') and (candidate_platform == None or candidate_platform == ''):
+			return 0.9
+		elif not (ifopt_platform == None or ifopt_platform=='') and (candidate_platform == None or candidate_platform == ''):
+			# usually, platform should be tagged in OSM, but especially for bus quais, that might not be the case, so just give small discount
+			return 0.85
+		elif ifopt_platform == str(candidate_platform):
+			return 1.0
+		else:
+			return 0.0
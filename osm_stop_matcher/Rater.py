@@ -0,0 +1,74 @@
+import abc
+
+import numpy as np
+
+class Rater(abc.ABC):
+	"""
+	Rates one aspect of candidates. StopMatcher composes the ratings of its raters to the final rating,
+	so a rater can be replaced by any subclass rating the same aspect.
+
+	prepare is called once with the osm stop list the candidate_ids of CandidateBatches index into,
+	so per osm stop attributes can be precomputed. rate_batch returns an array with one rating per candidate pair
+	of a CandidateBatch, rate the rating of a single official stop and osm stop.
+	Subclasses must implement rate, otherwise they can't be instantiated.
+	"""
+
+	def prepare(self, osm_stop_list):
+		pass
+
+	@abc.abstractmethod
+	def rate(self, stop, candidate):
+		pass
+
+	def rate_batch(self, batch):
+		"""
+		Rates the candidate pairs of batch one by one. Subclasses should override this with a vectorised implementation.
+		"""
+		return np.array([self.rate(stop, candidate) for (stop, candidate) in batch.pairs()], dtype=float)
+
+
+class TableRater(Rater):
+	"""
+	Rater of an attribute pair of official and osm stops, which are both from a small set of values (e.g. modes).
+	Values are coded as rows respectively columns of a table of ratings of every value combination,
+	which is extended as unknown values occur, so a batch is rated by a single table lookup.
+	Subclasses implement rate_values, stop_value and candidate_value.
+	"""
+
+	def __init__(self):
+		self.codes = {}
+		self.table = np.zeros((0, 0))
+
+	@abc.abstractmethod
+	def rate_values(self, stop_value, candidate_value):
+		pass
+
+	@abc.abstractmethod
+	def stop_value(self, stop):
+		pass
+
+	@abc.abstractmethod
+	def candidate_value(self, candidate):
+		pass
+
+	def code(self, value):
+		code = self.codes.get(value)
+		if code is None:
+			code = self.codes[value] = len(self.codes)
+		return code
+
+	def lookup_table(self):
+		if len(self.table) < len(self.codes):
+			values = list(self.codes.keys())
+			self.table = np.array([[self.rate_values(stop_value, candidate_value) for candidate_value in values] for stop_value in values], dtype=float)
+		return self.table
+
+	def prepare(self, osm_stop_list):
+		self.candidate_codes = np.array([self.code(self.candidate_value(candidate)) for candidate in osm_stop_list], dtype=np.intp)
+
+	def rate(self, stop, candidate):
+		return self.rate_values(self.stop_value(stop), self.candidate_value(candidate))
+
+	def rate_batch(self, batch):
+		stop_codes = np.array([self.code(self.stop_value(stop)) for stop in batch.stops], dtype=np.intp)
+		return self.lookup_table()[stop_codes[batch.stop_indexes], self.candidate_codes[batch.candidate_ids]]
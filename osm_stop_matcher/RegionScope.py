@@ -0,0 +1,118 @@
+import logging
+import math
+
+from osm_stop_matcher.util import EARTH_RADIUS_METERS, table_exists
+
+from . import config
+
+class RegionScope():
+	"""
+	Limits a compare_stops run to the official stops whose globaleID starts with id_prefix
+	and/or which are located within bbox (min_lon, min_lat, max_lon, max_lat), and to the osm stops
+	within MAXIMUM_DISTANCE of the bbox (or, without bbox, of the official stops in scope).
+
+	Rows of haltestellen_unified and osm_stops outside of the scope are kept as they are
+	when reimporting (see keep_outside/restore_outside). Before statistics and assertions are scoped,
+	prepare must be called, which creates the temp tables scope_stop_ids and scope_osm_ids.
+	"""
+
+	def __init__(self, id_prefix = None, bbox = None):
+		self.id_prefix = id_prefix
+		self.bbox = bbox
+		self.logger = logging.getLogger('osm_stop_matcher.RegionScope')
+
+	def __str__(self):
+		return "{}{}".format(self.id_prefix or '', ' ' + ','.join(str(coord) for coord in self.bbox) if self.bbox else '')
+
+	def stop_condition(self):
+		"""
+		Returns the (sql, params) condition of haltestellen_unified rows in scope
+		"""
+		conditions = []
+		params = []
+		if self.id_prefix:
+			conditions.append("globaleID LIKE ?")
+			params.append(self.id_prefix + '%')
+		if self.bbox:
+			conditions.append("lon BETWEEN ? AND ? AND lat BETWEEN ? AND ?")
+			params.extend([self.bbox[0], self.bbox[2], self.bbox[1], self.bbox[3]])
+		return (' AND '.join(conditions) or '1', params)
+
+	def stop_ids(self, db):
+		(condition, params) = self.stop_condition()
+		return set(row[0] for row in db.execute("SELECT globaleID FROM haltestellen_unified WHERE {}".format(condition), params))
+
+	def osm_bounds(self, db):
+		"""
+		Returns the bounds (min_lat, min_lon, max_lat, max_lon) of the osm stops in scope, i.e. the bbox
+		(or the extent of the official stops in scope) enlarged by MAXIMUM_DISTANCE, or None, if no official stop is in scope
+		"""
+		if self.bbox:
+			(min_lon, min_lat, max_lon, max_lat) = self.bbox
+		else:
+			(condition, params) = self.stop_condition()
+			(min_lat, min_lon, max_lat, max_lon) = db.execute("""SELECT min(lat), min(lon), max(lat), max(lon)
+				FROM haltestellen_unified WHERE lon IS NOT NULL AND {}""".format(condition), params).fetchone()
+			if min_lat is None:
+				return None
+		# 10% more than MAXIMUM_DISTANCE, as the enlarged bounds only approximate the distance
+		margin_lat = math.degrees(1.1 * config.MAXIMUM_DISTANCE / EARTH_RADIUS_METERS)
+		margin_lon = margin_lat / math.cos(math.radians(min(89.0, max(abs(min_lat), abs(max_lat)) + margin_lat)))
+		return (min_lat - margin_lat, min_lon - margin_lon, max_lat + margin_lat, max_lon + margin_lon)
+
+	def osm_condition(self, bounds):
+		"""
+		Returns the (sql, params) condition of osm_stops rows within bounds (see osm_bounds)
+		"""
+		if bounds is None:
+			return ('0', [])
+		(min_lat, min_lon, max_lat, max_lon) = bounds
+		return ("lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?", [min_lat, max_lat, min_lon, max_lon])
+
+	def prepare(self, db):
+		(condition, params) = self.stop_condition()
+		db.execute("DROP TABLE IF EXISTS temp.scope_stop_ids")
+		db.execute("CREATE TEMP TABLE scope_stop_ids AS SELECT DISTINCT globaleID FROM haltestellen_unified WHERE {}".format(condition), params)
+		(condition, params) = self.osm_condition(self.osm_bounds(db))
+		db.execute("DROP TABLE IF EXISTS temp.scope_osm_ids")
+		db.execute("CREATE TEMP TABLE scope_osm_ids AS SELECT osm_id FROM osm_stops WHERE {}".format(condition), params)
+
+	def stop_filter(self, column = 'globaleID'):
+		"""
+		Returns an sql condition (to be appended to a WHERE clause) restricting column to the globaleIDs in scope
+		"""
+		return " AND {} IN (SELECT globaleID FROM temp.scope_stop_ids)".format(column)
+
+	def osm_filter(self, column = 'osm_id'):
+		"""
+		Returns an sql condition (to be appended to a WHERE clause) restricting column to the osm_ids in scope
+		"""
+		return " AND {} IN (SELECT osm_id FROM temp.scope_osm_ids)".format(column)
+
+	def keep_outside(self, db, table, condition, params):
+		"""
+		Copies the rows of table not matching condition (if table exists) to table scope_outside_<table>, to restore them
+		after table was recreated by an importer. Rows for which condition is NULL (e.g. without location) are outside.
+		The copy is no temp table, as importers changing PRAGMA temp_store (see BulkLoader) drop all temp tables.
+		"""
+		db.execute("DROP TABLE IF EXISTS scope_outside_{}".format(table))
+		if table_exists(db, table):
+			db.execute("CREATE TABLE scope_outside_{0} AS SELECT * FROM {0} WHERE NOT IFNULL(({1}), 0)".format(table, condition), params)
+		db.commit()
+
+	def restore_outside(self, db, table, condition, params, key):
+		"""
+		Deletes the rows of table not matching condition and restores the rows kept by keep_outside,
+		unless a row with the same key (e.g. of a stop moved into the scope) remains.
+		Columns not existing in the recreated table are not restored.
+		"""
+		db.execute("DELETE FROM {} WHERE NOT IFNULL(({}), 0)".format(table, condition), params)
+		if table_exists(db, "scope_outside_{}".format(table)):
+			columns = [column[1] for column in db.execute("PRAGMA main.table_info({})".format(table))]
+			kept_columns = set(column[1] for column in db.execute("PRAGMA table_info(scope_outside_{})".format(table)))
+			common_columns = ', '.join(column for column in columns if column in kept_columns)
+			cur = db.execute("INSERT INTO {0} ({1}) SELECT {1} FROM scope_outside_{0} WHERE {2} NOT IN (SELECT {2} FROM main.{0})".format(
+				table, common_columns, key))
+			self.logger.info("Restored %s rows of %s outside of scope %s", cur.rowcount, table, self)
+			db.execute("DROP TABLE scope_outside_{}".format(table))
+		db.commit()
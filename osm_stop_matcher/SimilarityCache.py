@@ -0,0 +1,82 @@
+import logging
+import ngram
+import sys
+from collections import OrderedDict
+
+from . import config
+
+class LruCache():
+	"""
+	Dict with at most max_size entries, evicting the least recently used one.
+	Counts hits and misses and estimates the memory used by keys and values.
+	"""
+
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.size_in_bytes = 0
+
+	def get(self, key, compute):
+		try:
+			value = self.entries[key]
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return value
+		except KeyError:
+			pass
+		self.misses += 1
+		value = compute()
+		self.entries[key] = value
+		self.size_in_bytes += self.entry_size(key, value)
+		if len(self.entries) > self.max_size:
+			(evicted_key, evicted_value) = self.entries.popitem(last = False)
+			self.size_in_bytes -= self.entry_size(evicted_key, evicted_value)
+		return value
+
+	def entry_size(self, key, value):
+		size = sys.getsizeof(key) + sys.getsizeof(value)
+		if isinstance(key, tuple):
+			size += sum(sys.getsizeof(element) for element in key)
+		if isinstance(value, list):
+			size += sum(sys.getsizeof(element) for element in value)
+		return size
+
+	def stats(self):
+		return (self.hits, self.misses, len(self.entries), self.size_in_bytes)
+
+class SimilarityCache():
+	"""
+	Caches normalized names and the ngram similarity of name pairs used by StopMatcher's
+	successor/predecessor rating, as the same names recur for many stop/candidate pairs.
+	(Name rating computes the similarities of whole batches at once, see NameRater.)
+
+	Both caches are bounded LRU caches. Every StopMatcher (and hence every worker process)
+	uses its own instance, which is not shared with other processes or threads.
+	"""
+
+	def __init__(self, max_similarities = config.SIMILARITY_CACHE_SIZE, max_normalized_names = config.NORMALIZED_NAMES_CACHE_SIZE):
+		self.logger = logging.getLogger('osm_stop_matcher.SimilarityCache')
+		self.similarities = LruCache(max_similarities)
+		self.normalized_names = LruCache(max_normalized_names)
+
+	def similarity(self, name, other_name):
+		"""
+		Returns ngram.NGram.compare(name, other_name, N=1)
+		"""
+		return self.similarities.get((name, other_name), lambda: ngram.NGram.compare(name, other_name, N=1))
+
+	def normalized(self, normalize, *args):
+		"""
+		Returns normalize(*args). normalize must be a pure function of args.
+		"""
+		return self.normalized_names.get((normalize.__name__,) + args, lambda: normalize(*args))
+
+	def stats(self):
+		return {'similarities': self.similarities.stats(), 'normalized names': self.normalized_names.stats()}
+
+	def log_stats(self, stats = None):
+		for (cache, (hits, misses, entries, size_in_bytes)) in (stats or self.stats()).items():
+			self.logger.info("Cache %s: %s hits, %s misses (hit rate %.1f%%), %s entries, ~%.1f MB",
+				cache, hits, misses, 100.0 * hits / max(hits + misses, 1), entries, size_in_bytes / 1024 / 1024)
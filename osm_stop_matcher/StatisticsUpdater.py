@@ -11,13 +11,20 @@ class StatisticsUpdater():
          GROUP BY substr(globaleID, 0, instr(substr(globaleID||':',4), ':')+3), match_state
         """
 
-	def __init__(self, db):
+	def __init__(self, db, scope = None):
 		self.db = db
+		self.scope = scope
+		# restricts match state updates to the stops of a prepared RegionScope
+		self.stop_filter = scope.stop_filter() if scope else ''
+		self.osm_filter = scope.osm_filter() if scope else ''
 		self.logger = logging.getLogger('osm_stop_matcher.StatisticsUpdater')
 
 	def update_match_statistics(self, metadata):
 		self.create_stats_tables_if_not_existant()
 		run_id = self.retrive_new_run_id()
+		if self.scope:
+			# labels the run, so that its statistics can be told apart from those of unscoped runs
+			metadata = dict(metadata, scope = self.scope)
 		self.store_metadata(run_id, metadata)
 		self.update_match_states()
 		self.persists_stats(run_id)
@@ -36,53 +43,62 @@ class StatisticsUpdater():
 		
 		for key in metadata:
 			self.db.execute("INSERT INTO match_meta_data VALUES(?, ?, ?)", (run_id, key, str(metadata[key])))
-		self.db.execute("INSERT INTO match_meta_data SELECT ?, key, value FROM match_meta_data WHERE run_id=? AND key NOT IN (SELECT key FROM match_meta_data WHERE run_id=?)", (run_id, run_id-1, run_id))
+		# the scope only describes the run it was given for
+		self.db.execute("INSERT INTO match_meta_data SELECT ?, key, value FROM match_meta_data WHERE run_id=? AND key <> 'scope' AND key NOT IN (SELECT key FROM match_meta_data WHERE run_id=?)", (run_id, run_id-1, run_id))
 		self.db.commit()
 
 	def persists_stats(self, run_id):
+		# Counts all stops, not only those in scope: stops outside of the scope keep their previous
+		# match_state, so a scoped run's statistics cover every district, just like an unscoped run's
 		self.db.execute(self.MATCH_STATE_PER_REGION_QUERY, (run_id,))
 		self.db.commit()
 
+	def update_stops(self, statement):
+		self.db.execute(statement + self.stop_filter)
+
+	def update_osm_stops(self, statement):
+		self.db.execute(statement + self.osm_filter)
+
 	def update_match_states(self):
 		self.logger.info('Update statistics')
-		self.db.execute("""UPDATE haltestellen_unified 
+		self.update_stops("""UPDATE haltestellen_unified 
 			                  SET match_state='MATCHED' 
 			                WHERE globaleID IN (SELECT ifopt_id FROM matches)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_NAMES_DIFFER' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_NAMES_DIFFER' 
 			                WHERE globaleID IN (SELECT ifopt_id FROM matches WHERE name_distance < 0.4)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_NO_NAME' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_NO_NAME' 
 							WHERE match_state='MATCHED_THOUGH_NAMES_DIFFER' 
 							  AND Haltestelle IS NULL AND Haltestelle_lang IS NULL""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_OSM_NO_NAME' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_OSM_NO_NAME' 
 							WHERE globaleID IN (SELECT ifopt_id FROM matches m, osm_stops o WHERE (o.name IS NULL OR o.empty_name > 0) AND m.osm_id = o.osm_id)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_DISTANT' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_DISTANT' 
 							WHERE globaleID IN (SELECT ifopt_id FROM matches m WHERE distance > 200)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_IMPROBABLE' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_IMPROBABLE' 
 							WHERE globaleID IN (SELECT ifopt_id FROM matches m WHERE rating < 0.002)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_REVERSED_DIR' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_THOUGH_REVERSED_DIR' 
 							WHERE globaleID IN (SELECT ifopt_id FROM matches m WHERE successor_rating =-1)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='MATCHED_AMBIGUOUSLY' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='MATCHED_AMBIGUOUSLY' 
 							WHERE globaleID IN (SELECT ifopt_id FROM matches GROUP BY ifopt_id HAVING count(*)>1)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='NO_MATCH' 
-							WHERE globaleID NOT IN (SELECT ifopt_id FROM matches);""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='NO_MATCH_AND_SEEMS_UNSERVED' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='NO_MATCH' 
+							WHERE globaleID NOT IN (SELECT ifopt_id FROM matches)""")
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='NO_MATCH_AND_SEEMS_UNSERVED' 
 							WHERE match_state LIKE 'NO_MATCH%' AND linien IS NULL""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='NO_MATCH_BUT_OTHER_PLATFORM_MATCHED' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='NO_MATCH_BUT_OTHER_PLATFORM_MATCHED' 
 							WHERE match_state='NO_MATCH' AND PARENT IN (SELECT h.parent FROM matches m, haltestellen_unified h WHERE m.ifopt_id = h.globaleID)""")
-		self.db.execute("""UPDATE haltestellen_unified SET match_state='NO_MATCH_NO_IFOPT' 
+		self.update_stops("""UPDATE haltestellen_unified SET match_state='NO_MATCH_NO_IFOPT' 
 							WHERE globaleID IS NULL""")
 
-		self.db.execute("""UPDATE osm_stops SET match_state = 'MATCHED' 
+		self.update_osm_stops("""UPDATE osm_stops SET match_state = 'MATCHED' 
 			                WHERE osm_id IN (SELECT osm_id FROM matches)""")
-		self.db.execute("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_NAMES_DIFFER' 
+		self.update_osm_stops("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_NAMES_DIFFER' 
 			                WHERE osm_id IN (SELECT osm_id FROM matches WHERE name_distance < 0.4)""")
-		self.db.execute("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_OSM_NO_NAME' 
+		self.update_osm_stops("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_OSM_NO_NAME' 
 			                WHERE (name IS NULL OR empty_name > 0) AND osm_id  IN (SELECT osm_id FROM matches m )""")
-		self.db.execute("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_DISTANT' 
+		self.update_osm_stops("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_DISTANT' 
 			                WHERE osm_id IN (SELECT osm_id FROM matches m WHERE distance > 200)""")
-		self.db.execute("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_IMPROBABLE' 
+		self.update_osm_stops("""UPDATE osm_stops SET match_state='MATCHED_THOUGH_IMPROBABLE' 
 			                WHERE osm_id IN (SELECT osm_id FROM matches WHERE rating < 0.002)""")
-		self.db.execute("""UPDATE osm_stops SET match_state = 'NO_MATCH' 
+		self.update_osm_stops("""UPDATE osm_stops SET match_state = 'NO_MATCH' 
 			                WHERE osm_id NOT IN (SELECT osm_id FROM matches)""")
 		self.logger.info('Updated statistics')
 		
@@ -1,59 +1,119 @@
 import logging
 import math
-import ngram
-import re
-
-from rtree import index
-from haversine import haversine, Unit
-
-from osm_stop_matcher.util import  drop_table_if_exists, backup_table_if_exists
+import multiprocessing
+import os
+from collections import deque
+
+import numpy as np
+
+from osm_stop_matcher.BulkLoader import BulkLoader
+from osm_stop_matcher.CandidateBatch import CandidateBatch
+from osm_stop_matcher.CandidateIndex import CandidateIndex
+from osm_stop_matcher.CandidateRow import CandidateRow
+from osm_stop_matcher.FeatureExtractor import FeatureExtractor
+from osm_stop_matcher.MatchFingerprints import MatchFingerprints
+from osm_stop_matcher.MatchTrace import MatchTrace
+from osm_stop_matcher.ModeRater import ModeRater
+from osm_stop_matcher.NameRater import NameRater
+from osm_stop_matcher.PlatformRater import PlatformRater
+from osm_stop_matcher.SuccessorRater import SuccessorRater
+from osm_stop_matcher.SimilarityCache import SimilarityCache
+from osm_stop_matcher.util import  drop_table_if_exists, backup_table_if_exists, haversine_distances, spatialite_line, table_exists
 
 from . import config
 
 class StopMatcher():
 	
-	STOPS_SEPARATOR = '/'
-	
-	official_matches = {}
-	osm_matches = {}
-	errors = {}
+	RAIL_MODES = ['trainish', 'train','light_rail','tram']
 
-	def __init__(self, db):
+	def __init__(self, db, processes = config.MATCH_PROCESSES):
 		self.db = db
-		self.osm_stops = index.Index()
+		self.processes = processes
+		self.osm_stops = None
+		self.similarity_cache = SimilarityCache()
+		self.features = FeatureExtractor(db)
+		# raters may be replaced by other implementations rating the same aspect (see Rater)
+		self.name_rater = NameRater()
+		self.mode_rater = ModeRater()
+		self.successor_rater = SuccessorRater(self.similarity_cache)
+		self.platform_rater = PlatformRater()
+		# None if tracing is off, so the rating loop can skip it at no cost
+		self.trace = MatchTrace(db) if config.MATCH_TRACE else None
 		self.logger = logging.getLogger('osm_stop_matcher.StopMatcher')	
 
-	def match_stops(self):
-		self._match_stops('%', export = True)
-
-	def _match_stops(self, id_pattern = '%', export = False):
+	def match_stops(self, id_pattern = '%', incremental = False, scope = None, picker = None):
+		"""
+		Matches the stops whose globaleID is like id_pattern and exports their candidates.
+		If incremental, only stops which changed or have a changed osm stop in their neighbourhood
+		since the last match run (of all stops) are rematched and their candidates replaced.
+		If a RegionScope is given, only the stops in scope are (re)matched and their candidates replaced.
+		If a MatchPicker is given and all stops like id_pattern are matched, it partitions the candidates
+		while they are rated, instead of reading them from table candidates afterwards, and then picks their matches.
+		Returns the globaleIDs of the rematched stops, or None, if all stops like id_pattern were matched.
+		"""
+		fingerprints = MatchFingerprints(self.db)
+		stop_ids = fingerprints.changed_stop_ids() if incremental and id_pattern == '%' else None
+		if scope is not None:
+			stop_ids = scope.stop_ids(self.db) if stop_ids is None else stop_ids & scope.stop_ids(self.db)
+			self.export_match_candidates(self.rated_candidates(stop_ids = stop_ids, osm_bounds = scope.osm_bounds(self.db)), replaced_stop_ids = stop_ids)
+		elif stop_ids is None:
+			self.export_match_candidates(self.rated_candidates(id_pattern), picker = picker)
+		else:
+			self.export_match_candidates(self.rated_candidates(stop_ids = stop_ids), replaced_stop_ids = stop_ids)
+		# scoped runs keep the fingerprints of the last unscoped run, as stops outside of scope were not rematched
+		if scope is None and id_pattern == '%':
+			fingerprints.store()
+		elif scope is None:
+			# candidates of other stops are missing, so the next incremental run needs to match all stops
+			fingerprints.clear()
+		self.logger.info("Matched %s stops and exported candidates", 'all' if stop_ids is None else len(stop_ids))
+		return stop_ids
+
+	def rated_candidates(self, id_pattern = '%', stop_ids = None, osm_bounds = None):
+		"""
+		Matches the stops whose globaleID is like id_pattern (or, if given, is one of stop_ids) and yields (stop_id, candidate_rows)
+		for every stop with candidates, where candidate_rows are rows of table candidates.
+		Stops are read and matched in batches, so only the stops of the current batches are held in memory.
+		If osm_bounds (min_lat, min_lon, max_lat, max_lon) are given, only osm stops within are candidates.
+		"""
+		self.features.extract_features(only_missing = True)
 		self.logger.info("Loading osm data to index")
-		self.load_osm_index()
+		self.load_osm_index(osm_bounds)
 		self.logger.info("Loaded osm data to index")
-		row = 0
-		cur = self.db.execute("SELECT * FROM haltestellen_unified where lon IS NOT NULL AND globaleID like ?", [id_pattern])
-		stops = cur.fetchall()
-		for stop in stops:
-			row += 1
-			self.match_stop(stop, stop["globaleID"], (float(stop["lat"]),float(stop["lon"])), row)
-		
-		self.logger.info("Matched stops")
-		if export:	
-			self.export_match_candidates()
-			self.logger.info("Exported candidates")
-
-	def load_osm_index(self):
-		cur = self.db.execute("SELECT * FROM osm_stops")
-		cnt = 0
+		# ordered by globaleID, so batches contain stops of few districts
+		if stop_ids is None:
+			cur = self.db.execute("SELECT * FROM haltestellen_unified where lon IS NOT NULL AND globaleID like ? ORDER BY globaleID", [id_pattern])
+		else:
+			self.db.execute("DROP TABLE IF EXISTS temp.match_stop_ids")
+			self.db.execute("CREATE TEMP TABLE match_stop_ids (globaleID TEXT PRIMARY KEY)")
+			self.db.executemany("INSERT INTO temp.match_stop_ids VALUES (?)", ((stop_id,) for stop_id in stop_ids))
+			cur = self.db.execute("""SELECT * FROM haltestellen_unified where lon IS NOT NULL
+				AND globaleID IN (SELECT globaleID FROM temp.match_stop_ids) ORDER BY globaleID""")
+		batches = ([dict(stop) for stop in batch] for batch in iter(lambda: cur.fetchmany(config.MATCH_BATCH_SIZE), []))
+		if self.processes > 1:
+			yield from self.rated_candidates_parallel(batches)
+		else:
+			for stops in batches:
+				for (stop, rated_candidates) in self.match_stop_batch(stops):
+					yield (stop["globaleID"], self.candidate_rows(stop, rated_candidates))
+			self.similarity_cache.log_stats()
+
+	def load_osm_index(self, bounds = None):
+		if bounds is None:
+			cur = self.db.execute("SELECT * FROM osm_stops")
+		else:
+			(min_lat, min_lon, max_lat, max_lon) = bounds
+			cur = self.db.execute("SELECT * FROM osm_stops WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?", [min_lat, max_lat, min_lon, max_lon])
 		rows = cur.fetchall()
+		osm_stop_list = []
 		for stop in rows:
-			cnt += 1
 			lat = stop["lat"]
 			lon = stop["lon"]
 			id = stop["osm_id"]
 			stop = {
 				"id": id,
 				"name": stop["name"],
+				"name_normalized": stop["name_normalized"],
 				"network": stop["network"],
 				"operator": stop["operator"],
 				"lat": lat,
@@ -66,7 +126,20 @@ class StopMatcher():
 				"prev_stops": stop["prev_stops"],
 				"assumed_platform": stop["assumed_platform"]
 			}
-			self.osm_stops.insert(id = cnt, coordinates=(lat, lon, lat, lon), obj= stop)
+			osm_stop_list.append(stop)
+		self.build_osm_index(osm_stop_list)
+
+	def build_osm_index(self, osm_stop_list):
+		# candidate attributes, indexed by the candidate ids returned by osm_stops
+		self.osm_stop_list = osm_stop_list
+		self.osm_lats = np.array([stop["lat"] for stop in self.osm_stop_list], dtype=float)
+		self.osm_lons = np.array([stop["lon"] for stop in self.osm_stop_list], dtype=float)
+		self.osm_stops = CandidateIndex(self.osm_lats, self.osm_lons, config.MAXIMUM_DISTANCE)
+		self.osm_refs = np.array([stop["ref"] for stop in self.osm_stop_list], dtype=object)
+		self.osm_rail_modes = np.array([stop["mode"] in self.RAIL_MODES for stop in self.osm_stop_list], dtype=bool)
+		self.osm_bus_modes = np.array([stop["mode"] == 'bus' for stop in self.osm_stop_list], dtype=bool)
+		for rater in self.raters():
+			rater.prepare(self.osm_stop_list)
 
 	def substring_after(self, string , char):
 		index = string.find(char)
@@ -75,235 +148,291 @@ class StopMatcher():
 		else:
 			return string
 
-	def compare_stop_names(self, offical_stoplist, osm_stoplist):
-		if osm_stoplist is None:
-			return 0
-
-		best_value = 0
-		for official_stop in re.sub("\(\w*\)", '', offical_stoplist).split(self.STOPS_SEPARATOR):
-			for osm_stop in re.sub("\(\w*\)", '', osm_stoplist).split(self.STOPS_SEPARATOR):
-
-				value = ngram.NGram.compare(official_stop, osm_stop, N=1)
-				if value > best_value:
-					best_value = value
-
-		return best_value
+	def raters(self):
+		return [self.name_rater, self.mode_rater, self.successor_rater, self.platform_rater]
 
-	# TODO all rate methods should be move to proper classes to allow replacing etc.
 	def rate_successor_matching(self, stop, osm_stop):
-		richtung = stop["Name_Steig"]
-		ortsteil = stop['Ortsteil']
-		gemeinde = stop['Gemeinde']
-
-		if richtung:
-			match = re.match(config.DIRECTION_PREFIX_PATTERN, richtung)
-			if match:
-				richtung = match.group(3).strip()
-				richtung = self.normalize_direction(richtung, ortsteil, gemeinde)
-				# Note: removing the current stop's city from the successor/predecessor might remove the wrong significant part,
-				# e.g. 
-				next_stops = self.normalize_direction(osm_stop["next_stops"], ortsteil, gemeinde) if osm_stop["next_stops"] else None
-				prev_stops = self.normalize_direction(osm_stop["prev_stops"], ortsteil, gemeinde) if osm_stop["prev_stops"] else None
-				similarity_next = self.compare_stop_names(richtung, next_stops)
-				similarity_prev = self.compare_stop_names(richtung, prev_stops)
-				self.logger.info("Successor ranking for %s (%s, %s): next %s (%.2f) prev %s (%.2f)", richtung, ortsteil, gemeinde, next_stops, similarity_next, prev_stops, similarity_prev)
-				if similarity_next >= config.MINIMUM_SUCCESSOR_SIMILARITY and (similarity_next - similarity_prev) >= config.MINIMUM_SUCCESSOR_PREDECESSOR_DISTANCE:
-					return 1
-				elif similarity_prev >= config.MINIMUM_SUCCESSOR_SIMILARITY and (similarity_prev - similarity_next) >= config.MINIMUM_SUCCESSOR_PREDECESSOR_DISTANCE:
-					return -1
-				else:
-					return 0
-		return -0.5
-
-	def normalize_direction(self, dir, ortsteil, gemeinde):
-		dir = dir.replace(ortsteil+' ', '') if ortsteil else dir
-		dir = dir.replace(gemeinde+' ', '') if gemeinde else dir
-		return dir.replace('trasse', 'tr').replace(',', ' ').replace('-', ' ').strip()
+		return self.successor_rater.rate(stop, osm_stop)
 
 	def rate_mode(self, stop, candidate):
-		if (candidate["mode"] == stop["mode"] or
-			candidate["mode"] == 'trainish' and stop["mode"] in ['train', 'light_rail']):
-			return 1
-		elif not stop["mode"]:
-			# official stop not served, will result in greater malus
-			return config.UNSERVED_STOP_RATING
-		elif not candidate["mode"]:
-			# than OSM mode unknown
-			return config.UNKNOWN_MODE_RATING
-		else:
-			return 0
+		return self.mode_rater.rate(stop, candidate)
 
 	def rate_platform(self, stop, candidate):
-		ifopt_platform = stop["platform_code"]
-		candidate_platform = candidate["assumed_platform"]
-
-		if (ifopt_platform == None or ifopt_platform=='') and (candidate_platform == None or candidate_platform == ''):
-			return 0.9
-		elif not (ifopt_platform == None or ifopt_platform=='') and (candidate_platform == None or candidate_platform == ''):
-			# usually, platform should be tagged in OSM, but especially for bus quais, that might not be the case, so just give small discount
-			return 0.85
-		elif ifopt_platform == str(candidate_platform):
-			return 1.0
-		else:
-			return 0.0
-		
-	def normalize_name(self, name):
-		if not name:
-			return name
-		normalized_name = re.sub("\([\w\. ]*\)", '', name)
-		normalized_name = re.sub("Bahnhof$|Bhf$|Bf$", 'Bf', normalized_name)
-		normalized_name = re.sub("Ort$", '', normalized_name)
-		normalized_name = re.sub("trasse$", 'tr', normalized_name)
-		return normalized_name
+		return self.platform_rater.rate(stop, candidate)
 
 	def rate_name_equivalence(self, stop, candidate):
-		osm_name = self.normalize_name(candidate["name"])
-		name_short = self.normalize_name(stop["Haltestelle"])
-		name_long = self.normalize_name(stop["Haltestelle_lang"])
-
-		if osm_name and osm_name in name_short:
-			# If full (normalized) osm_name is part of the official stop_name,
-			# we deem this a full match. I.E. as official stop names often include 
-			# additional city/settelment names
-			return (1.0, stop["Haltestelle"])
-
-		name_distance_short_name = ngram.NGram.compare(name_short, osm_name, N=1)
-		name_distance_long_name = ngram.NGram.compare(name_long, osm_name, N=1)
-		if not name_short and not name_long:
-			self.logger.info("Stop %s has no name. Use fix name_distance", stop["globaleID"])
-			name_distance_short_name = config.MINIMUM_NAME_SIMILARITY
-			name_distance_long_name = config.MINIMUM_NAME_SIMILARITY
-		elif not osm_name:
-			self.logger.info("OSM stop %s has no name. Use fix name_distance", candidate["id"])
-			name_distance_short_name = config.MINIMUM_NAME_SIMILARITY
-			name_distance_long_name = config.MINIMUM_NAME_SIMILARITY
-		
-		if name_distance_short_name > name_distance_long_name:
-			return (name_distance_short_name, stop["Haltestelle"])
-		else:
-			return (name_distance_long_name, stop["Haltestelle_lang"])
-
-	def rate_candidate(self, stop, candidate, distance):
-		osm_name = candidate["name"]
-		(name_distance, matched_name) = self.rate_name_equivalence(stop, candidate)
-		mode_rating = self.rate_mode(stop, candidate)
-		successor_rating = self.rate_successor_matching(stop, candidate)
-		platform_rating = self.rate_platform(stop, candidate)
-
-		if candidate["ref"] == stop["globaleID"]:
-			# TODO: We currently ignore, that OSM IFOPTS are currently duplicated for some stops...
-			rating = 1
-		else:
-			rating = name_distance / ( 1 + distance / 10.0 )
-			# We boost a candidate if steig matches
-			# Note: since OSM has some refs wrongly tagged as bus route number...
-			
-			rating = (rating * (0.5 + 0.5 * platform_rating)) ** (1 - successor_rating * 0.3 - mode_rating * 0.2)
-
-		self.logger.debug("rating: %s name_distance: %s matched_name: %s osm_name: %s platform_rating: %s successor_rating: %s, mode_rating: %s", rating, name_distance, matched_name, osm_name, platform_rating, successor_rating, mode_rating)
-		return (rating, name_distance, matched_name, osm_name, platform_rating, successor_rating, mode_rating)
-
-	def rate_candidates(self, stop, stop_id, coords, candidates):
+		return self.name_rater.rate_name_equivalence(stop, candidate)
+
+	def rate_batch(self, batch):
+		"""
+		Rates the candidate pairs of batch (see CandidateBatch) by composing the ratings of the raters.
+		Returns the arrays (rating, name_distance, platform_rating, successor_rating, mode_rating), one element per pair.
+		"""
+		name_distances = self.name_rater.rate_batch(batch)
+		mode_ratings = self.mode_rater.rate_batch(batch)
+		successor_ratings = self.successor_rater.rate_batch(batch)
+		platform_ratings = self.platform_rater.rate_batch(batch)
+
+		stop_ids = np.array([stop["globaleID"] for stop in batch.stops], dtype=object)
+		# TODO: We currently ignore, that OSM IFOPTS are currently duplicated for some stops...
+		ref_matches = self.osm_refs[batch.candidate_ids] == stop_ids[batch.stop_indexes]
+		# We boost a candidate if steig matches
+		# Note: since OSM has some refs wrongly tagged as bus route number...
+		bases = name_distances / ( 1 + batch.distances / 10.0 ) * (0.5 + 0.5 * platform_ratings)
+		exponents = 1 - successor_ratings * 0.3 - mode_ratings * 0.2
+		# python's pow, as numpy's vectorised power may differ in the last bit, which would change picks of equally rated candidates
+		powers = np.array([base ** exponent for (base, exponent) in zip(bases.tolist(), exponents.tolist())], dtype=float)
+		ratings = np.where(ref_matches, 1.0, powers)
+		return (ratings, name_distances, platform_ratings, successor_ratings, mode_ratings)
+
+	def filter_candidates(self, stops, candidate_ids, stop_indexes):
+		"""
+		Computes the distances of all candidates (indexes into osm_stop_list) to their stops
+		(stop_indexes into stops) in one step and retains the candidates within MAXIMUM_DISTANCE
+		which have a compatible mode, per stop at most the MAX_EVALUATED_CANDIDATES_* nearest ones.
+		Returns the retained candidate_ids, stop_indexes and distances, ordered by stop and distance.
+		"""
+		stop_lats = np.array([float(stop["lat"]) for stop in stops], dtype=float)
+		stop_lons = np.array([float(stop["lon"]) for stop in stops], dtype=float)
+		distances = haversine_distances(stop_lats[stop_indexes], stop_lons[stop_indexes], self.osm_lats[candidate_ids], self.osm_lons[candidate_ids])
+
+		order = np.lexsort((candidate_ids, distances, stop_indexes))
+		(candidate_ids, stop_indexes, distances) = (candidate_ids[order], stop_indexes[order], distances[order])
+
+		stop_modes = [stop["mode"] for stop in stops]
+		bus_stops = np.array([mode == 'bus' for mode in stop_modes], dtype=bool)
+		rail_stops = np.array([mode in ["tram", "light_rail", "train"] for mode in stop_modes], dtype=bool)
+		# Ignore bahn candidates when looking for bus_stop and bus candidates when looking for railway stops
+		incompatible_mode = ((self.osm_rail_modes[candidate_ids] & bus_stops[stop_indexes]) |
+			(self.osm_bus_modes[candidate_ids] & rail_stops[stop_indexes]))
+
+		eligible = (distances <= config.MAXIMUM_DISTANCE) & ~incompatible_mode
+
+		# rank of each eligible candidate among the eligible candidates of its stop, starting with 1
+		eligible_count = np.cumsum(eligible)
+		first_candidate = np.searchsorted(stop_indexes, np.arange(len(stops)))
+		eligible_before_stop = np.concatenate(([0], eligible_count))[first_candidate]
+		rank = eligible_count - eligible_before_stop[stop_indexes]
+		max_no_of_candidates = np.array([config.MAX_EVALUATED_CANDIDATES_BUS_STATIONS if stop["bus_or_train_station"]
+			else config.MAX_EVALUATED_CANDIDATES_OTHER_STOPS for stop in stops], dtype=np.intp)
+		retained = eligible & (rank <= max_no_of_candidates[stop_indexes])
+
+		if self.trace is not None:
+			self.trace_filtered_candidates(stops, candidate_ids, stop_indexes, distances, incompatible_mode, retained)
+
+		return (candidate_ids[retained], stop_indexes[retained], distances[retained])
+
+	def trace_filtered_candidates(self, stops, candidate_ids, stop_indexes, distances, incompatible_mode, retained):
+		traced_stops = np.array([self.trace.traces(stop["globaleID"]) for stop in stops], dtype=bool)
+		for k in np.nonzero(traced_stops[stop_indexes] & ~retained)[0].tolist():
+			if distances[k] > config.MAXIMUM_DISTANCE:
+				reason = 'distance'
+			elif incompatible_mode[k]:
+				reason = 'mode'
+			else:
+				reason = 'candidate_limit'
+			self.trace.reject(stops[stop_indexes[k]]["globaleID"], self.osm_stop_list[candidate_ids[k]]["id"], reason, float(distances[k]))
+
+	def rate_candidates(self, stop_id, candidates, distances, ratings):
+		"""
+		Selects the candidates of a stop to retain, given their (rating, name_distance, platform_matches, successor_rating, mode_rating)
+		"""
 		matches = []
 		last_name_distance = 0
-		for candidate in candidates:
-			self.logger.debug('rank %s', candidate)
-			# estimate distance
-			distance = haversine(coords, (candidate["lat"],candidate["lon"]), unit=Unit.METERS)
-			if distance > config.MAXIMUM_DISTANCE:
-				return matches
-		   
-			# Ignore bahn candidates when looking for bus_stop
-			if candidate["mode"] in ['trainish', 'train','light_rail','tram'] and "bus" == stop["mode"]:
-				continue
-			# Ignore bus candidates when looking for railway stops
-			if candidate["mode"] == 'bus' and stop["mode"] in ["tram", "light_rail", "train"]:
-				continue
-			
-			(rating, name_distance, matched_name, osm_name, platform_matches, successor_rating, mode_rating) = self.rate_candidate(stop, candidate, distance)
+		trace = self.trace if self.trace is not None and self.trace.traces(stop_id) else None
+		for (candidate, distance, (rating, name_distance, platform_matches, successor_rating, mode_rating)) in zip(candidates, distances, ratings):
+			self.logger.debug("rating: %s name_distance: %s osm_name: %s platform_rating: %s successor_rating: %s, mode_rating: %s", rating, name_distance, candidate["name"], platform_matches, successor_rating, mode_rating)
 			#if last_name_distance > name_distance:
 			if last_name_distance > name_distance and name_distance < config.MINIMUM_NAME_SIMILARITY:
-				self.logger.info("Ignore {} ({})  {} ({}) with distance {} and name similarity {}. Platform matches? {} as name distance low".format(matched_name,stop_id, osm_name, candidate["id"], distance, name_distance,platform_matches))
+				if trace:
+					trace.reject(stop_id, candidate["id"], 'name', distance, name_distance, rating, platform_matches, successor_rating, mode_rating)
 				continue
 			elif rating < 0.001:
-				self.logger.info("Ignore {} ({})  {} ({}) as rating {} is low".format(matched_name,stop_id, osm_name, candidate["id"], distance, name_distance,platform_matches))
+				if trace:
+					trace.reject(stop_id, candidate["id"], 'rating', distance, name_distance, rating, platform_matches, successor_rating, mode_rating)
 				continue
-			self.logger.info("{} ({}) might match {} ({}) with distance {} and name similarity {}. Platform matches? {}".format(matched_name,stop_id, osm_name, candidate["id"], distance, name_distance,platform_matches))
-			
+			if trace:
+				trace.accept(stop_id, candidate["id"], distance, name_distance, rating, platform_matches, successor_rating, mode_rating)
+
 			matches.append({"globalID": stop_id, "match": candidate, "name_distance": name_distance, "distance": distance, "platform_matches": platform_matches, "successor_rating": successor_rating, "rating": rating, "mode_rating": mode_rating})
 			last_name_distance = name_distance
 		return matches
 
-	def store_matches(self, stop, offical_stop_id, matches):
-		self.official_matches[offical_stop_id] = matches
-		
-		for match in matches:
-			osm_id = match["match"]["id"]
-			if not osm_id in self.osm_matches:
-				 self.osm_matches[osm_id] = []
-			self.osm_matches[osm_id].append(match)
-
-	def is_bus_or_train_station(self, stop):
-		name = stop["Haltestelle"]  if stop["Haltestelle"] else stop["Haltestelle_lang"] 
-		return name and ('ahnhof' in name
-			or 'ZOB' in name
-			or 'Schulzentrum' in name
-			or 'Flughafen' in name
-			or ' Bf' in name )
-
-	def match_stop(self, stop, stop_id, coords, row):
-		max_no_of_candidates = config.MAX_EVALUATED_CANDIDATES_BUS_STATIONS if self.is_bus_or_train_station(stop) else config.MAX_EVALUATED_CANDIDATES_OTHER_STOPS
-
-		candidates = list(self.osm_stops.nearest(coords, max_no_of_candidates, objects='raw'))
-		# TODO rename rated_candidates, self.rate_candidates
-		rated_candidates = self.rate_candidates(stop, stop_id, coords, candidates)
-		if rated_candidates:	
-			self.store_matches(stop, stop_id, rated_candidates)
+	def candidate_rows(self, stop, matches):
+		"""
+		Returns the rows of table candidates for the matches of stop,
+		including the line from the osm stop to stop as SpatiaLite geometry blob
+		"""
+		return [(
+			match["globalID"], 
+			match["match"]["id"], 
+			match["rating"], 
+			match['distance'], 
+			match['name_distance'], 
+			match['platform_matches'],
+			match['successor_rating'],
+			match['mode_rating'],
+			spatialite_line(match["match"]["lon"], match["match"]["lat"], stop["lon"], stop["lat"]),
+			) for match in matches]
+
+	def match_stop_batch(self, stops):
+		"""
+		Rates the candidates of stops and returns (stop, rated_candidates) for every stop having any
+		"""
+		results = []
+		(candidate_ids, stop_indexes) = self.osm_stops.query(
+			np.array([float(stop["lat"]) for stop in stops], dtype=float),
+			np.array([float(stop["lon"]) for stop in stops], dtype=float))
+		(candidate_ids, stop_indexes, distances) = self.filter_candidates(stops, candidate_ids, stop_indexes)
+		ratings = list(zip(*(component.tolist() for component in self.rate_batch(CandidateBatch(stops, candidate_ids, stop_indexes, distances, self.osm_stop_list)))))
+
+		bounds = np.searchsorted(stop_indexes, np.arange(len(stops) + 1)).tolist()
+		candidate_ids = candidate_ids.tolist()
+		distances = distances.tolist()
+		for (stop_index, stop) in enumerate(stops):
+			start, end = bounds[stop_index], bounds[stop_index + 1]
+			candidates = [self.osm_stop_list[candidate_id] for candidate_id in candidate_ids[start:end]]
+			# TODO rename rated_candidates, self.rate_candidates
+			rated_candidates = self.rate_candidates(stop["globaleID"], candidates, distances[start:end], ratings[start:end])
+			if rated_candidates:
+				results.append((stop, rated_candidates))
+		return results
+
+	def rated_candidates_parallel(self, batches):
+		"""
+		Matches batches of stops in worker processes, each having its own copy of the osm index.
+		At most two batches per process are in flight and results are yielded in the order of batches,
+		so they equal those of a sequential run.
+		"""
+		self.logger.info("Matching stops with %s processes", self.processes)
+		cache_stats_by_worker = {}
+		pending = deque()
+		with multiprocessing.Pool(self.processes, init_match_worker, (self.osm_stop_list,)) as pool:
+			for stops in batches:
+				pending.append(pool.apply_async(match_partition, (stops,)))
+				if len(pending) < 2 * self.processes:
+					continue
+				(results, trace_rows, worker_pid, cache_stats_by_worker[worker_pid]) = pending.popleft().get()
+				if self.trace is not None:
+					self.trace.extend(trace_rows)
+				yield from results
+			while pending:
+				(results, trace_rows, worker_pid, cache_stats_by_worker[worker_pid]) = pending.popleft().get()
+				if self.trace is not None:
+					self.trace.extend(trace_rows)
+				yield from results
+
+		# stats are cumulated per worker, so sum up the latest of each
+		cache_stats = {}
+		for worker_cache_stats in cache_stats_by_worker.values():
+			for (cache, stats) in worker_cache_stats.items():
+				cache_stats[cache] = tuple(map(sum, zip(cache_stats.get(cache, (0, 0, 0, 0)), stats)))
+		self.similarity_cache.log_stats(cache_stats)
 	
-	def export_match_candidates(self):
-		drop_table_if_exists(self.db, "candidates")
-		self.db.execute('''CREATE TABLE candidates
-			 (ifopt_id text, osm_id text, rating real, distance real, name_distance real, platform_matches integer, successor_rating INTEGER, mode_rating real)''')
-		for stop_id in self.official_matches:
-			matches = self.official_matches[stop_id]
-			rows = []
-			for match in matches:
-				rows.append((
-					match["globalID"], 
-					match["match"]["id"], 
-					match["rating"], 
-					match['distance'], 
-					match['name_distance'], 
-					match['platform_matches'],
-					match['successor_rating'],
-					match['mode_rating'],
-					))
-			self.logger.debug("export match candidates ", rows)
-			self.db.executemany('INSERT INTO candidates VALUES (?,?,?,?,?,?,?,?)', rows)
-		self.db.commit()
-		self.db.execute('''CREATE INDEX osm_index ON candidates(osm_id, rating DESC)''')
-		self.db.execute('''CREATE INDEX ifopt_index ON candidates(ifopt_id, rating DESC)''')
-		
-		backup_table_if_exists(self.db, "matches", "matches_backup")
+	def export_match_candidates(self, rated_candidates, replaced_stop_ids = None, picker = None):
+		"""
+		Writes the (stop_id, candidate_rows) of rated_candidates to table candidates
+		in batches, while they are produced.
+		If replaced_stop_ids are given (and candidates exist), only the candidates of these stops are replaced,
+		otherwise candidates and matches are recreated and, if given, picker picks the matches of all candidates.
+		"""
+		if replaced_stop_ids is not None and not table_exists(self.db, "candidates"):
+			replaced_stop_ids = None
+		if replaced_stop_ids is None:
+			drop_table_if_exists(self.db, "candidates")
+			self.db.execute('''CREATE TABLE candidates
+				 (ifopt_id text, osm_id text, rating real, distance real, name_distance real, platform_matches integer, successor_rating INTEGER, mode_rating real)''')
+			try:
+				self.db.execute("SELECT InitSpatialMetaData()")
+			except:
+				pass
+			# the_geom is inserted together with the candidate rows
+			self.db.execute("SELECT AddGeometryColumn('candidates', 'the_geom', 4326, 'LINESTRING','XY')")
+		else:
+			self.db.executemany("DELETE FROM candidates WHERE ifopt_id=?", ((stop_id,) for stop_id in replaced_stop_ids))
 
-		drop_table_if_exists(self.db, "matches")
-		self.db.execute("""CREATE TABLE matches AS
-					SELECT * FROM candidates WHERE ifopt_id='Non existant'""")
+		backup_table_if_exists(self.db, "matches", "matches_backup")
 
-		# Add Spatial columns
-		try:
-			self.db.execute("SELECT InitSpatialMetaData()")
-			self.db.execute("SELECT AddGeometryColumn('matches', 'the_geom', 4326, 'LINESTRING','XY')")
-			self.db.execute("SELECT AddGeometryColumn('candidates', 'the_geom', 4326, 'LINESTRING','XY')")
-		except:
-			pass
-		self.db.execute("UPDATE osm_stops SET the_geom = MakePoint(lon,lat, 4326)")
-		self.db.execute("""UPDATE matches SET the_geom = (
-			SELECT LineFromText('LINESTRING('||o.lon||' '||o.lat||', '||n.lon||' '||n.lat||')', 4326) 
-			  FROM osm_stops o, haltestellen_unified n  
-			 WHERE o.osm_id = matches.osm_id AND matches.ifopt_id = n.globaleID AND n.lat IS NOT NULL)""") 
-		self.db.execute("""UPDATE candidates SET the_geom = (
-			SELECT LineFromText('LINESTRING('||o.lon||' '||o.lat||', '||n.lon||' '||n.lat||')', 4326) 
-			  FROM osm_stops o, haltestellen_unified n  
-			 WHERE o.osm_id = candidates.osm_id AND candidates.ifopt_id = n.globaleID AND n.lat IS NOT NULL)""")
+		# if candidates were replaced, MatchPicker repicks the matches of the replaced stops only
+		if replaced_stop_ids is None:
+			drop_table_if_exists(self.db, "matches")
+			self.db.execute("""CREATE TABLE matches AS
+						SELECT ifopt_id, osm_id, rating, distance, name_distance, platform_matches, successor_rating, mode_rating
+						  FROM candidates WHERE ifopt_id='Non existant'""")
+
+			# Add Spatial columns. Matches are inserted as candidate rows, i.e. including their geometry
+			try:
+				self.db.execute("SELECT AddGeometryColumn('matches', 'the_geom', 4326, 'LINESTRING','XY')")
+			except:
+				pass
+
+		if self.trace is not None:
+			self.trace.create_table()
+		with BulkLoader(self.db) as loader:
+			exported_candidates = self.exported_candidates(rated_candidates, loader)
+			if picker is not None and replaced_stop_ids is None:
+				# the picker writes matches via loader, so they are committed together with the candidates
+				picker.pick_matches(candidates = self.picked_candidates(exported_candidates), loader = loader)
+			else:
+				# consuming exported_candidates inserts them, nothing else is done with them
+				deque(exported_candidates, maxlen = 0)
+			if self.trace is not None:
+				self.trace.close()
+			# indexes are only needed by later runs, so they are created after matches were picked
+			if replaced_stop_ids is None:
+				loader.defer('''CREATE INDEX osm_index ON candidates(osm_id, rating DESC)''')
+				loader.defer('''CREATE INDEX ifopt_index ON candidates(ifopt_id, rating DESC)''')
 		self.db.commit()
+
+	def exported_candidates(self, rated_candidates, loader):
+		"""
+		Inserts the (stop_id, candidate_rows) of rated_candidates into table candidates via loader
+		and yields them once inserted (or buffered for insertion).
+		"""
+		exported_stop_ids = set()
+		rows = []
+		for (stop_id, candidate_rows) in rated_candidates:
+			if stop_id in exported_stop_ids:
+				# candidates of a stop replace those of a previous stop with the same globaleID
+				loader.insert('candidates', rows)
+				rows = []
+				self.db.execute("DELETE FROM candidates WHERE ifopt_id=?", [stop_id])
+			exported_stop_ids.add(stop_id)
+			rows.extend(candidate_rows)
+			if len(rows) >= loader.batch_size:
+				loader.insert('candidates', rows)
+				rows = []
+			yield (stop_id, candidate_rows)
+		loader.insert('candidates', rows)
+
+	def picked_candidates(self, exported_candidates):
+		"""
+		Yields the candidate rows of exported_candidates (ordered by stop_id) as MatchPicker reads them from table candidates,
+		i.e. as CandidateRows rated at least RATING_BELOW_CANDIDATES_ARE_IGNORED, ordered by ifopt_id and descending rating.
+		Candidates of a stop replace those of a previous stop with the same globaleID.
+		"""
+		pending_stop_id = None
+		pending_rows = []
+		for (stop_id, candidate_rows) in exported_candidates:
+			if stop_id != pending_stop_id:
+				yield from pending_rows
+			pending_stop_id = stop_id
+			# sorted is stable, so equally rated candidates remain in the order of insertion as in index ifopt_index
+			pending_rows = sorted((CandidateRow(row) for row in candidate_rows if row[2] >= config.RATING_BELOW_CANDIDATES_ARE_IGNORED),
+				key = lambda row: -row[2])
+		yield from pending_rows
+
+# StopMatcher of a worker process. Set per worker process by the pool initializer,
+# so the osm stops are sent only once to every worker.
+worker_matcher = None
+
+def init_match_worker(osm_stop_list):
+	global worker_matcher
+	worker_matcher = StopMatcher(None, processes = 1)
+	worker_matcher.build_osm_index(osm_stop_list)
+
+def match_partition(stops):
+	results = [(stop["globaleID"], worker_matcher.candidate_rows(stop, rated_candidates))
+		for (stop, rated_candidates) in worker_matcher.match_stop_batch(stops)]
+	trace_rows = worker_matcher.trace.pop_rows() if worker_matcher.trace is not None else []
+	return (results, trace_rows, os.getpid(), worker_matcher.similarity_cache.stats())
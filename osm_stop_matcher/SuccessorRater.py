@@ -0,0 +1,74 @@
+import logging
+import re
+
+import numpy as np
+
+from osm_stop_matcher.FeatureExtractor import normalize_direction, normalize_direction_of_name_steig
+from osm_stop_matcher.Rater import Rater
+
+from . import config
+
+class SuccessorRater(Rater):
+	"""
+	Rates whether the direction of an official stop (as given in Name_Steig) matches the osm stop's
+	next stops (1) or previous stops (-1) of its routes, or neither (0). Stops without direction are rated -0.5.
+	"""
+
+	STOPS_SEPARATOR = '/'
+
+	def __init__(self, similarity_cache):
+		self.similarity_cache = similarity_cache
+		self.logger = logging.getLogger('osm_stop_matcher.SuccessorRater')
+
+	def split_stop_names(self, stoplist):
+		return tuple(re.sub("\(\w*\)", '', stoplist).split(self.STOPS_SEPARATOR))
+
+	def compare_stop_names(self, offical_stoplist, osm_stoplist):
+		if osm_stoplist is None:
+			return 0
+
+		best_value = 0
+		for official_stop in self.similarity_cache.normalized(self.split_stop_names, offical_stoplist):
+			for osm_stop in self.similarity_cache.normalized(self.split_stop_names, osm_stoplist):
+
+				value = self.similarity_cache.similarity(official_stop, osm_stop)
+				if value > best_value:
+					best_value = value
+
+		return best_value
+
+	def direction(self, stop):
+		if "features_extracted" in stop:
+			return stop["direction_normalized"]
+		else:
+			# stop not read from haltestellen_unified
+			return normalize_direction_of_name_steig(stop["Name_Steig"], stop['Ortsteil'], stop['Gemeinde'])
+
+	def rate(self, stop, osm_stop):
+		return self.rate_direction(self.direction(stop), stop['Ortsteil'], stop['Gemeinde'], osm_stop)
+
+	def rate_direction(self, richtung, ortsteil, gemeinde, osm_stop):
+		if richtung is not None:
+			# Note: removing the current stop's city from the successor/predecessor might remove the wrong significant part,
+			# e.g. 
+			next_stops = self.similarity_cache.normalized(normalize_direction, osm_stop["next_stops"], ortsteil, gemeinde) if osm_stop["next_stops"] else None
+			prev_stops = self.similarity_cache.normalized(normalize_direction, osm_stop["prev_stops"], ortsteil, gemeinde) if osm_stop["prev_stops"] else None
+			similarity_next = self.compare_stop_names(richtung, next_stops)
+			similarity_prev = self.compare_stop_names(richtung, prev_stops)
+			self.logger.debug("Successor ranking for %s (%s, %s): next %s (%.2f) prev %s (%.2f)", richtung, ortsteil, gemeinde, next_stops, similarity_next, prev_stops, similarity_prev)
+			if similarity_next >= config.MINIMUM_SUCCESSOR_SIMILARITY and (similarity_next - similarity_prev) >= config.MINIMUM_SUCCESSOR_PREDECESSOR_DISTANCE:
+				return 1
+			elif similarity_prev >= config.MINIMUM_SUCCESSOR_SIMILARITY and (similarity_prev - similarity_next) >= config.MINIMUM_SUCCESSOR_PREDECESSOR_DISTANCE:
+				return -1
+			else:
+				return 0
+		return -0.5
+
+	def rate_batch(self, batch):
+		# directions are normalized once per stop, and only candidates of stops having one need to be compared
+		directions = [self.direction(stop) for stop in batch.stops]
+		ratings = np.full(len(batch), -0.5)
+		for k in np.nonzero(np.array([direction is not None for direction in directions], dtype=bool)[batch.stop_indexes])[0].tolist():
+			stop = batch.stops[batch.stop_indexes[k]]
+			ratings[k] = self.rate_direction(directions[batch.stop_indexes[k]], stop['Ortsteil'], stop['Gemeinde'], batch.osm_stop_list[batch.candidate_ids[k]])
+		return ratings
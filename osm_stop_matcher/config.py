@@ -1,19 +1,59 @@
 # Below this (empircally found) value, only very few associations are probable matches 
 RATING_BELOW_CANDIDATES_ARE_IGNORED = 0.04
 
-# To avoid combinatorial explosition when calculating best match combination per stop, 
-# we only consider the best candidate per osm_stop if a certain number of candidates is exceeded
-MAX_CANDIDATE_COUNT_PER_STOP_BEFORE_ONLY_BEST_PER_QUAY_ARE_CONSIDERED = 50
-
 MINIMUM_NAME_SIMILARITY = 0.3
 MAXIMUM_DISTANCE = 400
+# Number of official stops whose candidates' distances and mode compatibility are computed in one vectorised step
+MATCH_BATCH_SIZE = 1000
+# If > 1, official stops are matched in batches of MATCH_BATCH_SIZE stops (ordered by globaleID, i.e. grouped by district) in this many processes
+MATCH_PROCESSES = 1
 UNSERVED_STOP_RATING = 0.2
 UNKNOWN_MODE_RATING = 0.7
 SIMPLE_MATCH_PICKER = False
+# If > 1, MatchPicker picks the matches of connected components of candidates (largest first) in this many processes
+PICK_PROCESSES = 1
+# Maximum number of official stops of a connected component of candidates, whose matches MatchPicker assigns exactly at once.
+# Larger components are split into parts of whole parent stations, as the assignment's time and memory grow quadratically
+PICK_COMPONENT_MAX_STOPS = 1000
+# Number of largest connected components of candidates, which MatchPicker logs
+PICK_LOGGED_COMPONENTS = 5
+
+# Rows per executemany batch of BulkLoader
+BULK_LOAD_BATCH_SIZE = 10000
+# Pragmas applied while importers bulk load data. Note: with these settings, a crash during import may corrupt the database
+BULK_LOAD_PRAGMAS = {
+	'journal_mode': 'MEMORY',
+	'synchronous': 'OFF',
+	'cache_size': -64000,
+	'temp_store': 'MEMORY',
+}
+
+# Read only stops, route/stop_area relations and stop way nodes from the pbf instead of every object
+OSM_IMPORT_PREFILTER = True
+# If > 1, the (prefiltered) pbf import parses shards of OSM_IMPORT_SHARD_SIZE bytes in this many processes
+OSM_IMPORT_PROCESSES = 1
+OSM_IMPORT_SHARD_SIZE = 32 * 1024 * 1024
+# Radius (in degrees) around changed stops, within which OsmChangeImporter recomputes derived osm_stops
+OSM_UPDATE_NEIGHBOURHOOD = 0.01
+# Evaluate the rules deleting less specific osm_stops via OsmStopsPruner instead of SQL self-joins
+OSM_PRUNE_IN_MEMORY = True
+# Export the distinct (pred_id, succ_id) pairs of consecutive route members as table successor
+OSM_EXPORT_SUCCESSORS = False
+
+# Record why candidates were accepted or rejected in table match_trace,
+# for stops whose globaleID starts with MATCH_TRACE_ID_PREFIX (None for all) and of these a sample of MATCH_TRACE_SAMPLE_RATE
+MATCH_TRACE = False
+MATCH_TRACE_ID_PREFIX = None
+MATCH_TRACE_SAMPLE_RATE = 1.0
+
+# Maximum number of successor name pair similarities and normalized names cached per StopMatcher (i.e. per matching process)
+SIMILARITY_CACHE_SIZE = 500000
+NORMALIZED_NAMES_CACHE_SIZE = 200000
 
 MINIMUM_SUCCESSOR_SIMILARITY = 0.6
 MINIMUM_SUCCESSOR_PREDECESSOR_DISTANCE = 0.11
 
+# Maximum number of mode compatible candidates within MAXIMUM_DISTANCE, which are rated per official stop
 MAX_EVALUATED_CANDIDATES_BUS_STATIONS = 15
 MAX_EVALUATED_CANDIDATES_OTHER_STOPS = 10
 	
@@ -1,6 +1,10 @@
 import logging
 import sqlite3
+import resource
 import re
+import struct
+
+import numpy as np
 
 logger = logging.getLogger('osm_stop_matcher.util')
 
@@ -11,6 +15,9 @@ def drop_table_if_exists(db, table):
 		logger.info('Could not delete table {}'.format(table))
 		pass
 
+def table_exists(db, table):
+	return db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", [table]).fetchone() is not None
+
 def create_sequence(db, name):
 	try:
 		db.execute("CREATE TABLE {} (value int)".format(name))
@@ -53,3 +60,50 @@ def to_iso_date_format(iso_timestamp_string):
 		return None
 	else:
 		return iso_timestamp_string[0:10]
+
+OSM_TYPES = 'nwr'
+
+def osm_key(osm_type, ref):
+	"""
+	Packs an osm object's type ('n', 'w' or 'r') and id into a single integer.
+	"""
+	return ref << 2 | OSM_TYPES.index(osm_type)
+
+def osm_id(key):
+	"""
+	Returns the osm_id notation used in the database (e.g. 'n123') of an osm_key.
+	"""
+	return OSM_TYPES[key & 3] + str(key >> 2)
+
+def osm_type_and_ref(key):
+	return (OSM_TYPES[key & 3], key >> 2)
+
+def parse_osm_id(stop_id):
+	return osm_key(stop_id[0], int(stop_id[1:]))
+
+def peak_memory_mb(who = resource.RUSAGE_SELF):
+	# ru_maxrss is reported in kilobytes on linux
+	return resource.getrusage(who).ru_maxrss // 1024
+
+# Mean earth radius in meters, as used by haversine
+EARTH_RADIUS_METERS = 6371008.8
+
+def haversine_distances(lats, lons, other_lats, other_lons):
+	"""
+	Returns the haversine distances in meters between the (numpy array) coordinates lats/lons
+	and other_lats/other_lons, computed with the same formula as haversine(..., unit=Unit.METERS).
+	"""
+	lats, lons, other_lats, other_lons = (np.radians(coords) for coords in (lats, lons, other_lats, other_lons))
+	d = np.sin((other_lats - lats) * 0.5) ** 2 + np.cos(lats) * np.cos(other_lats) * np.sin((other_lons - lons) * 0.5) ** 2
+	return EARTH_RADIUS_METERS * (2 * np.arcsin(np.sqrt(d)))
+
+# SpatiaLite BLOB-Geometry (little endian): start, endian, srid, mbr, mbr end, class LINESTRING, number of points, points, end
+SPATIALITE_LINE = struct.Struct('<BBi4dBii4dB')
+
+def spatialite_line(x1, y1, x2, y2, srid = 4326):
+	"""
+	Returns the SpatiaLite geometry blob of the line from (x1, y1) to (x2, y2),
+	equivalent to LineFromText('LINESTRING(x1 y1, x2 y2)', srid) without a WKT round trip.
+	"""
+	return SPATIALITE_LINE.pack(0x00, 0x01, srid, min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), 0x7C,
+		2, 2, x1, y1, x2, y2, 0xFE)
@@ -0,0 +1,41 @@
+import sqlite3
+import unittest
+
+from osm_stop_matcher.BulkLoader import BulkLoader
+
+class BulkLoaderTest(unittest.TestCase):
+
+	def test_insert__loads_all_batches_and_creates_deferred_index(self):
+		db = sqlite3.connect(':memory:')
+		db.execute("CREATE TABLE t (a, b)")
+		with BulkLoader(db, batch_size = 3) as loader:
+			count = loader.insert('t', ((i, str(i)) for i in range(10)), "a, b")
+			loader.defer("CREATE INDEX t_a_idx ON t(a)")
+			self.assertIsNone(db.execute("SELECT name FROM sqlite_master WHERE name='t_a_idx'").fetchone())
+
+		self.assertEqual(count, 10)
+		self.assertEqual(db.execute("SELECT COUNT(*), SUM(a) FROM t").fetchone(), (10, 45))
+		self.assertIsNotNone(db.execute("SELECT name FROM sqlite_master WHERE name='t_a_idx'").fetchone())
+
+	def test_exit__restores_pragmas(self):
+		db = sqlite3.connect(':memory:')
+		synchronous = db.execute("PRAGMA synchronous").fetchone()[0]
+		with BulkLoader(db):
+			self.assertEqual(db.execute("PRAGMA synchronous").fetchone()[0], 0)
+		self.assertEqual(db.execute("PRAGMA synchronous").fetchone()[0], synchronous)
+
+	def test_nested_enter__continues_outer_load(self):
+		db = sqlite3.connect(':memory:')
+		db.execute("CREATE TABLE t (a)")
+		synchronous = db.execute("PRAGMA synchronous").fetchone()[0]
+		with BulkLoader(db) as loader:
+			loader.insert('t', [(1,)])
+			with loader:
+				loader.insert('t', [(2,)])
+				loader.defer("CREATE INDEX t_a_idx ON t(a)")
+			self.assertEqual(db.execute("PRAGMA synchronous").fetchone()[0], 0)
+			self.assertTrue(db.in_transaction)
+			self.assertIsNone(db.execute("SELECT name FROM sqlite_master WHERE name='t_a_idx'").fetchone())
+
+		self.assertEqual(db.execute("PRAGMA synchronous").fetchone()[0], synchronous)
+		self.assertIsNotNone(db.execute("SELECT name FROM sqlite_master WHERE name='t_a_idx'").fetchone())
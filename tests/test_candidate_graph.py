@@ -0,0 +1,21 @@
+import unittest
+
+from osm_stop_matcher.CandidateGraph import CandidateGraph
+
+class CandidateGraphTest(unittest.TestCase):
+
+	def test_components__connects_stops_sharing_osm_stops(self):
+		graph = CandidateGraph()
+		graph.add("C", 1)
+		graph.add("B", 2)
+		graph.add("A", 3)
+		graph.add("C", 2)
+		graph.add("D", 3)
+		graph.add("E", 4)
+
+		self.assertEqual(graph.components(), {"A": "A", "B": "B", "C": "B", "D": "A", "E": "E"})
+		self.assertEqual(graph.component_sizes(), {"A": (2, 1, 2), "B": (2, 2, 3), "E": (1, 1, 1)})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+
+import ngram
+import numpy as np
+
+from osm_stop_matcher.CharacterProfiles import CharacterProfiles
+
+class CharacterProfilesTest(unittest.TestCase):
+
+	def test_similarities__equal_ngram_compare(self):
+		osm_names = ['Rathaus', 'Hauptbahnhof', '', None, 'Marktplatz', 'Rathaus']
+		names = ['Rathausplatz', None, 'Markt', None, 'Straße (Süd)', '']
+		profiles = CharacterProfiles(osm_names)
+		rows = np.array([profiles.row(name) for name in osm_names])
+		(name_profiles, lengths) = profiles.profile(names)
+
+		similarities = profiles.similarities(name_profiles, lengths, rows)
+
+		self.assertEqual(similarities.tolist(), [ngram.NGram.compare(name, osm_name, N=1) for (name, osm_name) in zip(names, osm_names)])
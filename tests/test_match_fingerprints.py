@@ -0,0 +1,27 @@
+import sqlite3
+import unittest
+
+from osm_stop_matcher.MatchFingerprints import MatchFingerprints
+
+class MatchFingerprintsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.db = sqlite3.connect(':memory:')
+		self.db.execute("CREATE TABLE haltestellen_unified ({} TEXT)".format(' TEXT, '.join(MatchFingerprints.STOP_COLUMNS)))
+		self.db.execute("CREATE TABLE osm_stops ({} TEXT)".format(' TEXT, '.join(MatchFingerprints.OSM_STOP_COLUMNS)))
+		self.db.execute("INSERT INTO haltestellen_unified (globaleID, lat, lon, Haltestelle) VALUES ('de:08111:1', 48.7, 9.1, 'Rathaus')")
+		self.db.execute("INSERT INTO haltestellen_unified (globaleID, lat, lon, Haltestelle) VALUES ('de:08111:2', 48.8, 9.1, 'Markt')")
+		self.db.execute("INSERT INTO osm_stops (osm_id, lat, lon, name) VALUES ('n1', 48.701, 9.1, 'Rathaus')")
+
+	def test_changed_stop_ids__without_stored_fingerprints_is_none(self):
+		self.assertIsNone(MatchFingerprints(self.db).changed_stop_ids())
+
+	def test_changed_stop_ids__returns_changed_stops_and_neighbours_of_changed_osm_stops(self):
+		MatchFingerprints(self.db).store()
+		self.assertEqual(MatchFingerprints(self.db).changed_stop_ids(), set())
+
+		self.db.execute("UPDATE osm_stops SET name='Rathausplatz' WHERE osm_id='n1'")
+		self.db.execute("UPDATE haltestellen_unified SET Haltestelle='Marktplatz' WHERE globaleID='de:08111:2'")
+		self.db.execute("INSERT INTO haltestellen_unified (globaleID, lat, lon, Haltestelle) VALUES ('de:08111:3', 48.9, 9.1, 'Kirche')")
+
+		self.assertEqual(MatchFingerprints(self.db).changed_stop_ids(), {'de:08111:1', 'de:08111:2', 'de:08111:3'})
@@ -1,6 +1,40 @@
+import random
+import sqlite3
 import unittest
-
-from osm_stop_matcher.MatchPicker import best_unique_matches
+from collections import Counter
+from unittest.mock import patch
+
+from osm_stop_matcher import config
+from osm_stop_matcher.MatchPicker import MatchPicker, best_unique_matches, is_quai, pick_component_indexes, resolve_conflicts
+
+CANDIDATE_COLUMNS = "ifopt_id text, osm_id text, rating real, distance real, name_distance real, platform_matches integer, successor_rating INTEGER, mode_rating real"
+
+def create_candidates_db(seed, stop_count, osm_stop_count):
+	"""
+	Returns a db with random candidates of parent stations and their quais, sharing osm stops across parent stations
+	"""
+	rnd = random.Random(seed)
+	db = sqlite3.connect(':memory:')
+	db.row_factory = sqlite3.Row
+	db.execute("CREATE TABLE candidates ({})".format(CANDIDATE_COLUMNS))
+	db.execute("CREATE TABLE matches ({})".format(CANDIDATE_COLUMNS))
+	for i in range(stop_count):
+		stop_id = 'de:8111:{}'.format(i // 4) if i % 4 == 0 else 'de:8111:{}:1:{}'.format(i // 4, i % 4)
+		for osm_id in rnd.sample(range(osm_stop_count), rnd.randint(0, 4)):
+			db.execute("INSERT INTO candidates VALUES (?,?,?,?,?,?,?,?)", (stop_id, 'n{}'.format(osm_id),
+				rnd.random(), rnd.random() * 100, rnd.choice([0.5, 1.0]), 0, None, 1.0))
+	return db
+
+def single_assignment_matches(db):
+	"""
+	Returns the matches of all candidates picked in a single assignment, which components must not change
+	"""
+	rows = db.execute("SELECT * FROM candidates WHERE rating >= ? ORDER BY ifopt_id, rating DESC, rowid", [config.RATING_BELOW_CANDIDATES_ARE_IGNORED]).fetchall()
+	indexes = pick_component_indexes([(row["ifopt_id"], row["osm_id"], row["rating"], row["name_distance"]) for row in rows])
+	return sorted(tuple(rows[index]) for index in indexes)
+
+def picked_matches(db):
+	return sorted(tuple(row) for row in db.execute("SELECT * FROM matches"))
 
 class CandidatePickerTest(unittest.TestCase):
 	osm1 = {
@@ -65,6 +99,115 @@ class CandidatePickerTest(unittest.TestCase):
 
 		self.assertEqual(rating, 0.0)
 
+	def test_three_agency_competing_for_osm__picks_best_assignment(self):
+		candidates = {
+			"A": [{"ifopt_id": "A", "osm_id": 1, "rating": 0.9}, {"ifopt_id": "A", "osm_id": 2, "rating": 0.8}],
+			"B": [{"ifopt_id": "B", "osm_id": 1, "rating": 0.85}],
+			"C": [{"ifopt_id": "C", "osm_id": 2, "rating": 0.5}, {"ifopt_id": "C", "osm_id": 3, "rating": 0.1}],
+			"D": []
+			}
+
+		(rating, matches) = best_unique_matches(candidates)
+
+		self.assertEqual(sorted((match["ifopt_id"], match["osm_id"]) for match in matches), [("A", 2), ("B", 1), ("C", 3)])
+		self.assertAlmostEqual(rating, (0.8 + 0.85 + 0.1 + 0.04) / 4)
+
+	def test_pick_component_indexes__assigns_stops_sharing_osm_stops_together(self):
+		component = [
+			("de:08111:1:1:1", "n1", 0.9, 1.0),
+			("de:08111:1:1:1", "n2", 0.8, 1.0),
+			("de:08111:2:1:1", "n1", 0.85, 1.0),
+			("de:08111:3", "n3", 0.6, 1.0),
+			("de:08111:3", "n4", 0.5, 1.0),
+			("de:08111:3", "n5", 0.4, 0.5),
+			]
+
+		self.assertEqual(pick_component_indexes(component), [1, 2, 3, 4])
+
+	def test_picked_parts_parallel__equals_serial_pick(self):
+		parts = [[{"ifopt_id": "de:1:%d:1:%d" % (part, quai), "osm_id": osm_id, "rating": (part * 7 + quai * 3 + osm_id) % 10 / 10.0,
+			"name_distance": 1.0}
+			for quai in range(part % 4 + 1) for osm_id in range(part % 5 + 1)] for part in range(30)]
+
+		picked_parts = list(MatchPicker(None, processes = 2).picked_parts(parts))
+
+		self.assertEqual(picked_parts, list(MatchPicker(None, processes = 1).picked_parts(parts)))
+
+	def test_pick_matches__equals_single_assignment_of_all_candidates(self):
+		db = create_candidates_db(1, 400, 150)
+
+		MatchPicker(db).pick_matches()
+		self.assertEqual(picked_matches(db), single_assignment_matches(db))
+		MatchPicker(db, processes = 2).pick_matches()
+		self.assertEqual(picked_matches(db), single_assignment_matches(db))
+
+	def test_pick_matches_of_split_components__matches_osm_stops_and_quais_once(self):
+		db = create_candidates_db(1, 400, 150)
+
+		with patch.object(config, 'PICK_COMPONENT_MAX_STOPS', 10), self.assertLogs('osm_stop_matcher.MatchPicker') as logs:
+			MatchPicker(db).pick_matches()
+		matches = picked_matches(db)
+
+		self.assertTrue(any(' parts, of which ' in message for message in logs.output))
+		self.assertEqual(max(Counter(match[1] for match in matches).values()), 1)
+		self.assertEqual(max(Counter(match[0] for match in matches if is_quai(match[0])).values()), 1)
+
+	def test_create_repicked_stop_ids__covers_parent_station_and_stops_sharing_osm_stops(self):
+		db = sqlite3.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		db.execute("CREATE TABLE candidates ({})".format(CANDIDATE_COLUMNS))
+		db.execute("CREATE TABLE matches ({})".format(CANDIDATE_COLUMNS))
+		# a chain of 200 stops, each sharing an osm stop with the next one, i.e. a single component
+		stop_ids = ['de:8111:{}'.format(i // 4) if i % 4 == 0 else 'de:8111:{}:1:{}'.format(i // 4, i % 4) for i in range(200)]
+		db.executemany("INSERT INTO candidates VALUES (?,?,?,?,?,?,?,?)",
+			((stop_id, 'n{}'.format(i + offset), 0.5 + offset * 0.1, 1.0, 1.0, 0, None, 1.0) for (i, stop_id) in enumerate(stop_ids) for offset in [0, 1]))
+		MatchPicker(db).pick_matches()
+		# de:8111:5 was previously matched to n40, a candidate of de:8111:9:1:3 and de:8111:10
+		db.execute("UPDATE matches SET osm_id = 'n40' WHERE ifopt_id = 'de:8111:5'")
+
+		repicked_count = MatchPicker(db).create_repicked_stop_ids(['de:8111:20:1:2', 'de:8111:5'])
+
+		self.assertEqual(sorted(row[0] for row in db.execute("SELECT ifopt_id FROM temp.repicked_stop_ids")), [
+			'de:8111:10', 'de:8111:19:1:3', 'de:8111:20', 'de:8111:20:1:1', 'de:8111:20:1:2', 'de:8111:20:1:3', 'de:8111:21',
+			'de:8111:4:1:3', 'de:8111:5', 'de:8111:5:1:1', 'de:8111:5:1:2', 'de:8111:5:1:3', 'de:8111:6', 'de:8111:9:1:3'])
+		self.assertEqual(repicked_count, 14)
+
+	def test_pick_matches_of_changed_stops__retains_matches_of_others(self):
+		db = create_candidates_db(2, 400, 1000)
+		MatchPicker(db).pick_matches()
+		previous_matches = picked_matches(db)
+
+		# a removed parent station, changed quais and a new quai
+		changed_stop_ids = ['de:8111:3', 'de:8111:17:1:2', 'de:8111:42:1:1', 'de:8111:99:1:3', 'de:8111:18:1:9']
+		db.executemany("DELETE FROM candidates WHERE ifopt_id = ?", ((stop_id,) for stop_id in changed_stop_ids))
+		db.executemany("INSERT INTO candidates VALUES (?,?,?,?,?,?,?,?)",
+			((stop_id, 'n{}'.format(osm_id), 0.95, 1.0, 1.0, 0, None, 1.0) for (osm_id, stop_id) in enumerate(changed_stop_ids[1:], 1000)))
+		picker = MatchPicker(db)
+		repicked_count = picker.create_repicked_stop_ids(changed_stop_ids)
+		repicked_stop_ids = set(row[0] for row in db.execute("SELECT ifopt_id FROM temp.repicked_stop_ids"))
+		picker.pick_matches(stop_ids = changed_stop_ids)
+		matches = picked_matches(db)
+
+		self.assertLess(repicked_count, 60)
+		self.assertEqual([match for match in matches if match[0] not in repicked_stop_ids], [match for match in previous_matches if match[0] not in repicked_stop_ids])
+		self.assertEqual(max(Counter(match[1] for match in matches).values()), 1)
+		self.assertEqual(sorted(match[:2] for match in matches if match[0] in changed_stop_ids),
+			[('de:8111:17:1:2', 'n1000'), ('de:8111:18:1:9', 'n1003'), ('de:8111:42:1:1', 'n1001'), ('de:8111:99:1:3', 'n1002')])
+
+	def test_resolve_conflicts__retains_best_match_per_osm_stop_and_best_named_per_agency_stop(self):
+		matches = [
+			{"ifopt_id": "A", "osm_id": 1, "rating": 0.9, "name_distance": 1.0},
+			{"ifopt_id": "B", "osm_id": 1, "rating": 0.5, "name_distance": 1.0},
+			{"ifopt_id": "B", "osm_id": 2, "rating": 0.4, "name_distance": 1.0},
+			{"ifopt_id": "C", "osm_id": 3, "rating": 0.8, "name_distance": 1.0},
+			{"ifopt_id": "C", "osm_id": 4, "rating": 0.6, "name_distance": 0.5},
+			{"ifopt_id": "C", "osm_id": 5, "rating": 0.7, "name_distance": 1.0},
+			]
+
+		resolved = resolve_conflicts(matches)
+
+		self.assertEqual([(match["ifopt_id"], match["osm_id"]) for match in resolved], [("A", 1), ("B", 2), ("C", 3), ("C", 5)])
+
 
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
@@ -0,0 +1,26 @@
+import sqlite3
+import unittest
+
+from osm_stop_matcher.MatchTrace import MatchTrace
+
+class MatchTraceTest(unittest.TestCase):
+
+	def test_traces__restricts_to_prefix_and_sample(self):
+		stop_ids = ['de:08111:{}'.format(i) for i in range(1000)]
+		self.assertTrue(MatchTrace(None, id_prefix = 'de:08111').traces(stop_ids[0]))
+		self.assertFalse(MatchTrace(None, id_prefix = 'de:08115').traces(stop_ids[0]))
+		sampled = [stop_id for stop_id in stop_ids if MatchTrace(None, sample_rate = 0.1).traces(stop_id)]
+		self.assertTrue(50 < len(sampled) < 150)
+
+	def test_close__writes_buffered_decisions(self):
+		db = sqlite3.connect(':memory:')
+		trace = MatchTrace(db, batch_size = 2)
+		trace.create_table()
+		trace.reject('de:08111:1', '1', 'distance', 412.0)
+		trace.reject('de:08111:1', '2', 'mode', 12.0)
+		trace.accept('de:08111:1', '3', 15.0, 0.9, 0.8, 1, 0.5, 1)
+		self.assertEqual(db.execute("SELECT count(*) FROM match_trace").fetchone()[0], 2)
+		trace.close()
+
+		rows = db.execute("SELECT osm_id, decision, reason FROM match_trace ORDER BY osm_id").fetchall()
+		self.assertEqual(rows, [('1', 'rejected', 'distance'), ('2', 'rejected', 'mode'), ('3', 'accepted', None)])
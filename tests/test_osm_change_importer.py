@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import osmium
+import spatialite
+
+from osm_stop_matcher.OsmChangeImporter import OsmChangeImporter
+from osm_stop_matcher.OsmStopsImporter import OsmStopsImporter
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+STOPS_OSM = os.path.join(DATA_DIR, 'stops.osm')
+STOPS_OSC = os.path.join(DATA_DIR, 'stops.osc')
+
+CHANGED_TABLES = ['osm_stops', 'osm_stops_raw', 'platform_nodes', 'osm_stop_areas', 'osm_stop_area_members', 'osm_route_edges']
+
+class VisibleObjectsWriter(osmium.SimpleHandler):
+	"""
+	Writes all objects which are not deleted to writer
+	"""
+	def __init__(self, writer):
+		super(VisibleObjectsWriter, self).__init__()
+		self.writer = writer
+
+	def node(self, n):
+		if not n.deleted:
+			self.writer.add_node(n)
+
+	def way(self, w):
+		if not w.deleted:
+			self.writer.add_way(w)
+
+	def relation(self, r):
+		if not r.deleted:
+			self.writer.add_relation(r)
+
+def import_osm_stops(osm_file):
+	db = spatialite.connect(':memory:')
+	db.row_factory = sqlite3.Row
+	OsmStopsImporter(db, osm_file)
+	return db
+
+def table_rows(db, table):
+	return sorted(tuple(row) for row in db.execute("SELECT * FROM {}".format(table)))
+
+class OsmChangeImporterTest(unittest.TestCase):
+
+	def write_changed_osm(self, directory):
+		changed = os.path.join(directory, 'stops_changed.osm')
+		reader = osmium.MergeInputReader()
+		reader.add_file(STOPS_OSM)
+		reader.add_file(STOPS_OSC)
+		writer = osmium.SimpleWriter(changed)
+		reader.apply(VisibleObjectsWriter(writer), simplify = True)
+		writer.close()
+		return changed
+
+	def test_applied_change__equals_full_reimport(self):
+		# stops.osc creates, modifies and deletes a stop node and a platform way
+		db = import_osm_stops(STOPS_OSM)
+		OsmChangeImporter(db, STOPS_OSC)
+
+		with tempfile.TemporaryDirectory() as directory:
+			reimported = import_osm_stops(self.write_changed_osm(directory))
+
+		for table in CHANGED_TABLES:
+			self.assertEqual(table_rows(db, table), table_rows(reimported, table), table)
+		# locations of nodes which are no longer part of a stop way are retained
+		self.assertLessEqual(set(table_rows(reimported, 'osm_node_locations')), set(table_rows(db, 'osm_node_locations')))
+		self.assertEqual([row[0] for row in table_rows(db, 'osm_stops')], ['n1', 'n12', 'n13', 'n8', 'n9', 'w20', 'w23'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import osmium
+import spatialite
+
+from osm_stop_matcher import config
+from osm_stop_matcher.OsmStopsImporter import OsmStop, OsmStopsImporter, parse_blob_header, pbf_blocks, split_pbf
+from osm_stop_matcher.util import osm_key
+
+STOPS_OSM = os.path.join(os.path.dirname(__file__), 'data', 'stops.osm')
+
+IMPORTED_TABLES = ['osm_stops', 'osm_stops_raw', 'platform_nodes', 'osm_stop_areas', 'osm_stop_area_members', 'osm_route_edges', 'osm_node_locations']
+
+class PbfPartWriter(osmium.SimpleHandler):
+	"""
+	Writes the nodes with the given ids respectively all ways or relations of a file to writer
+	"""
+	def __init__(self, writer, kind, node_ids = None):
+		super(PbfPartWriter, self).__init__()
+		self.writer = writer
+		self.kind = kind
+		self.node_ids = node_ids
+
+	def node(self, n):
+		if self.kind == 'node' and n.id in self.node_ids:
+			self.writer.add_node(n)
+
+	def way(self, w):
+		if self.kind == 'way':
+			self.writer.add_way(w)
+
+	def relation(self, r):
+		if self.kind == 'relation':
+			self.writer.add_relation(r)
+
+def import_osm_stops(osm_file, **kwargs):
+	db = spatialite.connect(':memory:')
+	db.row_factory = sqlite3.Row
+	OsmStopsImporter(db, osm_file, **kwargs)
+	return db
+
+def table_rows(db, table):
+	return sorted(tuple(row) for row in db.execute("SELECT * FROM {}".format(table)))
+
+class OsmStopsImporterTest(unittest.TestCase):
+
+	def write_multi_block_pbf(self, directory):
+		"""
+		Writes stops.osm as pbf with four data blocks: nodes 1-7, nodes 8-12, ways and relations,
+		so way 21 (nodes 7 and 8) has nodes in different blocks than itself and each other
+		"""
+		parts = []
+		for (kind, node_ids) in [('node', range(1, 8)), ('node', range(8, 13)), ('way', None), ('relation', None)]:
+			part = os.path.join(directory, 'part{}.osm.pbf'.format(len(parts)))
+			writer = osmium.SimpleWriter(part)
+			PbfPartWriter(writer, kind, node_ids).apply_file(STOPS_OSM)
+			writer.close()
+			parts.append(part)
+
+		pbf = os.path.join(directory, 'stops.osm.pbf')
+		with open(pbf, 'wb') as out:
+			for part in parts:
+				with open(part, 'rb') as f:
+					data = f.read()
+				for (blob_type, offset, length) in pbf_blocks(part):
+					if blob_type == 'OSMData' or part == parts[0]:
+						out.write(data[offset:offset + length])
+		return pbf
+
+	def test_prefiltered_import__equals_unfiltered_import(self):
+		unfiltered = import_osm_stops(STOPS_OSM, prefilter = False)
+		prefiltered = import_osm_stops(STOPS_OSM, prefilter = True)
+
+		for table in IMPORTED_TABLES:
+			self.assertEqual(table_rows(prefiltered, table), table_rows(unfiltered, table), table)
+		self.assertEqual([row[0] for row in table_rows(prefiltered, 'osm_stops')], ['n1', 'n11', 'n12', 'n9', 'w20', 'w21'])
+
+	def test_osm_stop__has_fields_of_osm_stops_columns(self):
+		db = import_osm_stops(STOPS_OSM)
+
+		self.assertEqual(list(OsmStop._fields), [row["name"] for row in db.execute("PRAGMA table_info(osm_stops_raw)")])
+
+	def test_import__commits_once(self):
+		db = spatialite.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		commits = []
+		db.set_trace_callback(lambda statement: commits.append(statement) if statement.strip().upper() == 'COMMIT' else None)
+
+		OsmStopsImporter(db, STOPS_OSM, prefilter = True)
+
+		self.assertEqual(len(commits), 1)
+		self.assertFalse(db.in_transaction)
+
+	def test_parse_blob_header__returns_type_and_datasize(self):
+		# type "OSMData" (field 1), indexdata (field 2, skipped), datasize 300 (field 3)
+		header = b'\x0a\x07OSMData' + b'\x12\x02\x01\x02' + b'\x18\xac\x02'
+
+		self.assertEqual(parse_blob_header(header), ('OSMData', 300))
+
+	def test_sharded_import__equals_single_process_import(self):
+		with tempfile.TemporaryDirectory() as directory:
+			pbf = self.write_multi_block_pbf(directory)
+			(header, shards) = split_pbf(pbf, 1)
+			self.assertEqual(header[0], 0)
+			self.assertEqual(len(shards), 4)
+			self.assertEqual(shards[-1][1], os.path.getsize(pbf))
+
+			single = import_osm_stops(pbf, prefilter = True, processes = 1)
+			with patch.object(config, 'OSM_IMPORT_SHARD_SIZE', 1):
+				sharded = import_osm_stops(pbf, prefilter = True, processes = 2)
+
+		unfiltered = import_osm_stops(STOPS_OSM, prefilter = False)
+		for table in IMPORTED_TABLES:
+			self.assertEqual(table_rows(sharded, table), table_rows(single, table), table)
+			self.assertEqual(table_rows(single, table), table_rows(unfiltered, table), table)
+
+	def test_add_prev_and_next_stop_names__equals_sql_union(self):
+		stops = [('n1', 'A'), ('n2', 'B'), ('w3', 'C'), ('n4', 'D'), ('n5', None), ('n6', 'A')]
+		edges = [(1, 'n7', 'n1'), (1, 'n1', 'n2'), (1, 'n2', 'w3'), (1, 'w3', 'n6'), (2, 'n6', 'n2'), (2, 'n1', 'n2'), (2, 'n2', 'n8')]
+		way_nodes = [(3, [4, 5])]
+
+		db = sqlite3.connect(':memory:')
+		db.execute("CREATE TABLE osm_stops (osm_id TEXT PRIMARY KEY, name TEXT)")
+		db.executemany("INSERT INTO osm_stops VALUES (?,?)", stops)
+		importer = OsmStopsImporter.__new__(OsmStopsImporter)
+		importer.db = db
+		importer.init_collected_data()
+		for (route_id, pred_id, succ_id) in edges:
+			importer.route_edges.append(route_id, osm_key(pred_id[0], int(pred_id[1:])), osm_key(succ_id[0], int(succ_id[1:])))
+		for (way_id, node_refs) in way_nodes:
+			importer.platform_nodes.add_way(way_id, node_refs)
+		importer.add_prev_and_next_stop_names()
+
+		reference = sqlite3.connect(':memory:')
+		reference.execute("CREATE TABLE osm_stops (osm_id TEXT PRIMARY KEY, name TEXT)")
+		reference.executemany("INSERT INTO osm_stops VALUES (?,?)", stops)
+		reference.execute("CREATE TABLE successor (pred_id TEXT, succ_id TEXT)")
+		reference.executemany("INSERT INTO successor VALUES (?,?)", set((pred_id, succ_id) for (route_id, pred_id, succ_id) in edges))
+		reference.execute("CREATE TABLE platform_nodes (way_id TEXT, node_id TEXT)")
+		reference.executemany("INSERT INTO platform_nodes VALUES (?,?)", ((way_id, node_id) for (way_id, node_id) in importer.platform_nodes))
+		# the SQL UNION add_prev_and_next_stop_names replaced
+		reference_names = dict(((osm_id, 'next'), names) for (osm_id, names) in reference.execute("""
+			SELECT pred_id osm_id, group_concat(name,'/') succ_name FROM (
+			  SELECT s.pred_id, o.name FROM successor s, osm_stops o WHERE s.succ_id = o.osm_id AND o.name IS NOT NULL
+			   UNION
+			  SELECT bus_stop.osm_id, o.name FROM successor s
+			    JOIN osm_stops o ON s.succ_id = o.osm_id
+			    JOIN platform_nodes pn ON s.pred_id = pn.way_id
+			    JOIN osm_stops bus_stop ON bus_stop.osm_id = pn.node_id
+			   WHERE o.name IS NOT NULL)
+			GROUP BY pred_id"""))
+		reference_names.update(((osm_id, 'prev'), names) for (osm_id, names) in reference.execute("""
+			SELECT succ_id osm_id, group_concat(name,'/') pred_name FROM (
+			  SELECT s.succ_id, o.name FROM successor s, osm_stops o WHERE s.pred_id = o.osm_id AND o.name IS NOT NULL
+			   UNION
+			  SELECT bus_stop.osm_id, o.name FROM successor s
+			    JOIN osm_stops o ON s.pred_id = o.osm_id
+			    JOIN platform_nodes pn ON s.succ_id = pn.way_id
+			    JOIN osm_stops bus_stop ON bus_stop.osm_id = pn.node_id
+			   WHERE o.name IS NOT NULL)
+			GROUP BY succ_id"""))
+
+		def sorted_names(names):
+			return sorted(names.split('/')) if names is not None else None
+		for (osm_id, next_stops, prev_stops) in db.execute("SELECT osm_id, next_stops, prev_stops FROM osm_stops"):
+			self.assertEqual(sorted_names(next_stops), sorted_names(reference_names.get((osm_id, 'next'))), osm_id)
+			self.assertEqual(sorted_names(prev_stops), sorted_names(reference_names.get((osm_id, 'prev'))), osm_id)
+		self.assertEqual(db.execute("SELECT next_stops, prev_stops FROM osm_stops WHERE osm_id = 'n2'").fetchone(), ('C', 'A'))
+
+
+if __name__ == '__main__':
+	unittest.main()
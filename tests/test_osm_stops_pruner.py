@@ -0,0 +1,59 @@
+import logging
+import random
+import sqlite3
+import unittest
+
+from osm_stop_matcher.OsmStopsImporter import OsmStopsImporter
+from osm_stop_matcher.OsmStopsPruner import OsmStopsPruner
+
+class OsmStopsPrunerTest(unittest.TestCase):
+
+	def random_db(self, seed):
+		rnd = random.Random(seed)
+		db = sqlite3.connect(':memory:')
+		db.execute('''CREATE TABLE osm_stops
+			(osm_id TEXT PRIMARY KEY, name TEXT, network TEXT, operator TEXT, railway TEXT, highway TEXT, public_transport TEXT, lat REAL, lon REAL,
+			 mode TEXT, type TEXT, ref TEXT, ref_key TEXT, assumed_platform TEXT, empty_name INTEGER, kerb_approach_aid TEXT, wheelchair TEXT, tactile_paving TEXT)''')
+		db.execute('CREATE TABLE osm_stop_area_members (stop_area_id TEXT, member_id TEXT)')
+		db.execute('CREATE TABLE platform_nodes (way_id TEXT, node_id TEXT)')
+
+		ids = []
+		for i in range(2000):
+			osm_id = rnd.choice('nw') + str(i)
+			ids.append(osm_id)
+			# a coarse lattice provokes stops exactly at the vicinity border
+			lat = 48.0 + rnd.randrange(10) * 0.005 + rnd.choice([0, 0.00005, 0.0001, 0.0037])
+			lon = 9.0 + rnd.randrange(10) * 0.005 + rnd.choice([0, 0.00005, 0.0001, 0.0037])
+			db.execute('INSERT INTO osm_stops VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', (osm_id,
+				rnd.choice(['Hauptbahnhof', 'Rathaus', 'Markt', None]), None, None,
+				rnd.choice(['tram_stop', 'halt', 'stop', None]), rnd.choice(['bus_stop', None]),
+				rnd.choice(['stop_position', 'platform', 'station', None]),
+				lat, lon,
+				rnd.choice(['bus', 'tram', 'train', 'light_rail', 'trainish', None]),
+				rnd.choice(['stop', 'platform', 'halt', 'station', None]),
+				rnd.choice(['1', '2', None]), rnd.choice(['ref:IFOPT', 'ref', None]),
+				None, 0, None, None, None))
+		for i in range(300):
+			db.execute('INSERT INTO platform_nodes VALUES (?,?)', (rnd.choice(ids), rnd.choice(ids)))
+		for i in range(300):
+			db.execute('INSERT INTO osm_stop_area_members VALUES (?,?)', ('r' + str(rnd.randrange(60)), rnd.choice(ids)))
+		db.commit()
+		return db
+
+	def retained_ids(self, db):
+		return sorted(row[0] for row in db.execute('SELECT osm_id FROM osm_stops'))
+
+	def test_prune__deletes_same_stops_as_sql(self):
+		for seed in range(3):
+			expected_db = self.random_db(seed)
+			importer = OsmStopsImporter.__new__(OsmStopsImporter)
+			importer.db = expected_db
+			importer.logger = logging.getLogger('osm_stop_matcher.OsmStopsImporter')
+			importer.only_keep_more_specific_stops_for_matching_in_db()
+
+			actual_db = self.random_db(seed)
+			OsmStopsPruner(actual_db).prune()
+
+			expected = self.retained_ids(expected_db)
+			self.assertLess(len(expected), 2000)
+			self.assertEqual(self.retained_ids(actual_db), expected)
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import unittest
+
+import spatialite
+
+from osm_stop_matcher.OsmStopsImporter import OsmStopsImporter
+from osm_stop_matcher.RegionScope import RegionScope
+from osm_stop_matcher.StatisticsUpdater import StatisticsUpdater
+
+STOPS_OSM = os.path.join(os.path.dirname(__file__), 'data', 'stops.osm')
+
+class RegionScopeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.db = sqlite3.connect(':memory:')
+		self.db.execute("CREATE TABLE haltestellen_unified (globaleID TEXT, lat REAL, lon REAL, Haltestelle TEXT)")
+		self.db.execute("INSERT INTO haltestellen_unified VALUES ('de:08111:1', 48.7, 9.1, 'Rathaus')")
+		self.db.execute("INSERT INTO haltestellen_unified VALUES ('de:08111:2', 48.8, 9.2, 'Markt')")
+		self.db.execute("INSERT INTO haltestellen_unified VALUES ('de:08221:3', 49.4, 8.7, 'Bismarckplatz')")
+		self.db.execute("INSERT INTO haltestellen_unified VALUES ('de:08221:4', NULL, NULL, 'Hbf')")
+
+	def test_stop_ids__of_prefix_and_bbox(self):
+		self.assertEqual(RegionScope('de:08111').stop_ids(self.db), {'de:08111:1', 'de:08111:2'})
+		self.assertEqual(RegionScope('de:08111', (9.0, 48.6, 9.15, 48.75)).stop_ids(self.db), {'de:08111:1'})
+		self.assertEqual(RegionScope(bbox = (8.0, 48.0, 9.0, 50.0)).stop_ids(self.db), {'de:08221:3'})
+
+	def test_restore_outside__keeps_rows_outside_of_scope(self):
+		scope = RegionScope(bbox = (9.0, 48.6, 9.15, 48.75))
+		(condition, params) = scope.stop_condition()
+		scope.keep_outside(self.db, 'haltestellen_unified', condition, params)
+
+		self.db.execute("DROP TABLE haltestellen_unified")
+		self.db.execute("CREATE TABLE haltestellen_unified (globaleID TEXT, lat REAL, lon REAL, Haltestelle TEXT)")
+		self.db.execute("INSERT INTO haltestellen_unified VALUES ('de:08111:1', 48.7, 9.1, 'Rathausplatz')")
+		self.db.execute("INSERT INTO haltestellen_unified VALUES ('de:08111:2', 48.8, 9.2, 'Marktplatz')")
+		scope.restore_outside(self.db, 'haltestellen_unified', condition, params, 'globaleID')
+
+		rows = self.db.execute("SELECT globaleID, Haltestelle FROM haltestellen_unified ORDER BY globaleID").fetchall()
+		self.assertEqual(rows, [('de:08111:1', 'Rathausplatz'), ('de:08111:2', 'Markt'), ('de:08221:3', 'Bismarckplatz'), ('de:08221:4', 'Hbf')])
+
+	def test_restore_outside__keeps_rows_outside_of_scope_across_bulk_loading_import(self):
+		db = spatialite.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		OsmStopsImporter(db, STOPS_OSM)
+		db.execute("INSERT INTO osm_stops (osm_id, name, lat, lon) VALUES ('n99', 'Fernbahnhof', 50.0, 10.0)")
+		db.execute("UPDATE osm_stops SET name='Rathaus alt' WHERE osm_id='n1'")
+		db.commit()
+
+		# the scope's osm bounds cover n1, n9 and w20, but not n12 or n99
+		scope = RegionScope(bbox = (9.09, 48.69, 9.115, 48.715))
+		(condition, params) = scope.osm_condition(scope.osm_bounds(db))
+		scope.keep_outside(db, 'osm_stops', condition, params)
+		# OsmStopsImporter loads via BulkLoader, whose pragmas drop temp tables
+		OsmStopsImporter(db, STOPS_OSM)
+		scope.restore_outside(db, 'osm_stops', condition, params, 'osm_id')
+
+		rows = db.execute("SELECT osm_id, name FROM osm_stops ORDER BY osm_id").fetchall()
+		self.assertEqual([tuple(row) for row in rows], [('n1', 'Rathaus'), ('n11', 'Bahnhof Nord'), ('n12', None), ('n9', 'Markt 2'),
+			('n99', 'Fernbahnhof'), ('w20', 'Markt'), ('w21', 'Bahnhof')])
+		self.assertIsNone(db.execute("SELECT name FROM sqlite_master WHERE name='scope_outside_osm_stops'").fetchone())
+
+	def test_update_match_statistics__of_scoped_run_cover_all_districts_and_are_labelled(self):
+		self.db.execute("ALTER TABLE haltestellen_unified ADD COLUMN Haltestelle_lang TEXT")
+		self.db.execute("ALTER TABLE haltestellen_unified ADD COLUMN parent TEXT")
+		self.db.execute("ALTER TABLE haltestellen_unified ADD COLUMN linien TEXT")
+		self.db.execute("ALTER TABLE haltestellen_unified ADD COLUMN match_state TEXT")
+		self.db.execute("UPDATE haltestellen_unified SET linien = '1', match_state = 'MATCHED'")
+		self.db.execute("CREATE TABLE osm_stops (osm_id TEXT, name TEXT, empty_name INTEGER, lat REAL, lon REAL, match_state TEXT)")
+		self.db.execute("CREATE TABLE matches (ifopt_id TEXT, osm_id TEXT, rating REAL, distance REAL, name_distance REAL, successor_rating INTEGER)")
+		self.db.execute("INSERT INTO matches VALUES ('de:08111:2', 'n1', 0.9, 10, 1.0, 0)")
+
+		scope = RegionScope('de:08111')
+		scope.prepare(self.db)
+		StatisticsUpdater(self.db, scope).update_match_statistics({'osm_timestamp': '2026-01-01'})
+		StatisticsUpdater(self.db).update_match_statistics({})
+
+		stats = self.db.execute("SELECT district, key, value FROM match_stats WHERE run_id = 1 ORDER BY district, key").fetchall()
+		self.assertEqual(stats, [('de:08111', 'MATCHED', 1), ('de:08111', 'NO_MATCH', 1), ('de:08221', 'MATCHED', 2)])
+		metadata = self.db.execute("SELECT run_id, key, value FROM match_meta_data ORDER BY run_id, key").fetchall()
+		self.assertEqual(metadata, [(1, 'osm_timestamp', '2026-01-01'), (1, 'scope', 'de:08111'), (2, 'osm_timestamp', '2026-01-01')])
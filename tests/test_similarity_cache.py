@@ -0,0 +1,26 @@
+import unittest
+
+import ngram
+
+from osm_stop_matcher.SimilarityCache import LruCache, SimilarityCache
+
+class SimilarityCacheTest(unittest.TestCase):
+
+	def test_get__evicts_least_recently_used(self):
+		cache = LruCache(2)
+		cache.get('a', lambda: 1)
+		cache.get('b', lambda: 2)
+		cache.get('a', lambda: None)
+		cache.get('c', lambda: 3)
+
+		self.assertEqual(list(cache.entries), ['a', 'c'])
+		(hits, misses, entries, size_in_bytes) = cache.stats()
+		self.assertEqual((hits, misses, entries), (1, 3, 2))
+		self.assertGreater(size_in_bytes, 0)
+
+	def test_similarity__equals_ngram_compare(self):
+		cache = SimilarityCache()
+		for (name, other_name) in [('Rathaus', 'Rathausplatz'), ('Rathausplatz', 'Rathaus'), (None, 'Markt'), ('Markt', 'Markt')]:
+			self.assertEqual(cache.similarity(name, other_name), ngram.NGram.compare(name, other_name, N=1))
+			self.assertEqual(cache.similarity(name, other_name), ngram.NGram.compare(name, other_name, N=1))
+		self.assertEqual(cache.similarities.stats()[:3], (4, 4, 4))
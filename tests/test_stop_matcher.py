@@ -1,9 +1,47 @@
+import random
+import sqlite3
 import unittest
+from unittest.mock import patch
 
+import numpy as np
+import spatialite
+
+from osm_stop_matcher import config
+from osm_stop_matcher.CandidateBatch import CandidateBatch
+from osm_stop_matcher.ModeRater import ModeRater
+from osm_stop_matcher.PlatformRater import PlatformRater
+from osm_stop_matcher.Rater import Rater, TableRater
+from osm_stop_matcher.MatchFingerprints import MatchFingerprints
+from osm_stop_matcher.MatchPicker import MatchPicker
 from osm_stop_matcher.StopMatcher import StopMatcher
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     
+NAMES = ['Rathaus', 'Bahnhof', 'Marktplatz', 'Schule', 'Kirche', 'Post', 'Friedhof', 'Lindenstraße']
+
+def create_matching_db(seed, stop_count, osm_stop_count):
+	"""
+	Returns a db with random official and osm stops named alike, located within ~1 km
+	"""
+	rnd = random.Random(seed)
+	db = spatialite.connect(':memory:')
+	db.row_factory = sqlite3.Row
+	for (table, columns) in [('haltestellen_unified', MatchFingerprints.STOP_COLUMNS), ('osm_stops', MatchFingerprints.OSM_STOP_COLUMNS)]:
+		db.execute("CREATE TABLE {} ({})".format(table, ', '.join(column + (' REAL' if column in ['lat', 'lon'] else ' TEXT') for column in columns)))
+	for i in range(stop_count):
+		name = rnd.choice(NAMES)
+		# every third stop is a parent station without quais, the others are quais of the previous one
+		stop_id = 'de:8111:{}'.format(i // 3) if i % 3 == 0 else 'de:8111:{}:1:{}'.format(i // 3, i % 3)
+		db.execute("INSERT INTO haltestellen_unified VALUES (?,?,?,?,?,?,?,?,?,?)", (stop_id,
+			48.7 + rnd.random() * 0.01, 9.1 + rnd.random() * 0.01, rnd.choice(['bus', 'train', 'tram', None]), name, 'Stuttgart ' + name,
+			rnd.choice(['Ri ' + rnd.choice(NAMES), 'Steig 1', None]), None, 'Stuttgart', rnd.choice(['1', '2', None])))
+	for i in range(osm_stop_count):
+		db.execute("INSERT INTO osm_stops VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", ('n{}'.format(i),
+			48.7 + rnd.random() * 0.01, 9.1 + rnd.random() * 0.01, rnd.choice(NAMES + [None]), None, None,
+			rnd.choice(['bus', 'trainish', 'tram', None]), rnd.choice(['platform', 'stop', 'station']), None, None,
+			rnd.choice(NAMES + [None]), rnd.choice(NAMES + [None]), rnd.choice(['1', '2', None])))
+	return db
+
 class StopMatcherTest(unittest.TestCase):
 	
 	def _do_test_rate_platform(self, official_platform_code, osm_assumed_platform_code, expected):
@@ -48,6 +86,83 @@ class StopMatcherTest(unittest.TestCase):
 		self._do_test_rate_successor("Idstein", "Idstein-Wörsdorf ", "Ri Idstein Bahnhof", "Bad Camberg", "Idstein", 0)
 		self._do_test_rate_successor("Crailsheim", "Alexandersreut ", "Ri Jagstheim Burgbergsiedlung/Jagstheim Degenbachsee/Weipertshofen Siedlung", "Ingersheim Bildstraße", "Degenbachsee", -1)
 
+	def test_filter_candidates(self):
+		matcher = StopMatcher(None)
+		# ~111 m, ~0 m, ~1112 m, again ~111 m and ~222 m north of 48.0, 9.0
+		matcher.osm_lats = np.array([48.001, 48.0, 48.01, 48.001, 48.002])
+		matcher.osm_lons = np.array([9.0, 9.0, 9.0, 9.0, 9.0])
+		matcher.osm_rail_modes = np.array([True, False, False, False, False])
+		matcher.osm_bus_modes = np.array([False, True, False, True, False])
+		stops = [
+			{"lat": "48.0", "lon": "9.0", "mode": "bus", "bus_or_train_station": 0},
+			{"lat": "48.0", "lon": "9.0", "mode": "train", "bus_or_train_station": 0}
+		]
+		candidate_ids = np.array([0, 1, 2, 3, 4, 4, 3, 2, 1, 0])
+		stop_indexes = np.array([0, 0, 0, 0, 0, 1, 1, 1, 1, 1])
+
+		with patch.object(config, 'MAX_EVALUATED_CANDIDATES_OTHER_STOPS', 2):
+			(candidate_ids, stop_indexes, distances) = matcher.filter_candidates(stops, candidate_ids, stop_indexes)
+
+		# rail candidates for bus stops, bus candidates for train stops and candidates beyond MAXIMUM_DISTANCE are dropped,
+		# the nearest two remaining per stop are retained
+		self.assertEqual(candidate_ids.tolist(), [1, 3, 0, 4])
+		self.assertEqual(stop_indexes.tolist(), [0, 0, 1, 1])
+		self.assertAlmostEqual(distances[1], 111.2, places = 1)
+
+	def test_table_raters__rate_batch_equals_rate(self):
+		stops = [{"mode": mode, "platform_code": platform} for mode in ['bus', 'train', None] for platform in ['1', '', None]]
+		candidates = [{"mode": mode, "assumed_platform": platform} for mode in ['bus', 'trainish', 'tram', None] for platform in ['1', '2', 1, None]]
+		stop_indexes = np.repeat(np.arange(len(stops)), len(candidates))
+		candidate_ids = np.tile(np.arange(len(candidates)), len(stops))
+		batch = CandidateBatch(stops, candidate_ids, stop_indexes, np.zeros(len(candidate_ids)), candidates)
+		for rater in [ModeRater(), PlatformRater()]:
+			rater.prepare(candidates)
+			expected = [rater.rate(stop, candidate) for (stop, candidate) in batch.pairs()]
+			self.assertEqual(rater.rate_batch(batch).tolist(), expected)
+
+	def test_raters__missing_rating_methods_fail_at_instantiation(self):
+		class UnratingRater(Rater):
+			pass
+		class ValuelessTableRater(TableRater):
+			def rate_values(self, stop_value, candidate_value):
+				return 1.0
+			def stop_value(self, stop):
+				return stop["mode"]
+
+		for rater_class in [UnratingRater, ValuelessTableRater]:
+			with self.assertRaises(TypeError):
+				rater_class()
+
+	def test_parallel_matching__equals_serial_matching(self):
+		candidates = []
+		for processes in [1, 2]:
+			db = create_matching_db(1, 200, 400)
+			matcher = StopMatcher(db, processes = processes)
+			with patch.object(config, 'MATCH_BATCH_SIZE', 16):
+				matcher.export_match_candidates(matcher.rated_candidates())
+			candidates.append(sorted(tuple(row) for row in db.execute("SELECT * FROM candidates")))
+
+		self.assertGreater(len(candidates[0]), 200)
+		self.assertEqual(candidates[1], candidates[0])
+
+	def test_match_stops_with_picker__equals_separate_match_and_pick(self):
+		matches = []
+		for (combined, processes) in [(False, 1), (True, 1), (True, 2)]:
+			db = create_matching_db(2, 200, 400)
+			picker = MatchPicker(db, processes = processes)
+			with patch.object(config, 'MATCH_BATCH_SIZE', 16), patch.object(config, 'PICK_COMPONENT_MAX_STOPS', 20):
+				if combined:
+					StopMatcher(db, processes = processes).match_stops(picker = picker)
+				else:
+					StopMatcher(db, processes = processes).match_stops()
+					picker.pick_matches()
+			self.assertFalse(db.in_transaction)
+			matches.append(sorted(tuple(row) for row in db.execute("SELECT * FROM matches")))
+
+		self.assertGreater(len(matches[0]), 50)
+		self.assertEqual(matches[1], matches[0])
+		self.assertEqual(matches[2], matches[0])
+
 # Execute e.g. via python3 -m unittest tests/test_stop_matcher.py
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
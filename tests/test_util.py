@@ -0,0 +1,42 @@
+import sqlite3
+import struct
+import unittest
+
+import spatialite
+
+from osm_stop_matcher.util import spatialite_line
+
+def has_spatialite_functions(db):
+	try:
+		db.execute("SELECT spatialite_version()")
+		return True
+	except sqlite3.OperationalError:
+		return False
+
+class UtilTest(unittest.TestCase):
+
+	def setUp(self):
+		self.db = spatialite.connect(':memory:')
+
+	def test_spatialite_line__unpacks_to_blob_geometry_fields(self):
+		blob = spatialite_line(9.2, 48.8, 9.1, 48.7, 4326)
+
+		self.assertEqual(len(blob), 80)
+		(start, endian, srid, min_x, min_y, max_x, max_y, mbr_end, geometry_class, point_count,
+			x1, y1, x2, y2, end) = struct.unpack('<BBi4dBii4dB', blob)
+		self.assertEqual((start, endian, srid, mbr_end, geometry_class, point_count, end), (0x00, 0x01, 4326, 0x7C, 2, 2, 0xFE))
+		self.assertEqual((min_x, min_y, max_x, max_y), (9.1, 48.7, 9.2, 48.8))
+		self.assertEqual((x1, y1, x2, y2), (9.2, 48.8, 9.1, 48.7))
+
+	def test_spatialite_line__equals_line_from_text(self):
+		if not has_spatialite_functions(self.db):
+			self.skipTest("mod_spatialite is not available")
+		for (x1, y1, x2, y2) in [(9.2, 48.8, 9.1, 48.7), (9.123456789, 48.1, 9.123456789, 48.2)]:
+			blob = spatialite_line(x1, y1, x2, y2)
+			expected = self.db.execute("SELECT LineFromText(?, 4326)", ['LINESTRING({} {}, {} {})'.format(x1, y1, x2, y2)]).fetchone()[0]
+			self.assertEqual(blob, expected)
+			self.assertEqual(self.db.execute("SELECT AsText(?), SRID(?)", [blob, blob]).fetchone(),
+				('LINESTRING({} {}, {} {})'.format(x1, y1, x2, y2), 4326))
+
+if __name__ == '__main__':
+	unittest.main()